@@ -0,0 +1,65 @@
+import gzip
+import logging
+
+import brotli
+import structlog
+from flask import current_app, request
+
+from application.metrics import (
+    COMPRESSED_RESPONSES,
+    COMPRESSION_COMPRESSED_BYTES,
+    COMPRESSION_ORIGINAL_BYTES,
+)
+
+log = structlog.wrap_logger(logging.getLogger(__name__))
+
+COMPRESSIBLE_MIMETYPES = {"application/json"}
+GZIP_LEVEL = 6
+# Brotli's quality 11 default is far too slow to do per response
+BROTLI_QUALITY = 4
+# In order of preference, for clients that accept more than one
+ENCODERS = {
+    "br": lambda data: brotli.compress(data, quality=BROTLI_QUALITY),
+    "gzip": lambda data: gzip.compress(data, compresslevel=GZIP_LEVEL),
+}
+
+
+def compress_response(response):
+    """
+    An after_request hook that compresses JSON responses of at least RESPONSE_COMPRESSION_MIN_SIZE bytes with the
+    best encoding the client accepts, brotli or gzip. Streamed responses, which are sent as they are
+    produced, and anything that isn't JSON (e.g. xlsx downloads, which are already compressed) are left alone.
+
+    :param response: The response to compress
+    :return: the response
+    """
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < current_app.config["RESPONSE_COMPRESSION_MIN_SIZE"]:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(list(ENCODERS))
+    if encoding is None:
+        return response
+
+    compressed = ENCODERS[encoding](data)
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    # The compressed body is a different representation, so its ETag can only be weak
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    COMPRESSED_RESPONSES.labels(encoding).inc()
+    COMPRESSION_ORIGINAL_BYTES.labels(encoding).inc(len(data))
+    COMPRESSION_COMPRESSED_BYTES.labels(encoding).inc(len(compressed))
+    log.debug("Compressed response", encoding=encoding, original_size=len(data), compressed_size=len(compressed))
+    return response
@@ -1,24 +1,45 @@
 import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from json import loads
+from uuid import UUID
 
 import structlog
 from flask import current_app
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 
-from application.controllers.helper import validate_uuid
+from application.controllers.helper import (
+    is_valid_file_extension,
+    is_valid_file_name_length,
+    validate_uuid,
+)
+from application.controllers.search_cache import (
+    get_search_cache,
+    invalidate_exercise_links_on_commit,
+    invalidate_instruments_on_commit,
+)
 from application.controllers.service_helper import get_survey_details, service_request
-from application.controllers.session_decorator import with_db_session
+from application.controllers.session_decorator import (
+    with_db_session,
+    with_db_session_generator,
+)
 from application.controllers.sql_queries import (
     delete_registry_instrument_by_exercise_id_and_instrument_id,
     query_business_by_ru,
+    query_businesses_by_ru_refs,
     query_exercise_by_id,
+    query_exercise_with_instruments_by_id,
     query_instrument,
     query_instrument_by_id,
+    query_instrument_summaries_by_ids,
     query_instruments_form_type_with_different_survey_mode,
+    query_registry_instruments_by_exercise_id,
+    query_ru_refs_with_instrument_for_exercise,
+    query_seft_file_names_for_exercise,
     query_survey_by_id,
 )
 from application.exceptions import GCPBucketException, RasError
-from application.models.google_cloud_bucket import GoogleCloudSEFTCIBucket
+from application.models.google_cloud_bucket import GoogleCloudSEFTCIBucket, digest_file
 from application.models.models import (
     BusinessModel,
     ExerciseModel,
@@ -35,6 +56,10 @@ COLLECTION_EXERCISE_AND_ASSOCIATED_FILES_DELETED = (
     "Collection exercise and instruments successfully deleted from database and GCP (if applicable)"
 )
 
+BULK_UPLOAD_UPLOADED = "UPLOADED"
+BULK_UPLOAD_REJECTED = "REJECTED"
+BULK_UPLOAD_FAILED = "FAILED"
+
 
 class CollectionInstrument(object):
     @with_db_session
@@ -55,29 +80,68 @@ class CollectionInstrument(object):
         else:
             json_search_parameters = {}
 
+        search_cache = get_search_cache()
+        if search_cache.enabled:
+            cache_key = search_cache.key(json_search_parameters, limit)
+            result = search_cache.get(cache_key)
+            if result is not None:
+                log.info("Search served from cache", search_string=search_string)
+                return result
+
         instruments = self._get_instruments_by_classifier(json_search_parameters, limit, session)
 
         result = []
         for instrument in instruments:
-            classifiers = instrument.classifiers or {}
-
-            # Leaving these as empty lists for now. Before it would loop over the instrument.businesses and
-            # instrument.exercises and populate the lists.  We're almost certain nothing uses this, or the 'classifiers'
-            # key in the instrument_json at all.  If this proves to be the case after we deploy this change then we can
-            # fully remove it in a future PR
-            ru = {"RU_REF": []}
-            collection_exercise = {"COLLECTION_EXERCISE": []}
-
-            instrument_json = {
-                "id": instrument.instrument_id,
-                "file_name": instrument.name,
-                "type": instrument.type,
-                "classifiers": {**classifiers, **ru, **collection_exercise},
-                "surveyId": instrument.survey.survey_id,
-            }
-            result.append(instrument_json)
+            result.append(self._search_result_json(instrument))
+        if search_cache.enabled:
+            search_cache.put(cache_key, result)
         return result
 
+    @with_db_session_generator
+    def stream_instrument_by_search_string(self, search_string=None, limit=None, session=None):
+        """
+        Get Instrument from the db using the search string passed, one at a time through a server side cursor so a
+        large result is never all in memory
+
+        :param search_string: Classifiers to filter on
+        :param limit: the amount of records to return
+        :param session: database session
+        :return: generator of matching records
+        """
+
+        log.info("Streaming search for instrument", search_string=search_string)
+
+        if search_string:
+            json_search_parameters = loads(search_string)
+        else:
+            json_search_parameters = {}
+
+        query = self._build_search_query(json_search_parameters, session).options(joinedload(InstrumentModel.survey))
+        if limit:
+            query = query.limit(limit)
+
+        for instrument in query.yield_per(current_app.config["INSTRUMENT_SEARCH_YIELD_PER"]):
+            yield self._search_result_json(instrument)
+
+    @staticmethod
+    def _search_result_json(instrument):
+        classifiers = instrument.classifiers or {}
+
+        # Leaving these as empty lists for now. Before it would loop over the instrument.businesses and
+        # instrument.exercises and populate the lists.  We're almost certain nothing uses this, or the 'classifiers'
+        # key in the instrument_json at all.  If this proves to be the case after we deploy this change then we can
+        # fully remove it in a future PR
+        ru = {"RU_REF": []}
+        collection_exercise = {"COLLECTION_EXERCISE": []}
+
+        return {
+            "id": instrument.instrument_id,
+            "file_name": instrument.name,
+            "type": instrument.type,
+            "classifiers": {**classifiers, **ru, **collection_exercise},
+            "surveyId": instrument.survey.survey_id,
+        }
+
     @with_db_session
     def upload_seft_to_bucket(self, exercise_id, file, ru_ref=None, classifiers=None, session=None):
         """
@@ -120,17 +184,161 @@ class CollectionInstrument(object):
         instrument.exercises.append(exercise)
         instrument.survey = survey
         session.add(instrument)
+        invalidate_instruments_on_commit(session, [survey_id], [exercise_id])
 
         try:
             file.filename = survey_service_details["surveyRef"] + "/" + exercise_id + "/" + file.filename
             seft_ci_bucket = GoogleCloudSEFTCIBucket(current_app.config)
-            seft_ci_bucket.upload_file_to_bucket(file=file)
+            digest = seft_ci_bucket.upload_file_to_bucket(file=file)
         except Exception as e:
             log.exception("An error occurred when trying to put SEFT CI in bucket")
             raise e
+        self._set_seft_file_digest(seft_file, digest)
 
         return instrument
 
+    @with_db_session
+    def bulk_upload_seft_to_bucket(self, exercise_id, files, classifiers=None, session=None):
+        """
+        Validate, upload and store a set of reporting unit specific SEFT collection instruments for an exercise.
+
+        The survey and exercise are looked up once, the files are validated together with batched queries, the
+        valid ones are uploaded to the bucket in parallel (bounded by BULK_UPLOAD_MAX_WORKERS) and all the new
+        instruments are committed in the one transaction. Files that fail validation or upload are reported and
+        skipped, they don't stop the rest of the set.
+
+        :param exercise_id: An exercise id (UUID)
+        :param files: A list of (file, ru_ref) tuples, where file is a FileStorage object
+        :param classifiers: Classifiers associated with every instrument
+        :param session: database session
+        :return: a list of per-file results, in the order the files were given
+        """
+        log.info("Bulk upload instruments", exercise_id=exercise_id, file_count=len(files))
+
+        validate_uuid(exercise_id)
+        survey = self._find_or_create_survey_from_exercise_id(exercise_id, session)
+        survey_service_details = get_survey_details(survey.survey_id)
+        if survey_service_details["surveyMode"] == "EQ_AND_SEFT":
+            raise RasError("Can't upload a reporting unit specific instrument for an EQ_AND_SEFT survey", 400)
+        if classifiers:
+            classifiers = loads(classifiers)
+
+        results = self._validate_bulk_seft_files(exercise_id, files, session)
+        valid = [(file, ru_ref, result) for (file, ru_ref), result in zip(files, results) if not result["errors"]]
+        if not valid:
+            log.info("No valid files in bulk upload", exercise_id=exercise_id)
+            return results
+
+        exercise = self._find_or_create_exercise(exercise_id, session)
+        businesses = {}
+        for business in query_businesses_by_ru_refs([ru_ref for _, ru_ref, _ in valid], session):
+            businesses.setdefault(business.ru_ref, business)
+
+        instruments = []
+        for file, ru_ref, result in valid:
+            instrument = InstrumentModel(ci_type="SEFT")
+            instrument.classifiers = classifiers
+            instrument.seft_file = self._create_seft_file(instrument.instrument_id, file)
+            file.filename = survey_service_details["surveyRef"] + "/" + exercise_id + "/" + file.filename
+            instruments.append(instrument)
+
+        seft_ci_bucket = GoogleCloudSEFTCIBucket(current_app.config)
+        uploads = self._upload_files_to_bucket(seft_ci_bucket, [file for file, _, _ in valid])
+
+        for (file, ru_ref, result), instrument, (digest, error) in zip(valid, instruments, uploads):
+            if error:
+                result["status"] = BULK_UPLOAD_FAILED
+                result["errors"].append(error)
+                continue
+            self._set_seft_file_digest(instrument.seft_file, digest)
+            # Only once it's uploaded, as attaching an existing business would cascade the instrument into the session
+            instrument.businesses.append(businesses.get(ru_ref) or BusinessModel(ru_ref=ru_ref))
+            instrument.exercises.append(exercise)
+            instrument.survey = survey
+            session.add(instrument)
+            result["status"] = BULK_UPLOAD_UPLOADED
+            result["instrument_id"] = str(instrument.instrument_id)
+        invalidate_instruments_on_commit(session, [survey.survey_id], [exercise_id])
+
+        log.info(
+            "Bulk upload complete",
+            exercise_id=exercise_id,
+            uploaded=sum(result["status"] == BULK_UPLOAD_UPLOADED for result in results),
+            not_uploaded=sum(result["status"] != BULK_UPLOAD_UPLOADED for result in results),
+        )
+        return results
+
+    @staticmethod
+    def _validate_bulk_seft_files(exercise_id, files, session):
+        """
+        Validates a set of reporting unit specific SEFT files for an exercise, checking the set against itself and
+        against what is already uploaded with one query per rule rather than one per file
+
+        :param exercise_id: An exercise id (UUID)
+        :param files: A list of (file, ru_ref) tuples
+        :param session: database session
+        :return: a list of result dicts, one per file, with any validation errors
+        """
+        config = current_app.config
+        max_ru_ref_length = BusinessModel.ru_ref.type.length
+        file_names = Counter(file.filename for file, _ in files)
+        ru_refs = Counter(ru_ref for _, ru_ref in files)
+        uploaded_file_names = query_seft_file_names_for_exercise(exercise_id, list(file_names), session)
+        ru_refs_with_instrument = query_ru_refs_with_instrument_for_exercise(
+            exercise_id, [ru_ref for ru_ref in ru_refs if ru_ref], session
+        )
+
+        results = []
+        for file, ru_ref in files:
+            errors = []
+            if not is_valid_file_extension(file.filename, config["UPLOAD_FILE_EXTENSIONS"]):
+                errors.append(f"File must be one of {config['UPLOAD_FILE_EXTENSIONS']}")
+            if not is_valid_file_name_length(file.filename, config["MAX_UPLOAD_FILE_NAME_LENGTH"]):
+                errors.append(f"File name is longer than {config['MAX_UPLOAD_FILE_NAME_LENGTH']} characters")
+            if not ru_ref:
+                errors.append("No reporting unit for file")
+            elif len(ru_ref) > max_ru_ref_length:
+                # Caught here, as otherwise it fails the commit after every file has been uploaded
+                errors.append(f"Reporting unit {ru_ref} is longer than {max_ru_ref_length} characters")
+            if file.filename in uploaded_file_names or file_names[file.filename] > 1:
+                errors.append("Collection instrument file already uploaded for this collection exercise")
+            if ru_ref and (ru_ref in ru_refs_with_instrument or ru_refs[ru_ref] > 1):
+                errors.append(
+                    f"Reporting unit {ru_ref} already has an instrument uploaded for this collection exercise"
+                )
+            results.append(
+                {
+                    "file_name": file.filename,
+                    "ru_ref": ru_ref,
+                    "status": BULK_UPLOAD_REJECTED if errors else None,
+                    "errors": errors,
+                }
+            )
+        return results
+
+    @staticmethod
+    def _upload_files_to_bucket(seft_ci_bucket, files):
+        """
+        Uploads files to the bucket in parallel, with at most BULK_UPLOAD_MAX_WORKERS uploads in flight
+
+        :param seft_ci_bucket: The bucket to upload to
+        :param files: The files to upload, with their bucket path as the filename
+        :return: a list the same length as files, holding a (digest, error) tuple for each, where one of them is None
+        """
+        app = current_app._get_current_object()
+
+        def upload(file):
+            with app.app_context():
+                try:
+                    return seft_ci_bucket.upload_file_to_bucket(file=file), None
+                except Exception as e:
+                    log.exception("An error occurred when trying to put SEFT CI in bucket", file_name=file.filename)
+                    return None, f"Failed to upload file: {e}"
+
+        max_workers = min(int(app.config["BULK_UPLOAD_MAX_WORKERS"]), len(files))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(upload, files))
+
     @staticmethod
     def validate_eq_and_seft_form_type(survey_id: str, form_type: str, survey_mode: str, session: Session) -> None:
         """
@@ -192,6 +400,7 @@ class CollectionInstrument(object):
 
         seft_model = self._update_seft_file(instrument.seft_file, file, survey_ref, exercise_id)
         session.add(seft_model)
+        invalidate_instruments_on_commit(session, [instrument.survey.survey_id], instrument.exids)
 
     @staticmethod
     def validate_one_instrument_for_ru_specific_upload(exercise, business, session):
@@ -270,6 +479,7 @@ class CollectionInstrument(object):
 
             instrument.classifiers = deserialized_classifiers
         session.add(instrument)
+        invalidate_instruments_on_commit(session, [survey.survey_id])
         return instrument
 
     @with_db_session
@@ -302,6 +512,7 @@ class CollectionInstrument(object):
             delete_registry_instrument_by_exercise_id_and_instrument_id(exercise_id, instrument_id, session)
             log.info("Collection and registry instrument deleted", instrument=instrument_id, exercise_id=exercise_id)
 
+        invalidate_exercise_links_on_commit(session, [exercise_id])
         log.info("Collection instruments updated successfully", instruments=instruments, exercise_id=exercise_id)
 
         return bool(instruments_to_add or instruments_to_remove)
@@ -323,6 +534,7 @@ class CollectionInstrument(object):
         instrument = self.get_instrument_by_id(instrument_id, session)
         exercise = self._find_or_create_exercise(exercise_id, session)
         instrument.exercises.append(exercise)
+        invalidate_exercise_links_on_commit(session, [exercise_id])
 
         log.info("Successfully linked instrument to exercise", instrument_id=instrument_id, exercise_id=exercise_id)
         return True
@@ -356,6 +568,7 @@ class CollectionInstrument(object):
             )
 
         instrument.exercises.remove(exercise)
+        invalidate_exercise_links_on_commit(session, [exercise_id])
         bound_logger.info("Successfully unlinked instrument to exercise")
         return True
 
@@ -372,6 +585,7 @@ class CollectionInstrument(object):
             raise RasError(f"Collection instrument {instrument_id} not found", 404)
 
         session.delete(instrument)
+        invalidate_instruments_on_commit(session, [instrument.survey.survey_id], instrument.exids)
 
         if instrument.type == "SEFT":
             gcs_seft_bucket = GoogleCloudSEFTCIBucket(current_app.config)
@@ -390,6 +604,7 @@ class CollectionInstrument(object):
             return COLLECTION_EXERCISE_NOT_FOUND_IN_DB, 404
 
         session.delete(exercise)
+        invalidate_exercise_links_on_commit(session, [ce_id])
 
         if exercise.seft_instrument_in_exercise:
             survey_id = exercise.instruments[0].survey.survey_id
@@ -487,38 +702,47 @@ class CollectionInstrument(object):
     @staticmethod
     def _create_seft_file(instrument_id, file):
         """
-        Creates a seft_file with an encrypted version of the file
+        Creates a seft_file for the file, its length is set once the file has been streamed to the bucket
         :param file: A file object from which we can read the file contents
         :return: instrument
         """
         log.info("creating instrument seft file")
-        file_contents = file.read()
-        file_size = len(file_contents)
-        seft_file = SEFTModel(instrument_id=instrument_id, file_name=file.filename, length=file_size)
+        seft_file = SEFTModel(instrument_id=instrument_id, file_name=file.filename)
 
         return seft_file
 
+    @staticmethod
+    def _set_seft_file_digest(seft_file, digest):
+        """Records the length and digests of a file, as computed while it was uploaded, on its seft_file"""
+        seft_file.len = digest.length
+        seft_file.crc32c = digest.crc32c
+        seft_file.md5_hash = digest.md5_hash
+
     @staticmethod
     def _update_seft_file(seft_model, file, survey_ref, exercise_id):
         """
-        Updates a seft_file with a new version of the data
+        Updates a seft_file with a new version of the data, unless it has the same name and content as the current one
 
         :param file: A file object from which we can read the file contents
         :return: instrument
         """
         log.info("Updating instrument seft file")
-        file_contents = file.read()
-        file_size = len(file_contents)
-        if file_size == 0:
+        digest = digest_file(file.stream, current_app.config["SEFT_UPLOAD_CHUNK_SIZE"])
+        if digest.length == 0:
             raise RasError("File is empty", 400)
-        seft_model.length = file_size
+        # Re-patching the same file is common, when the name and digests match there is nothing to replace
+        same_digest = (seft_model.crc32c, seft_model.md5_hash) == (digest.crc32c, digest.md5_hash)
+        if same_digest and file.filename == seft_model.file_name:
+            log.info("SEFT file is unchanged, not re-uploading it", file_name=file.filename)
+            return seft_model
         old_filename = seft_model.file_name
         seft_model.file_name = file.filename
         file.filename = survey_ref + "/" + exercise_id + "/" + file.filename
         old_filename = survey_ref + "/" + exercise_id + "/" + old_filename
         seft_ci_bucket = GoogleCloudSEFTCIBucket(current_app.config)
         seft_ci_bucket.delete_file_from_bucket(old_filename)
-        seft_ci_bucket.upload_file_to_bucket(file=file)
+        digest = seft_ci_bucket.upload_file_to_bucket(file=file, expected_digest=digest)
+        CollectionInstrument._set_seft_file_digest(seft_model, digest)
         return seft_model
 
     @with_db_session
@@ -556,6 +780,51 @@ class CollectionInstrument(object):
                 log.exception("Couldn't find SEFT CI in bucket")
         return csv
 
+    @with_db_session
+    def get_manifest_by_exercise_id(self, exercise_id, session=None):
+        """
+        Builds everything needed to render a collection exercise's instruments: each linked instrument with its SEFT
+        file details, ru_refs and the CIR instrument selected for it, from a fixed number of queries
+
+        :param exercise_id: An exercise id (UUID)
+        :param session: database session
+        :return: the manifest, or None if the exercise isn't found
+        """
+        log.info("Getting manifest for exercise", exercise_id=exercise_id)
+        validate_uuid(exercise_id)
+        exercise = query_exercise_with_instruments_by_id(exercise_id, session)
+        if not exercise:
+            return None
+
+        registry_instruments = [
+            registry_instrument.to_dict()
+            for registry_instrument in query_registry_instruments_by_exercise_id(exercise_id, session)
+        ]
+        selected = {
+            str(registry_instrument["instrument_id"]): registry_instrument
+            for registry_instrument in registry_instruments
+        }
+        instruments = []
+        for instrument in sorted(exercise.instruments, key=lambda instrument: instrument.stamp, reverse=True):
+            instruments.append(
+                {
+                    "id": instrument.instrument_id,
+                    "type": instrument.type,
+                    "file_name": instrument.name,
+                    "len": instrument.seft_file.len if instrument.seft_file else None,
+                    "stamp": instrument.stamp,
+                    "survey": instrument.survey.survey_id,
+                    "businesses": instrument.rurefs,
+                    "classifiers": instrument.classifiers,
+                    "registry_instrument": selected.get(str(instrument.instrument_id)),
+                }
+            )
+        return {
+            "exercise_id": exercise.exercise_id,
+            "instruments": instruments,
+            "registry_instrument_count": len(registry_instruments),
+        }
+
     @staticmethod
     @with_db_session
     def get_instrument_json(instrument_id, session):
@@ -567,10 +836,32 @@ class CollectionInstrument(object):
         :return: formatted JSON version of the instrument
         """
 
-        instrument = CollectionInstrument.get_instrument_by_id(instrument_id, session)
-        instrument_json = instrument.json if instrument else None
+        log.info("Searching for instrument", instrument_id=instrument_id)
+        validate_uuid(instrument_id)
+        instruments = query_instrument_summaries_by_ids([instrument_id], session)
+        instrument_json = instruments[0].json if instruments else None
         return instrument_json
 
+    @staticmethod
+    @with_db_session
+    def get_instruments_json_by_ids(instrument_ids, session):
+        """
+        Get the collection instrument json for each of a list of ids from the db, in one query
+
+        :param instrument_ids: The ids of the instruments we want
+        :param session: database session
+        :return: a dict of id to formatted JSON version of the instrument, and a list of the ids not found
+        """
+        log.info("Searching for instruments", count=len(instrument_ids))
+        validate_uuid(*instrument_ids)
+        instrument_ids = list(dict.fromkeys(str(UUID(instrument_id)) for instrument_id in instrument_ids))
+        instruments = {
+            str(instrument.instrument_id): instrument.json
+            for instrument in query_instrument_summaries_by_ids(instrument_ids, session)
+        }
+        not_found = [instrument_id for instrument_id in instrument_ids if instrument_id not in instruments]
+        return instruments, not_found
+
     @with_db_session
     def get_instrument_data(self, instrument_id, session):
         """
@@ -620,6 +911,21 @@ class CollectionInstrument(object):
         :return: query results
         """
 
+        result = self._build_search_query(json_search_parameters, session)
+
+        if limit:
+            return result.limit(limit)
+        return result.all()
+
+    def _build_search_query(self, json_search_parameters, session):
+        """
+        Builds the query for a search by classifiers, newest first
+
+        :param json_search_parameters: dict of (key, value) pairs to search on
+        :param session: database session
+        :return: query
+        """
+
         query = self._build_model_joins(json_search_parameters, session)
 
         for classifier, value in json_search_parameters.items():
@@ -633,11 +939,7 @@ class CollectionInstrument(object):
                 query = query.filter(InstrumentModel.type == value)
             else:
                 query = query.filter(InstrumentModel.classifiers.contains({classifier.lower(): value}))
-        result = query.order_by(InstrumentModel.stamp.desc())
-
-        if limit:
-            return result.limit(limit)
-        return result.all()
+        return query.order_by(InstrumentModel.stamp.desc())
 
     @staticmethod
     def _build_model_joins(json_search_parameters, session):
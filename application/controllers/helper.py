@@ -1,8 +1,21 @@
 import base64
+import io
+import json
+import posixpath
+import zipfile
+import zlib
+from tempfile import SpooledTemporaryFile
 from uuid import UUID
 
+from werkzeug.datastructures import FileStorage
+
 from application.exceptions import RasError
 
+ZIP_MANIFEST_FILE_NAME = "manifest.json"
+# Far more than a manifest for BULK_UPLOAD_MAX_FILES files needs
+MAX_MANIFEST_SIZE = 1024 * 1024
+UNZIP_CHUNK_SIZE = 64 * 1024
+
 
 def is_valid_file_extension(file_name, extensions):
     """
@@ -26,6 +39,107 @@ def is_valid_file_name_length(file_name, length):
     return len(file_name) <= int(length)
 
 
+def files_from_zip_archive(archive, max_files, extensions, max_file_size, max_archive_size):
+    """
+    Unpacks the files in a zip archive into spooled FileStorage objects, so large archives don't have to be held in
+    memory. A manifest.json at the top of the archive is returned separately rather than as a file, and anything
+    without one of the extensions is skipped without being decompressed.
+
+    The sizes in an archive's headers are checked before anything is decompressed, and the bytes are counted as they
+    are, as the headers can't be trusted not to understate them.
+
+    :param archive: A file object holding the zip archive
+    :param max_files: The most files the archive may contain
+    :param extensions: The extensions of the files to unpack, comma separated
+    :param max_file_size: The most bytes any one file may decompress to
+    :param max_archive_size: The most bytes all the files together may decompress to
+    :return: a list of FileStorage objects and the parsed manifest (None if the archive has no manifest)
+    """
+    try:
+        zip_file = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise RasError("Archive is not a valid zip file", 400)
+
+    with zip_file:
+        manifest_info = None
+        members = []
+        for info in zip_file.infolist():
+            if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                continue
+            if info.filename == ZIP_MANIFEST_FILE_NAME:
+                manifest_info = info
+            elif is_valid_file_extension(info.filename, extensions):
+                members.append(info)
+        if len(members) > max_files:
+            raise RasError(f"Archive contains more than {max_files} files", 400)
+        archive_too_large = f"Archive is larger than {max_archive_size} bytes uncompressed"
+        if sum(info.file_size for info in members) > max_archive_size:
+            raise RasError(archive_too_large, 400)
+
+        manifest = None
+        if manifest_info:
+            stream = io.BytesIO()
+            _unzip_member(
+                zip_file, manifest_info, stream, MAX_MANIFEST_SIZE, f"Manifest is larger than {MAX_MANIFEST_SIZE} bytes"
+            )
+            manifest = parse_bulk_upload_manifest(stream.getvalue())
+
+        files = []
+        remaining = max_archive_size
+        for info in members:
+            file_too_large = f"{info.filename} is larger than {max_file_size} bytes uncompressed"
+            if max_file_size <= remaining:
+                max_size, error = max_file_size, file_too_large
+            else:
+                max_size, error = remaining, archive_too_large
+            stream = SpooledTemporaryFile(max_size=1024 * 1024)
+            remaining -= _unzip_member(zip_file, info, stream, max_size, error)
+            stream.seek(0)
+            files.append(FileStorage(stream=stream, filename=posixpath.basename(info.filename)))
+    return files, manifest
+
+
+def _unzip_member(zip_file, info, stream, max_size, error):
+    """
+    Decompresses a member of a zip archive into a stream, stopping as soon as it's more than max_size bytes
+
+    :return: the number of bytes written
+    """
+    if info.file_size > max_size:
+        raise RasError(error, 400)
+    size = 0
+    try:
+        with zip_file.open(info) as member:
+            while chunk := member.read(UNZIP_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise RasError(error, 400)
+                stream.write(chunk)
+    except (zipfile.BadZipFile, zlib.error):
+        raise RasError("Archive is not a valid zip file", 400)
+    return size
+
+
+def parse_bulk_upload_manifest(manifest):
+    """
+    Parses a bulk upload manifest, a JSON object mapping each file name to the ru_ref it's for
+
+    :param manifest: The manifest as a JSON string or bytes
+    :return: dict of file name to ru_ref
+    """
+    if len(manifest) > MAX_MANIFEST_SIZE:
+        raise RasError(f"Manifest is larger than {MAX_MANIFEST_SIZE} bytes", 400)
+    try:
+        parsed = json.loads(manifest)
+    except ValueError:
+        raise RasError("Manifest is not valid JSON", 400)
+    if not isinstance(parsed, dict) or not all(
+        isinstance(value, str) and value for item in parsed.items() for value in item
+    ):
+        raise RasError("Manifest must be a JSON object of file name to ru_ref", 400)
+    return parsed
+
+
 def convert_file_object_to_string_base64(file):
     """
     Convert a file object to a string
@@ -60,4 +174,4 @@ def validate_uuid(*values):
             UUID(value)
         except ValueError:
             raise RasError(f"Value is not a valid UUID ({value})", 400)
-        return True
+    return True
@@ -0,0 +1,152 @@
+import json
+import logging
+import select
+import threading
+import uuid
+
+import structlog
+from flask import current_app, has_app_context
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from application.controllers.search_cache import PENDING_INVALIDATIONS, get_search_cache
+
+log = structlog.wrap_logger(logging.getLogger(__name__))
+
+INVALIDATION_LISTENER = "invalidation_listener"
+# Postgres rejects NOTIFY payloads of 8000 bytes or more, so larger sets of scopes are sent in several notifications
+MAX_PAYLOAD_SIZE = 7900
+POLL_TIMEOUT = 1
+RECONNECT_DELAY = 5
+
+
+def get_origin(app):
+    """An id for this worker's app, so a listener can ignore the notifications its own commits sent"""
+    return app.extensions.setdefault("invalidation_origin", uuid.uuid4().hex)
+
+
+def notification_payloads(origin, scopes):
+    """
+    Splits the scopes invalidated by a commit into NOTIFY payloads small enough for Postgres
+
+    :param origin: the id of the app that committed
+    :param scopes: an iterable of (scope, id) tuples
+    :return: a list of JSON payloads
+    """
+    payloads = []
+    batch = []
+    size = len(_encode(origin, []))
+    for scope in sorted(scopes, key=lambda s: (s[0], s[1] or "")):
+        scope_size = len(json.dumps(list(scope), separators=(",", ":"))) + 1
+        if batch and size + scope_size > MAX_PAYLOAD_SIZE:
+            payloads.append(_encode(origin, batch))
+            batch = []
+            size = len(_encode(origin, []))
+        batch.append(list(scope))
+        size += scope_size
+    if batch:
+        payloads.append(_encode(origin, batch))
+    return payloads
+
+
+def _encode(origin, scopes):
+    return json.dumps({"origin": origin, "scopes": scopes}, separators=(",", ":"))
+
+
+class InvalidationListener:
+    """
+    LISTENs on INVALIDATION_CHANNEL with its own connection, outside the engine's pool, and bumps this worker's search
+    cache generations for the scopes other workers (in this pod or any other) invalidated. Under gunicorn's gevent
+    workers the thread is a greenlet, which the patched select lets run while it waits.
+
+    Notifications sent while the listener is reconnecting are lost, so the whole cache is cleared once it's listening
+    again.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.channel = app.config["INVALIDATION_CHANNEL"]
+        self.origin = get_origin(app)
+        self.stopped = threading.Event()
+        self.listening = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="invalidation-listener", daemon=True)
+        self.thread.start()
+        log.info("Started cache invalidation listener", channel=self.channel)
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def run(self):
+        while not self.stopped.is_set():
+            connection = None
+            try:
+                connection = self._connect()
+                with self.app.app_context():
+                    get_search_cache().clear()
+                self.listening.set()
+                self._listen(connection)
+            except Exception:
+                log.exception("Cache invalidation listener failed, reconnecting", channel=self.channel)
+                self.stopped.wait(RECONNECT_DELAY)
+            finally:
+                self.listening.clear()
+                if connection is not None:
+                    connection.close()
+
+    def _connect(self):
+        engine = self.app.db
+        connect_args, connect_kwargs = engine.dialect.create_connect_args(engine.url)
+        connection = engine.dialect.connect(*connect_args, **connect_kwargs)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            # The channel is an identifier, which LISTEN can't take as a parameter
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return connection
+
+    def _listen(self, connection):
+        while not self.stopped.is_set():
+            if select.select([connection], [], [], POLL_TIMEOUT) == ([], [], []):
+                continue
+            connection.poll()
+            while connection.notifies:
+                self.handle(connection.notifies.pop(0).payload)
+
+    def handle(self, payload):
+        message = json.loads(payload)
+        if message["origin"] == self.origin:
+            return
+        scopes = [tuple(scope) for scope in message["scopes"]]
+        with self.app.app_context():
+            get_search_cache().bump(scopes)
+
+
+def start_invalidation_listener(app):
+    """Starts the app's invalidation listener, if the bus is enabled and the database is Postgres"""
+    if not app.config["INVALIDATION_BUS_ENABLED"] or app.db.dialect.name != "postgresql":
+        log.info("Cache invalidation bus disabled")
+        return None
+    listener = InvalidationListener(app)
+    app.extensions[INVALIDATION_LISTENER] = listener
+    listener.start()
+    return listener
+
+
+@event.listens_for(Session, "before_commit")
+def _notify_before_commit(session):
+    """
+    Sends the scopes the session invalidated to the other workers as part of the transaction, so Postgres only
+    delivers them if it commits
+    """
+    scopes = session.info.get(PENDING_INVALIDATIONS)
+    if not scopes or not has_app_context() or not current_app.config["INVALIDATION_BUS_ENABLED"]:
+        return
+    if session.get_bind().dialect.name != "postgresql":
+        return
+    channel = current_app.config["INVALIDATION_CHANNEL"]
+    for payload in notification_payloads(get_origin(current_app), scopes):
+        session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
@@ -1,14 +1,26 @@
+import base64
+import binascii
+import datetime
+import json
 import logging
+from uuid import UUID
 
 import structlog
 
 from application.controllers.helper import validate_uuid
 from application.controllers.session_decorator import with_db_session
 from application.controllers.sql_queries import (
+    delete_registry_instruments_by_exercise_id,
     query_registry_instrument_by_exercise_id_and_formtype,
     query_registry_instrument_count_by_exercise_id,
+    query_registry_instrument_counts_by_exercise_ids,
+    query_registry_instrument_revision_by_exercise_id,
     query_registry_instruments_by_exercise_id,
+    query_registry_instruments_by_exercise_ids,
+    query_registry_instruments_page,
+    upsert_registry_instruments,
 )
+from application.exceptions import RasError
 from application.models.models import RegistryInstrumentModel
 
 log = structlog.wrap_logger(logging.getLogger(__name__))
@@ -33,6 +45,61 @@ class RegistryInstrument(object):
             response.append(registry_instrument.to_dict())
         return response
 
+    @with_db_session
+    def get_by_exercise_ids(self, exercise_ids, session=None):
+        """
+        Retrieves the selected CIR instruments for each of a list of collection exercises with one query
+
+        :param exercise_ids: A list of exercise ids (UUIDs)
+        :param session: database session
+        :return: a dict of exercise id to its list of RegistryInstrumentModel dictionaries
+        """
+        log.info("Retrieving selected CIR instruments for exercises", exercise_ids=exercise_ids)
+        validate_uuid(*exercise_ids)
+        response = {str(UUID(exercise_id)): [] for exercise_id in exercise_ids}
+        for registry_instrument in query_registry_instruments_by_exercise_ids(exercise_ids, session):
+            response[str(registry_instrument.exercise_id)].append(registry_instrument.to_dict())
+        return response
+
+    @with_db_session
+    def get_page_by_guid(self, guid, limit, after=None, session=None):
+        """
+        Retrieves a page of the selected CIR instruments for a CIR version, i.e. which exercises have selected it
+
+        :param guid: The CIR guid (UUID)
+        :param limit: The most registry instruments to return
+        :param after: The next cursor of the previous page, or None for the first page
+        :param session: database session
+        :return: a list of RegistryInstrumentModel dictionaries and the cursor of the next page (None on the last)
+        """
+        log.info("Retrieving selected CIR instruments by guid", guid=guid)
+        validate_uuid(guid)
+        return self._page(RegistryInstrumentModel.guid, guid, limit, after, session)
+
+    @with_db_session
+    def get_page_by_instrument_id(self, instrument_id, limit, after=None, session=None):
+        """
+        Retrieves a page of the selected CIR instruments for a collection instrument
+
+        :param instrument_id: The collection instrument id (UUID)
+        :param limit: The most registry instruments to return
+        :param after: The next cursor of the previous page, or None for the first page
+        :param session: database session
+        :return: a list of RegistryInstrumentModel dictionaries and the cursor of the next page (None on the last)
+        """
+        log.info("Retrieving selected CIR instruments by instrument id", instrument_id=instrument_id)
+        validate_uuid(instrument_id)
+        return self._page(RegistryInstrumentModel.instrument_id, instrument_id, limit, after, session)
+
+    @staticmethod
+    def _page(column, value, limit, after, session):
+        # One more than the limit is read to tell whether there is a next page
+        registry_instruments = query_registry_instruments_page(
+            column, value, _decode_cursor(after) if after else None, limit + 1, session
+        )
+        next_cursor = _encode_cursor(registry_instruments[limit - 1]) if len(registry_instruments) > limit else None
+        return [registry_instrument.to_dict() for registry_instrument in registry_instruments[:limit]], next_cursor
+
     @with_db_session
     def get_by_exercise_id_and_formtype(self, exercise_id, form_type, session=None):
         """
@@ -74,6 +141,40 @@ class RegistryInstrument(object):
         session.add(registry_instrument)
         return True, is_new
 
+    @with_db_session
+    def bulk_save_for_exercise_id(self, exercise_id, registry_instruments, session=None):
+        """
+        Save a set of selected CIR instruments for the given collection exercise with a single upsert
+
+        :param exercise_id: An exercise id (UUID)
+        :param registry_instruments: A list of validated registry instrument payloads, at most one per form type
+        :param session: database session
+        :return: a list of (classifier_type, classifier_value, is_new) tuples in the order the payloads were given
+        """
+        log.info("Saving selected CIR instruments", exercise_id=exercise_id, count=len(registry_instruments))
+        validate_uuid(exercise_id)
+        rows = [
+            {
+                "survey_id": payload["survey_id"],
+                "exercise_id": payload["exercise_id"],
+                "instrument_id": payload["instrument_id"],
+                "classifier_type": payload["classifier_type"],
+                "classifier_value": str(payload["classifier_value"]),
+                "ci_version": int(payload["ci_version"]),
+                "guid": payload["guid"],
+                "published_at": datetime.datetime.fromisoformat(payload["published_at"]),
+            }
+            for payload in registry_instruments
+        ]
+        saved = {
+            (classifier_type, classifier_value): created
+            for classifier_type, classifier_value, created in upsert_registry_instruments(rows, session)
+        }
+        return [
+            (row["classifier_type"], row["classifier_value"], saved[(row["classifier_type"], row["classifier_value"])])
+            for row in rows
+        ]
+
     @with_db_session
     def delete_by_exercise_id_and_formtype(self, exercise_id, form_type, session=None):
         """
@@ -96,6 +197,23 @@ class RegistryInstrument(object):
         session.delete(registry_instrument)
         return True
 
+    @with_db_session
+    def delete_by_exercise_id(self, exercise_id, form_types=None, session=None):
+        """
+        Delete the selected CIR instruments for the given collection exercise, or only those for some form types,
+        with a single DELETE
+
+        :param exercise_id: An exercise id (UUID)
+        :param form_types: A list of form types (e.g. ["0001", "0002"]), or None for all of them
+        :param session: database session
+        :return: the number of registry instruments deleted
+        """
+        log.info("Deleting selected CIR instruments", exercise_id=exercise_id, form_types=form_types)
+        validate_uuid(exercise_id)
+        deleted = delete_registry_instruments_by_exercise_id(exercise_id, form_types, session)
+        log.info("Deleted selected CIR instruments", exercise_id=exercise_id, deleted=deleted)
+        return deleted
+
     @with_db_session
     def get_count_by_exercise_id(self, exercise_id: str, session=None) -> dict:
         """
@@ -107,6 +225,29 @@ class RegistryInstrument(object):
 
         return {"registry_instrument_count": query_registry_instrument_count_by_exercise_id(exercise_id, session)}
 
+    @with_db_session
+    def get_revision_by_exercise_id(self, exercise_id: str, session=None) -> int:
+        """
+        Retrieves the revision of an exercise's registry instruments, which goes up whenever any of them change
+        :param exercise_id: An exercise id (UUID)
+        :param session: database session
+        :return: the revision, 0 if the exercise has never had a registry instrument
+        """
+        validate_uuid(exercise_id)
+        return query_registry_instrument_revision_by_exercise_id(exercise_id, session)
+
+    @with_db_session
+    def get_counts_by_exercise_ids(self, exercise_ids: list, session=None) -> dict:
+        """
+        Retrieves the count of registry instruments for each of a list of exercises with one query
+        :param exercise_ids: A list of exercise ids (UUIDs)
+        :param session: database session
+        :return: a dict of exercise id to its registry instrument count
+        """
+        validate_uuid(*exercise_ids)
+        counts = query_registry_instrument_counts_by_exercise_ids(exercise_ids, session)
+        return {str(UUID(exercise_id)): counts.get(UUID(exercise_id), 0) for exercise_id in exercise_ids}
+
     @staticmethod
     def _find_and_update_or_create(
         survey_id, exercise_id, instrument_id, form_type, ci_version, published_at, guid, session
@@ -144,3 +285,28 @@ class RegistryInstrument(object):
             registry_instrument.guid = guid
             registry_instrument.published_at = published_at
             return registry_instrument, True
+
+
+def _encode_cursor(registry_instrument):
+    key = [
+        str(registry_instrument.exercise_id),
+        registry_instrument.classifier_type,
+        registry_instrument.classifier_value,
+    ]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    # The cursor comes from the client, so anything other than the list _encode_cursor makes is rejected
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise RasError("Invalid cursor", 400)
+    if not (isinstance(key, list) and len(key) == 3 and all(isinstance(part, str) for part in key)):
+        raise RasError("Invalid cursor", 400)
+    exercise_id, classifier_type, classifier_value = key
+    try:
+        UUID(exercise_id)
+    except ValueError:
+        raise RasError("Invalid cursor", 400)
+    return exercise_id, classifier_type, classifier_value
@@ -0,0 +1,156 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import structlog
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+log = structlog.wrap_logger(logging.getLogger(__name__))
+
+PENDING_INVALIDATIONS = "search_cache_invalidations"
+# Scopes of the generation counters. Every instrument change bumps ALL, its survey's and its exercises'
+ALL = "all"
+SURVEY = "survey"
+EXERCISE = "exercise"
+
+
+class SearchCache:
+    """
+    Instrument search results, keyed on the canonicalised search parameters and limit along with the generation of
+    the narrowest scope the search is filtered to (an exercise, else a survey, else all instruments).
+
+    Writes bump the generations of the scopes they affect once they're committed, so later searches make new keys and
+    never see the results cached before. Other workers' writes bump them too, through the invalidation bus when it's
+    enabled. Entries are also dropped after SEARCH_CACHE_TTL seconds, as a limit on how stale a result can be should
+    a notification be missed, and the least recently used entries are evicted past SEARCH_CACHE_MAX_ENTRIES.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.generations = {}
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def key(self, search_parameters, limit):
+        """
+        Makes the cache key for a search. It has to be made before the search is run, so that a result read before a
+        write is committed is stored against the generation it was read at.
+
+        :param search_parameters: dict of (key, value) pairs being searched on
+        :param limit: the amount of records to return, or None
+        :return: the cache key
+        """
+        if "COLLECTION_EXERCISE" in search_parameters:
+            scope = (EXERCISE, _canonical_id(search_parameters["COLLECTION_EXERCISE"]))
+        elif "SURVEY_ID" in search_parameters:
+            scope = (SURVEY, _canonical_id(search_parameters["SURVEY_ID"]))
+        else:
+            scope = (ALL, None)
+        canonical = json.dumps(search_parameters, sort_keys=True, separators=(",", ":"), default=str)
+        with self.lock:
+            generation = self.generations.get(scope, 0)
+        return canonical, int(limit) if limit else None, scope, generation
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, result = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def bump(self, scopes):
+        """
+        Bumps the generations of the given scopes, so searches in them miss the entries cached before
+
+        :param scopes: an iterable of (scope, id) tuples
+        """
+        with self.lock:
+            for scope in scopes:
+                self.generations[scope] = self.generations.get(scope, 0) + 1
+            # Entries of old generations can never be hit again
+            stale = [key for key in self.entries if key[3] != self.generations.get(key[2], 0)]
+            for key in stale:
+                del self.entries[key]
+        log.debug("Bumped search cache generations", scopes=scopes, evicted=len(stale))
+
+    def clear(self):
+        """Drops every entry, for when invalidations may have been missed"""
+        with self.lock:
+            self.entries.clear()
+
+
+def get_search_cache():
+    """The current app's search cache, created on first use"""
+    if "search_cache" not in current_app.extensions:
+        current_app.extensions["search_cache"] = SearchCache(
+            current_app.config["SEARCH_CACHE_TTL"], current_app.config["SEARCH_CACHE_MAX_ENTRIES"]
+        )
+    return current_app.extensions["search_cache"]
+
+
+def invalidate_instruments_on_commit(session, survey_ids=(), exercise_ids=()):
+    """
+    Records that instruments in the given surveys and exercises have been added, changed or deleted, so the search
+    cache is invalidated for them (and for searches across all instruments) once the session commits
+
+    :param session: database session
+    :param survey_ids: the surveys of the instruments
+    :param exercise_ids: the exercises the instruments are linked to
+    """
+    _pending(session).update([(ALL, None)] + _scopes(SURVEY, survey_ids) + _scopes(EXERCISE, exercise_ids))
+
+
+def invalidate_exercise_links_on_commit(session, exercise_ids):
+    """
+    Records that instruments have been linked to or unlinked from the given exercises, which only changes the
+    results of searches filtered by those exercises, so they're invalidated once the session commits
+
+    :param session: database session
+    :param exercise_ids: the exercises whose links changed
+    """
+    _pending(session).update(_scopes(EXERCISE, exercise_ids))
+
+
+def _pending(session):
+    return session.info.setdefault(PENDING_INVALIDATIONS, set())
+
+
+def _scopes(scope, ids):
+    return [(scope, _canonical_id(id_)) for id_ in ids]
+
+
+def _canonical_id(value):
+    return str(value).lower()
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_generations_after_commit(session):
+    scopes = session.info.pop(PENDING_INVALIDATIONS, None)
+    if scopes and has_app_context():
+        get_search_cache().bump(scopes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations_after_rollback(session):
+    session.info.pop(PENDING_INVALIDATIONS, None)
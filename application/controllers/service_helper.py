@@ -1,21 +1,46 @@
+import atexit
 import logging
+import time
+from threading import Lock
 
 import requests
 import structlog
 from flask import current_app
 
 from application.exceptions import RasError, ServiceUnavailableException
+from application.models.google_cloud_pubsub import GoogleCloudInstrumentChangePublisher
 
 log = structlog.wrap_logger(logging.getLogger(__name__))
 
+INSTRUMENT_CHANGE_PUBLISHER = "instrument_change_publisher"
+SURVEY_DETAILS_CACHE = "survey_details_cache"
+
+_publisher_lock = Lock()
+_survey_details_lock = Lock()
+
 
 def get_survey_details(survey_id):
     """
+    Gets the survey's details from the survey service, or from this worker's cache of them if they were got in the
+    last SURVEY_DETAILS_CACHE_TTL seconds. They're shared between callers, so mustn't be changed.
+
     :param survey_id: The survey_id UUID to search with
     :return: survey reference
     """
+    ttl = current_app.config["SURVEY_DETAILS_CACHE_TTL"]
+    key = str(survey_id).lower()
+    cache = current_app.extensions.setdefault(SURVEY_DETAILS_CACHE, {})
+    with _survey_details_lock:
+        expires, survey_details = cache.get(key, (0, None))
+    if expires > time.monotonic():
+        return survey_details
+
     response = service_request(service="survey-service", endpoint="surveys", search_value=survey_id)
-    return response.json()
+    survey_details = response.json()
+    if ttl > 0:
+        with _survey_details_lock:
+            cache[key] = (time.monotonic() + ttl, survey_details)
+    return survey_details
 
 
 def service_request(service, endpoint, search_value):
@@ -55,6 +80,39 @@ def service_request(service, endpoint, search_value):
 
 
 def collection_exercise_instrument_update_request(action, exercise_id: str) -> object:
+    """
+    Notifies the collection exercise service of a collection instrument change, using the configured
+    INSTRUMENT_NOTIFICATION_BACKEND
+    :param action: The change made to the exercise's instruments (ADD, UPDATE or REMOVE)
+    :param exercise_id: An exercise id (UUID)
+    :return: the REST response, or the publish future when notifications go through Pub/Sub
+    """
+    backend = current_app.config.get("INSTRUMENT_NOTIFICATION_BACKEND", "REST")
+    if backend == "PUBSUB":
+        return get_instrument_change_publisher().publish_instrument_change(action, exercise_id)
+    if backend != "REST":
+        raise RasError(f"notification backend '{backend}' not configured", 500)
+    return _post_collection_exercise_instrument_update(action, exercise_id)
+
+
+def get_instrument_change_publisher() -> GoogleCloudInstrumentChangePublisher:
+    """
+    Returns this worker's Pub/Sub publisher, creating it on first use. The publisher is shared across requests so
+    its batches can fill, and is flushed when the worker exits.
+    :return: the instrument change publisher
+    """
+    publisher = current_app.extensions.get(INSTRUMENT_CHANGE_PUBLISHER)
+    if publisher is None:
+        with _publisher_lock:
+            publisher = current_app.extensions.get(INSTRUMENT_CHANGE_PUBLISHER)
+            if publisher is None:
+                publisher = GoogleCloudInstrumentChangePublisher(current_app.config)
+                atexit.register(publisher.stop)
+                current_app.extensions[INSTRUMENT_CHANGE_PUBLISHER] = publisher
+    return publisher
+
+
+def _post_collection_exercise_instrument_update(action, exercise_id: str) -> object:
     """
     Posts a request to the collection exercise service to notify of a collection instrument change
     :param: json_message
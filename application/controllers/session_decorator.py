@@ -2,7 +2,7 @@ import logging
 from functools import wraps
 
 import structlog
-from flask import current_app
+from flask import current_app, g
 
 from application.exceptions import RasDatabaseError, RasError
 
@@ -20,6 +20,9 @@ def with_db_session(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         session = current_app.db.session()
+        # The function running the statements, so they can be tagged with it
+        controller = g.get("db_controller")
+        g.db_controller = f.__qualname__
         try:
             result = f(*args, **kwargs, session=session)
             session.commit()
@@ -34,5 +37,37 @@ def with_db_session(f):
             raise RasDatabaseError(f"There was an error committing the changes to the database. Details: {e}")
         finally:
             current_app.db.session.remove()
+            g.db_controller = controller
+
+    return wrapper
+
+
+def with_db_session_generator(f):
+    """
+    As with_db_session, for a generator function. The session lasts until the generator is exhausted or closed, so
+    when streaming a response the generator has to be iterated within the request context (stream_with_context).
+
+    :param f: The generator function to be wrapped.
+    """
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        session = current_app.db.session()
+        controller = g.get("db_controller")
+        g.db_controller = f.__qualname__
+        try:
+            yield from f(*args, **kwargs, session=session)
+            session.commit()
+        except RasError:
+            log.error("Rolling-back database session", exc_info=True)
+            session.rollback()
+            raise
+        except Exception as e:
+            log.error("Rolling-back database session", exc_info=True)
+            session.rollback()
+            raise RasDatabaseError(f"There was an error committing the changes to the database. Details: {e}")
+        finally:
+            current_app.db.session.remove()
+            g.db_controller = controller
 
     return wrapper
@@ -1,14 +1,21 @@
 from typing import Optional
 
-from sqlalchemy.orm import Session
-from sqlalchemy.sql import text
+from sqlalchemy import delete, func, select, tuple_
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy.sql import literal_column
 
 from application.models.models import (
     BusinessModel,
     ExerciseModel,
     InstrumentModel,
+    InstrumentSummary,
+    RegistryInstrumentCountModel,
     RegistryInstrumentModel,
+    SEFTModel,
     SurveyModel,
+    instrument_business_table,
+    instrument_exercise_table,
 )
 
 
@@ -16,18 +23,159 @@ def query_exercise_by_id(exercise_id, session):
     return session.query(ExerciseModel).filter(ExerciseModel.exercise_id == exercise_id).first()
 
 
+def query_exercise_with_instruments_by_id(exercise_id, session):
+    """
+    query for an exercise with its instruments, their survey, SEFT file and businesses eagerly loaded, so reading all of
+    them takes three queries (the exercise, its instruments with survey and SEFT file joined, then their businesses)
+    rather than a few per instrument
+    :param exercise_id: exercise id
+    :param session: session
+    :return: ExerciseModel, or None if not found
+    """
+    return (
+        session.query(ExerciseModel)
+        .options(
+            selectinload(ExerciseModel.instruments).options(
+                joinedload(InstrumentModel.survey), selectinload(InstrumentModel.businesses)
+            )
+        )
+        .filter(ExerciseModel.exercise_id == exercise_id)
+        .first()
+    )
+
+
 def query_business_by_ru(ru_ref, session):
     return session.query(BusinessModel).filter(BusinessModel.ru_ref == ru_ref).first()
 
 
+def query_businesses_by_ru_refs(ru_refs, session):
+    return session.query(BusinessModel).filter(BusinessModel.ru_ref.in_(ru_refs)).order_by(BusinessModel.id).all()
+
+
+def query_ru_refs_with_instrument_for_exercise(exercise_id, ru_refs, session) -> set:
+    """
+    query to find which of the given reporting units already have an instrument in a collection exercise
+    :param exercise_id: exercise id
+    :param ru_refs: reporting unit references to check
+    :param session: session
+    :return: the set of ru_refs that already have an instrument for the exercise
+    """
+    rows = (
+        session.query(BusinessModel.ru_ref)
+        .join(instrument_business_table, instrument_business_table.c.business_id == BusinessModel.id)
+        .join(
+            instrument_exercise_table,
+            instrument_exercise_table.c.instrument_id == instrument_business_table.c.instrument_id,
+        )
+        .join(ExerciseModel, ExerciseModel.id == instrument_exercise_table.c.exercise_id)
+        .filter(ExerciseModel.exercise_id == exercise_id, BusinessModel.ru_ref.in_(ru_refs))
+        .distinct()
+    )
+    return {row.ru_ref for row in rows}
+
+
+def query_seft_file_names_for_exercise(exercise_id, file_names, session) -> set:
+    """
+    query to find which of the given SEFT file names have already been uploaded for a collection exercise
+    :param exercise_id: exercise id
+    :param file_names: file names to check
+    :param session: session
+    :return: the set of file names already uploaded for the exercise
+    """
+    rows = (
+        session.query(SEFTModel.file_name)
+        .join(InstrumentModel, InstrumentModel.instrument_id == SEFTModel.instrument_id)
+        .join(instrument_exercise_table, instrument_exercise_table.c.instrument_id == InstrumentModel.id)
+        .join(ExerciseModel, ExerciseModel.id == instrument_exercise_table.c.exercise_id)
+        .filter(ExerciseModel.exercise_id == exercise_id, SEFTModel.file_name.in_(file_names))
+        .distinct()
+    )
+    return {row.file_name for row in rows}
+
+
 def query_survey_by_id(survey_id, session):
     return session.query(SurveyModel).filter(SurveyModel.survey_id == survey_id).first()
 
 
+def query_survey_ids_with_recent_instruments(since, limit, session) -> list:
+    """
+    query for the surveys with instruments stamped since the given time, most recently stamped first
+    :param since: the earliest instrument stamp to include
+    :param limit: the most survey ids to return
+    :param session: session
+    :return: a list of survey ids
+    """
+    return (
+        session.execute(
+            select(SurveyModel.survey_id)
+            .join(InstrumentModel, InstrumentModel.survey_id == SurveyModel.id)
+            .where(InstrumentModel.stamp >= since)
+            .group_by(SurveyModel.survey_id)
+            .order_by(func.max(InstrumentModel.stamp).desc())
+            .limit(limit)
+        )
+        .scalars()
+        .all()
+    )
+
+
 def query_instrument_by_id(instrument_id, session):
     return session.query(InstrumentModel).filter(InstrumentModel.instrument_id == instrument_id).first()
 
 
+def query_instrument_summaries_by_ids(instrument_ids, session):
+    """
+    query for the instruments with the given ids as InstrumentSummary, selecting only the columns InstrumentModel.json
+    uses and aggregating their ru_refs and exercise ids in the database, so it's one query and no ORM loading.
+    The aggregates are grouped derived tables rather than correlated subqueries, as the association tables aren't
+    indexed on instrument_id and a subquery per row would scan them once per instrument
+    :param instrument_ids: instrument ids
+    :param session: session
+    :return: list of InstrumentSummary
+    """
+    ids = select(InstrumentModel.id).where(InstrumentModel.instrument_id.in_(instrument_ids)).scalar_subquery()
+    rurefs = (
+        select(
+            instrument_business_table.c.instrument_id,
+            func.array_agg(aggregate_order_by(BusinessModel.ru_ref, BusinessModel.id)).label("rurefs"),
+        )
+        .join(BusinessModel, BusinessModel.id == instrument_business_table.c.business_id)
+        .where(instrument_business_table.c.instrument_id.in_(ids))
+        .group_by(instrument_business_table.c.instrument_id)
+        .subquery()
+    )
+    exids = (
+        select(
+            instrument_exercise_table.c.instrument_id,
+            func.array_agg(aggregate_order_by(ExerciseModel.exercise_id, ExerciseModel.id)).label("exids"),
+        )
+        .join(ExerciseModel, ExerciseModel.id == instrument_exercise_table.c.exercise_id)
+        .where(instrument_exercise_table.c.instrument_id.in_(ids))
+        .group_by(instrument_exercise_table.c.instrument_id)
+        .subquery()
+    )
+    statement = (
+        select(
+            InstrumentModel.instrument_id,
+            InstrumentModel.type,
+            InstrumentModel.stamp,
+            InstrumentModel.classifiers,
+            SEFTModel.id.label("seft_file_id"),
+            SEFTModel.file_name,
+            SEFTModel.len,
+            SurveyModel.survey_id,
+            rurefs.c.rurefs,
+            exids.c.exids,
+        )
+        .outerjoin(SEFTModel, SEFTModel.instrument_id == InstrumentModel.instrument_id)
+        .outerjoin(SurveyModel, SurveyModel.id == InstrumentModel.survey_id)
+        .outerjoin(rurefs, rurefs.c.instrument_id == InstrumentModel.id)
+        .outerjoin(exids, exids.c.instrument_id == InstrumentModel.id)
+        .where(InstrumentModel.instrument_id.in_(instrument_ids))
+    )
+    return [InstrumentSummary(row) for row in session.execute(statement)]
+
+
 def query_instrument(session):
     return session.query(InstrumentModel)
 
@@ -57,6 +205,39 @@ def query_registry_instruments_by_exercise_id(exercise_id, session):
     return session.query(RegistryInstrumentModel).filter(RegistryInstrumentModel.exercise_id == exercise_id)
 
 
+def query_registry_instruments_by_exercise_ids(exercise_ids, session):
+    return (
+        session.query(RegistryInstrumentModel)
+        .filter(RegistryInstrumentModel.exercise_id.in_(exercise_ids))
+        .order_by(
+            RegistryInstrumentModel.exercise_id,
+            RegistryInstrumentModel.classifier_type,
+            RegistryInstrumentModel.classifier_value,
+        )
+    )
+
+
+def query_registry_instruments_page(column, value, after, limit, session):
+    """
+    Returns a page of the registry instruments with the given value in a column, in primary key order
+
+    :param column: The RegistryInstrumentModel column to match on, which should be indexed with the primary key after it
+    :param value: The value to match
+    :param after: The (exercise_id, classifier_type, classifier_value) key the page starts after, or None for the first
+    :param limit: The most registry instruments to return
+    :param session: database session
+    """
+    primary_key = tuple_(
+        RegistryInstrumentModel.exercise_id,
+        RegistryInstrumentModel.classifier_type,
+        RegistryInstrumentModel.classifier_value,
+    )
+    query = session.query(RegistryInstrumentModel).filter(column == value)
+    if after:
+        query = query.filter(primary_key > tuple_(*after))
+    return query.order_by(*primary_key.clauses).limit(limit).all()
+
+
 def query_registry_instrument_by_exercise_id_and_formtype(exercise_id, form_type, session):
     return session.query(RegistryInstrumentModel).filter(
         RegistryInstrumentModel.exercise_id == exercise_id,
@@ -65,14 +246,68 @@ def query_registry_instrument_by_exercise_id_and_formtype(exercise_id, form_type
     )
 
 
+def upsert_registry_instruments(registry_instruments: list, session: Session) -> list:
+    """
+    Inserts or updates registry instruments in one INSERT ... ON CONFLICT statement. An existing row keeps its survey
+    and instrument ids and has its ci_version, guid and published_at replaced, as a single save does
+
+    :param registry_instruments: A list of dicts of registry_instrument column values, unique on the primary key
+    :param session: database session
+    :return: a list of (classifier_type, classifier_value, created) rows, created being False for updated rows
+    """
+    table = RegistryInstrumentModel.__table__
+    statement = insert(table).values(registry_instruments)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.exercise_id, table.c.classifier_type, table.c.classifier_value],
+        set_={
+            "ci_version": statement.excluded.ci_version,
+            "guid": statement.excluded.guid,
+            "published_at": statement.excluded.published_at,
+        },
+    ).returning(
+        # xmax is only zero on a row version written by an insert
+        table.c.classifier_type,
+        table.c.classifier_value,
+        literal_column("xmax = 0").label("created"),
+    )
+    return session.execute(statement).all()
+
+
 def query_registry_instrument_count_by_exercise_id(exercise_id: str, session: Session) -> Optional[int]:
     row_result = session.execute(
-        text("SELECT * FROM ras_ci.registry_instrument_count WHERE exercise_id = :exercise_id"),
-        {"exercise_id": exercise_id},
+        select(RegistryInstrumentCountModel.exercise_id, RegistryInstrumentCountModel.count).where(
+            RegistryInstrumentCountModel.exercise_id == exercise_id
+        )
     ).first()
     return row_result[1] if row_result else 0
 
 
+def query_registry_instrument_revision_by_exercise_id(exercise_id: str, session: Session) -> int:
+    revision = session.execute(
+        select(RegistryInstrumentCountModel.revision).where(RegistryInstrumentCountModel.exercise_id == exercise_id)
+    ).scalar()
+    return revision or 0
+
+
+def query_registry_instrument_counts_by_exercise_ids(exercise_ids: list, session: Session) -> dict:
+    rows = session.execute(
+        select(RegistryInstrumentCountModel.exercise_id, RegistryInstrumentCountModel.count).where(
+            RegistryInstrumentCountModel.exercise_id.in_(exercise_ids)
+        )
+    )
+    return {exercise_id: count for exercise_id, count in rows}
+
+
+def delete_registry_instruments_by_exercise_id(exercise_id: str, form_types: Optional[list], session: Session) -> int:
+    statement = delete(RegistryInstrumentModel).where(RegistryInstrumentModel.exercise_id == exercise_id)
+    if form_types:
+        statement = statement.where(
+            RegistryInstrumentModel.classifier_type == "form_type",
+            RegistryInstrumentModel.classifier_value.in_(form_types),
+        )
+    return session.execute(statement).rowcount
+
+
 def delete_registry_instrument_by_exercise_id_and_instrument_id(
     exercise_id: str, instrument_id: str, session: Session
 ) -> None:
@@ -0,0 +1,52 @@
+import logging
+
+import orjson
+import structlog
+from flask.json.provider import DefaultJSONProvider
+
+log = structlog.wrap_logger(logging.getLogger(__name__))
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Serialises JSON with orjson, falling back to Flask's default provider for anything orjson can't encode (e.g.
+    integers over 64 bits).
+
+    UUIDs are encoded by orjson natively. Datetimes and dataclasses are passed through to Flask's default function so
+    they come out exactly as before (datetimes as HTTP dates), keys are sorted and debug responses indented as Flask
+    does. Unlike Flask's default, non ASCII characters are sent as UTF-8 rather than escaped.
+    """
+
+    options = (
+        orjson.OPT_SORT_KEYS
+        | orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return self._orjson_dumps(obj).decode()
+        except orjson.JSONEncodeError:
+            return super().dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        try:
+            body = self._orjson_dumps(obj, orjson.OPT_INDENT_2 if indent else 0) + b"\n"
+        except orjson.JSONEncodeError:
+            log.warning("orjson couldn't encode a response, falling back to json")
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+    def _orjson_dumps(self, obj, options=0):
+        options |= self.options if self.sort_keys else self.options & ~orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=options)
@@ -0,0 +1,127 @@
+import os
+import time
+
+from flask import g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# The blueprints of the API's routes. Service endpoints such as /metrics and /health/ready aren't measured
+METERED_BLUEPRINTS = ("collection_instrument_view", "registry_instrument_view")
+# Gunicorn's timeout is 30 seconds, so nothing takes longer
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Enough to tell a few eager loading queries from a query per instrument
+STATEMENT_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+REQUEST_DURATION = Histogram(
+    "ras_ci_http_request_duration_seconds",
+    "Time taken to handle a request, until its response (or the last of a streamed response) is sent",
+    ["blueprint", "route", "method"],
+    buckets=DURATION_BUCKETS,
+)
+REQUESTS = Counter(
+    "ras_ci_http_requests",
+    "Requests handled, by response status code",
+    ["blueprint", "route", "method", "status"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "ras_ci_http_requests_in_flight",
+    "Requests being handled",
+    ["blueprint", "route", "method"],
+    multiprocess_mode="livesum",
+)
+DB_STATEMENTS_PER_REQUEST = Histogram(
+    "ras_ci_db_statements_per_request",
+    "Database statements run to handle a request",
+    ["blueprint", "route", "method"],
+    buckets=STATEMENT_COUNT_BUCKETS,
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "ras_ci_db_time_per_request_seconds",
+    "Time spent running database statements to handle a request",
+    ["blueprint", "route", "method"],
+    buckets=DURATION_BUCKETS,
+)
+SLOW_DB_STATEMENTS = Counter(
+    "ras_ci_db_slow_statements",
+    "Database statements which took longer than SLOW_SQL_THRESHOLD_MS",
+    ["blueprint", "route", "method"],
+)
+# The bytes compression saves are the original bytes less the compressed ones
+COMPRESSED_RESPONSES = Counter(
+    "ras_ci_http_compressed_responses",
+    "Responses compressed, by encoding",
+    ["encoding"],
+)
+COMPRESSION_ORIGINAL_BYTES = Counter(
+    "ras_ci_http_response_compression_original_bytes",
+    "Size of compressed responses before they were compressed",
+    ["encoding"],
+)
+COMPRESSION_COMPRESSED_BYTES = Counter(
+    "ras_ci_http_response_compression_compressed_bytes",
+    "Size of compressed responses once they were compressed",
+    ["encoding"],
+)
+
+
+def start_request_timer():
+    """A before_request hook that starts timing the request and counts it as in flight"""
+    if request.blueprint not in METERED_BLUEPRINTS:
+        return
+    # The route's rule, rather than the path, so the ids in paths don't make a series each
+    labels = (request.blueprint, request.url_rule.rule if request.url_rule else "", request.method)
+    g.metrics_labels = labels
+    g.metrics_start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.labels(*labels).inc()
+
+
+def record_response_status(response):
+    """An after_request hook that notes the response's status, for when the request is torn down"""
+    g.metrics_status = response.status_code
+    return response
+
+
+def observe_request(exception=None):
+    """
+    A teardown_request hook that records how long the request took and its status. Teardown comes after the response
+    is sent, so a streamed response is timed until its last line.
+    """
+    labels = g.pop("metrics_labels", None)
+    if labels is None:
+        return
+    REQUEST_DURATION.labels(*labels).observe(time.perf_counter() - g.pop("metrics_start"))
+    REQUESTS.labels(*labels, str(g.pop("metrics_status", 500))).inc()
+    REQUESTS_IN_FLIGHT.labels(*labels).dec()
+
+
+def init_metrics(app):
+    """
+    Records request metrics for the routes of the METERED_BLUEPRINTS. The hooks are the app's rather than the
+    blueprints', so they run before the blueprints' authentication and requests it rejects are counted too.
+    """
+    app.before_request(start_request_timer)
+    app.after_request(record_response_status)
+    app.teardown_request(observe_request)
+
+
+def latest_metrics():
+    """
+    The metrics in Prometheus' text format. Under gunicorn, PROMETHEUS_MULTIPROC_DIR is set and every worker writes
+    its metrics there, so they're collected from all of them whichever worker is scraped.
+
+    :return: the metrics and their content type
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,6 +1,10 @@
+import base64
 import logging
-from hashlib import sha256
+import os
+from collections import namedtuple
+from hashlib import md5, sha256
 
+import google_crc32c
 import structlog
 from flask import current_app
 from google.cloud import storage
@@ -10,6 +14,77 @@ from application.exceptions import GCPBucketException, RasError
 
 log = structlog.wrap_logger(logging.getLogger(__name__))
 
+# Length and base64 encoded digests of an uploaded file, the encoding matches the crc32c and md5_hash blob properties
+SEFTFileDigest = namedtuple("SEFTFileDigest", ["length", "crc32c", "md5_hash"])
+
+
+class DigestingStream:
+    """
+    Wraps a file stream, counting and hashing (CRC32C and MD5) the bytes as they are read through it, so the upload to
+    the bucket is the only pass made over the file.
+
+    The upload may seek back and resend a chunk after a failure; bytes below the high-water mark have already been
+    hashed and are not hashed again.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.stream.seek(0)
+        self.position = 0
+        self.hashed = 0
+        self._crc32c = google_crc32c.Checksum()
+        self._md5 = md5()
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        end = self.position + len(chunk)
+        if end > self.hashed:
+            if self.position > self.hashed:
+                raise RasError("File stream was not read in order", 500)
+            already_hashed = self.hashed - self.position
+            new_bytes = chunk[already_hashed:]
+            self._crc32c.update(new_bytes)
+            self._md5.update(new_bytes)
+            self.hashed = end
+        self.position = end
+        return chunk
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.position = self.stream.seek(offset, whence)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def size(self):
+        """The total size of the stream, found by seeking rather than reading"""
+        current = self.position
+        size = self.seek(0, os.SEEK_END)
+        self.seek(current)
+        return size
+
+    def digest(self):
+        return SEFTFileDigest(
+            length=self.hashed,
+            crc32c=base64.b64encode(self._crc32c.digest()).decode("utf-8"),
+            md5_hash=base64.b64encode(self._md5.digest()).decode("utf-8"),
+        )
+
+
+def digest_file(stream, chunk_size):
+    """
+    Works out the SEFTFileDigest of a file stream by reading it through a chunk at a time, then rewinds it
+
+    :param stream: A seekable file stream
+    :param chunk_size: The most bytes to hold in memory at once
+    :return: the SEFTFileDigest of the stream
+    """
+    digesting_stream = DigestingStream(stream)
+    while digesting_stream.read(chunk_size):
+        pass
+    stream.seek(0)
+    return digesting_stream.digest()
+
 
 class GoogleCloudSEFTCIBucket:
     def __init__(self, config):
@@ -18,8 +93,20 @@ class GoogleCloudSEFTCIBucket:
         self.client = storage.Client(project=self.project_id)
         self.bucket = self.client.bucket(self.bucket_name)
         self.prefix = config["SEFT_DOWNLOAD_BUCKET_FILE_PREFIX"]
+        self.upload_chunk_size = int(config["SEFT_UPLOAD_CHUNK_SIZE"])
 
-    def upload_file_to_bucket(self, file):
+    def upload_file_to_bucket(self, file, expected_digest=None):
+        """
+        Streams a file to the bucket, hashing it on the way through.
+
+        Files no bigger than SEFT_UPLOAD_CHUNK_SIZE go in a single request, larger ones as a resumable upload in chunks
+        of that size, so no more than one chunk of the file is held in memory whatever its size. The CRC32C of what is
+        sent goes with it, so GCS rejects a transfer that arrives corrupted.
+
+        :param file: A FileStorage object, with the path in the bucket (less the prefix) as its filename
+        :param expected_digest: Optionally the SEFTFileDigest the file is known to have, which GCS then also checks
+        :return: the SEFTFileDigest of what was uploaded
+        """
         path = file.filename
         if self.prefix != "":
             path = self.prefix + "/" + path
@@ -29,10 +116,19 @@ class GoogleCloudSEFTCIBucket:
             log.error("Customer defined encryption key is missing.")
             raise RasError("can't find customer defined encryption, hence can't perform this task", 500)
         customer_supplied_encryption_key = sha256(key.encode("utf-8")).digest()
-        blob = self.bucket.blob(blob_name=path, encryption_key=customer_supplied_encryption_key)
-        blob.upload_from_file(file_obj=file.stream, rewind=True)
-        log.info("Successfully put SEFT CI in bucket")
-        return
+        blob = self.bucket.blob(
+            blob_name=path, encryption_key=customer_supplied_encryption_key, chunk_size=self.upload_chunk_size
+        )
+        if expected_digest:
+            blob.crc32c = expected_digest.crc32c
+            blob.md5_hash = expected_digest.md5_hash
+        stream = DigestingStream(file.stream)
+        size = stream.size()
+        # A size makes the client send the file in one request, without one it uploads in chunk_size chunks
+        blob.upload_from_file(file_obj=stream, size=size if size <= self.upload_chunk_size else None, checksum="crc32c")
+        digest = stream.digest()
+        log.info("Successfully put SEFT CI in bucket", length=digest.length)
+        return digest
 
     def download_file_from_bucket(self, file_location: str):
         if self.prefix != "":
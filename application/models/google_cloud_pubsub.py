@@ -0,0 +1,69 @@
+import json
+import logging
+import os
+
+import structlog
+from google.api_core.exceptions import AlreadyExists
+from google.cloud import pubsub_v1
+
+log = structlog.wrap_logger(logging.getLogger(__name__))
+
+
+class GoogleCloudInstrumentChangePublisher:
+    """
+    Publishes collection instrument change events (ADD, UPDATE, REMOVE for a collection exercise) to a Pub/Sub topic.
+
+    Messages are handed to the client's batching publisher and sent in the background, so a request only pays for
+    queueing the message. One instance should be kept per worker process so batches can build up across requests.
+    """
+
+    def __init__(self, config):
+        self.project_id = config["GOOGLE_CLOUD_PROJECT"]
+        self.topic_id = config["INSTRUMENT_CHANGE_TOPIC_ID"]
+        batch_settings = pubsub_v1.types.BatchSettings(
+            max_bytes=config["PUBSUB_BATCH_MAX_BYTES"],
+            max_latency=config["PUBSUB_BATCH_MAX_LATENCY"],
+            max_messages=config["PUBSUB_BATCH_MAX_MESSAGES"],
+        )
+        self.client = pubsub_v1.PublisherClient(batch_settings=batch_settings)
+        self.topic_path = self.client.topic_path(self.project_id, self.topic_id)
+        if os.getenv("PUBSUB_EMULATOR_HOST"):
+            self._create_topic_on_emulator()
+
+    def publish_instrument_change(self, action, exercise_id):
+        """
+        Queues an instrument change event for publishing
+
+        :param action: The change made to the exercise's instruments (ADD, UPDATE or REMOVE)
+        :param exercise_id: An exercise id (UUID)
+        :return: the publish future, which resolves to the message id once the batch has been sent
+        """
+        exercise_id = str(exercise_id)
+        data = json.dumps({"action": action, "exercise_id": exercise_id}).encode("utf-8")
+        future = self.client.publish(self.topic_path, data, action=action, exercise_id=exercise_id)
+        future.add_done_callback(lambda f: self._log_publish_result(f, action, exercise_id))
+        return future
+
+    def stop(self):
+        """Sends any batched messages still waiting and shuts the publisher down"""
+        log.info("Flushing instrument change publisher", topic=self.topic_path)
+        self.client.stop()
+
+    @staticmethod
+    def _log_publish_result(future, action, exercise_id):
+        # Runs on the client's background thread once the batch has been sent, so failures can only be logged
+        exception = future.exception()
+        if exception:
+            log.error(
+                "Failed to publish instrument change", action=action, exercise_id=exercise_id, error=str(exception)
+            )
+        else:
+            log.info("Published instrument change", action=action, exercise_id=exercise_id, message_id=future.result())
+
+    def _create_topic_on_emulator(self):
+        # The emulator starts empty, real topics are provisioned outside this service
+        try:
+            self.client.create_topic(name=self.topic_path)
+            log.info("Created topic on Pub/Sub emulator", topic=self.topic_path)
+        except AlreadyExists:
+            pass
@@ -1,7 +1,7 @@
 from datetime import datetime
 from uuid import uuid4
 
-from sqlalchemy import Column, ForeignKey, Integer, Table
+from sqlalchemy import BigInteger, Column, ForeignKey, Index, Integer, Table, event
 from sqlalchemy.dialects.postgresql.json import JSONB
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.types import TIMESTAMP, UUID, String
@@ -89,6 +89,42 @@ class InstrumentModel(Base):
         return self.classifiers.get("form_type")
 
 
+class InstrumentSummary:
+    """
+    A read only instrument built from a single row of selected columns, which gives the same json as InstrumentModel
+    without loading its relationships into the session. See query_instrument_summaries_by_ids
+    """
+
+    __slots__ = ("instrument_id", "type", "stamp", "classifiers", "name", "len", "survey_id", "rurefs", "exids")
+
+    def __init__(self, row):
+        self.instrument_id = row.instrument_id
+        self.type = row.type
+        self.stamp = row.stamp
+        self.classifiers = row.classifiers
+        # Matches InstrumentModel.name, an instrument with a SEFT file is named after it
+        self.name = row.file_name if row.seft_file_id is not None else row.classifiers.get("form_type")
+        self.len = row.len
+        self.survey_id = row.survey_id
+        # array_agg gives NULL rather than an empty array when there are no rows
+        self.rurefs = row.rurefs or []
+        self.exids = row.exids or []
+
+    @property
+    def json(self):
+        return {
+            "id": self.instrument_id,
+            "file_name": self.name,
+            "len": self.len,
+            "stamp": self.stamp,
+            "survey": self.survey_id,
+            "businesses": self.rurefs,
+            "exercises": self.exids,
+            "classifiers": self.classifiers,
+            "type": self.type,
+        }
+
+
 class BusinessModel(Base):
     """
     This models the 'business' table which is a placeholder for the RU code
@@ -180,6 +216,9 @@ class SEFTModel(Base):
     id = Column(Integer, primary_key=True)
     file_name = Column(String(32))
     len = Column(Integer)
+    # Base64 encoded digests of the file as uploaded to the bucket, in the same form as the blob's properties
+    crc32c = Column(String(8))
+    md5_hash = Column(String(24))
     instrument_id = Column(UUID, ForeignKey("instrument.instrument_id"))
 
     instrument = relationship("InstrumentModel", back_populates="seft_file")
@@ -206,6 +245,17 @@ class RegistryInstrumentModel(Base):
     """
 
     __tablename__ = "registry_instrument"
+    # For finding the exercises using a CIR version or instrument, in primary key order so they can be paged through
+    __table_args__ = (
+        Index("ix_registry_instrument_guid", "guid", "exercise_id", "classifier_type", "classifier_value"),
+        Index(
+            "ix_registry_instrument_instrument_id",
+            "instrument_id",
+            "exercise_id",
+            "classifier_type",
+            "classifier_value",
+        ),
+    )
 
     instrument_id = Column(UUID, ForeignKey("instrument.instrument_id"))
     survey_id = Column(UUID, nullable=False)
@@ -248,3 +298,65 @@ class RegistryInstrumentModel(Base):
             "guid": self.guid,
             "published_at": self.published_at.isoformat() if self.published_at else None,
         }
+
+
+class RegistryInstrumentCountModel(Base):
+    """This models the 'registry_instrument_counter' table which holds the number of registry instruments selected for
+    each collection exercise, so a count is a primary key lookup rather than a count over registry_instrument.
+
+    * Maintained by a trigger on registry_instrument, created along with the tables below (and by migration for
+      existing databases)
+    * revision goes up on every insert, update or delete of one of the exercise's registry instruments, so it versions
+      the exercise's selections (e.g. for ETags) without reading them
+    * A registry instrument moved to another exercise is taken off the old exercise's count and added to the new one's,
+      bumping both revisions
+    * An exercise's row stays, at a count of 0, when its last registry instrument is deleted, so revisions never reset
+    """
+
+    __tablename__ = "registry_instrument_counter"
+
+    exercise_id = Column(UUID, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    revision = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+
+REGISTRY_INSTRUMENT_COUNT_FUNCTION = """
+CREATE OR REPLACE FUNCTION {schema}.count_registry_instrument() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO {schema}.registry_instrument_counter AS counter (exercise_id, count, revision)
+        VALUES (NEW.exercise_id, 1, 1)
+        ON CONFLICT (exercise_id) DO UPDATE SET count = counter.count + 1, revision = counter.revision + 1;
+    ELSIF TG_OP = 'UPDATE' AND OLD.exercise_id IS DISTINCT FROM NEW.exercise_id THEN
+        -- Moved to another exercise, so it's counted against that one instead
+        UPDATE {schema}.registry_instrument_counter SET count = count - 1, revision = revision + 1
+        WHERE exercise_id = OLD.exercise_id;
+        INSERT INTO {schema}.registry_instrument_counter AS counter (exercise_id, count, revision)
+        VALUES (NEW.exercise_id, 1, 1)
+        ON CONFLICT (exercise_id) DO UPDATE SET count = counter.count + 1, revision = counter.revision + 1;
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE {schema}.registry_instrument_counter SET revision = revision + 1 WHERE exercise_id = NEW.exercise_id;
+    ELSE
+        UPDATE {schema}.registry_instrument_counter SET count = count - 1, revision = revision + 1
+        WHERE exercise_id = OLD.exercise_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+REGISTRY_INSTRUMENT_COUNT_TRIGGER = """
+CREATE TRIGGER registry_instrument_count AFTER INSERT OR UPDATE OR DELETE ON {schema}.registry_instrument
+FOR EACH ROW EXECUTE PROCEDURE {schema}.count_registry_instrument()
+"""
+
+
+@event.listens_for(Base.metadata, "after_create")
+def create_registry_instrument_count_trigger(target, connection, **kw):
+    # The counter and registry_instrument tables both have to exist first, so this hangs off the metadata
+    if connection.dialect.name != "postgresql":
+        return
+    schema = RegistryInstrumentModel.__table__.schema or "public"
+    connection.exec_driver_sql(REGISTRY_INSTRUMENT_COUNT_FUNCTION.format(schema=schema))
+    connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS registry_instrument_count ON {schema}.registry_instrument")
+    connection.exec_driver_sql(REGISTRY_INSTRUMENT_COUNT_TRIGGER.format(schema=schema))
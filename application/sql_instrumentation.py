@@ -0,0 +1,178 @@
+import logging
+import re
+import time
+import uuid
+
+import structlog
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+
+from application.metrics import (
+    DB_STATEMENTS_PER_REQUEST,
+    DB_TIME_PER_REQUEST,
+    METERED_BLUEPRINTS,
+    SLOW_DB_STATEMENTS,
+)
+
+log = structlog.wrap_logger(logging.getLogger(__name__))
+
+QUERY_STARTS = "query_starts"
+MAX_LOGGED_SQL_LENGTH = 2000
+REQUEST_ID_HEADER = "X-Request-ID"
+MAX_REQUEST_ID_LENGTH = 64
+
+_comment = re.compile(r"/\*.*?\*/", re.DOTALL)
+_placeholder = re.compile(r"%\(\w+\)s|%s")
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r"\b\d+(?:\.\d+)?\b")
+_value_list = re.compile(r"\?(?:\s*,\s*\?)+")
+_whitespace = re.compile(r"\s+")
+# Anything that could close a comment, or be taken by psycopg2 as a parameter placeholder, is kept out of the tags
+_unsafe_tag_characters = re.compile(r"[^\w./<>:-]")
+_unsafe_request_id_characters = re.compile(r"[^\w.-]")
+
+
+def normalise_sql(statement):
+    """
+    Replaces the parameters and literals in a statement with ?, collapsing lists of them, and drops its comments, so
+    statements that only differ in their values (such as an IN with more or fewer ids) log the same
+
+    :param statement: the SQL sent to the database
+    :return: the normalised SQL
+    """
+    statement = _comment.sub("", statement)
+    statement = _placeholder.sub("?", statement)
+    statement = _string_literal.sub("?", statement)
+    statement = _number_literal.sub("?", statement)
+    statement = _value_list.sub("?, ...", statement)
+    return _whitespace.sub(" ", statement).strip()[:MAX_LOGGED_SQL_LENGTH]
+
+
+def instrument_engine(engine, slow_statement_ms):
+    """
+    Times every statement the engine executes. Those run for a request are added to its totals, and any that take
+    longer than slow_statement_ms are logged with the route that ran them.
+
+    :param engine: the engine to instrument
+    :param slow_statement_ms: the time in milliseconds over which a statement is logged
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault(QUERY_STARTS, []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _record_statement(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info[QUERY_STARTS].pop()
+        in_request = has_request_context()
+        if in_request:
+            g.db_statements = g.get("db_statements", 0) + 1
+            g.db_time = g.get("db_time", 0.0) + elapsed
+        if elapsed * 1000 >= slow_statement_ms:
+            route = request.url_rule.rule if in_request and request.url_rule else None
+            if in_request and request.blueprint in METERED_BLUEPRINTS:
+                SLOW_DB_STATEMENTS.labels(request.blueprint, route or "", request.method).inc()
+            log.warning(
+                "Slow database statement",
+                duration_ms=round(elapsed * 1000, 1),
+                sql=normalise_sql(statement),
+                route=route,
+                endpoint=request.endpoint if in_request else None,
+                controller=g.get("db_controller") if has_app_context() else None,
+            )
+
+    @event.listens_for(engine, "handle_error")
+    def _discard_statement_timer(exception_context):
+        starts = exception_context.connection.info.get(QUERY_STARTS) if exception_context.connection else None
+        if starts:
+            starts.pop()
+
+
+def reset_request_sql():
+    """A before_request hook that zeroes the request's totals, as g can outlive a request if it has an app context"""
+    g.db_statements = 0
+    g.db_time = 0.0
+    g.pop("request_id", None)
+
+
+def get_request_id():
+    """The request's X-Request-ID, if it was sent one, otherwise one made up for it"""
+    if "request_id" not in g:
+        request_id = _unsafe_request_id_characters.sub("", request.headers.get(REQUEST_ID_HEADER, ""))
+        g.request_id = request_id[:MAX_REQUEST_ID_LENGTH] or uuid.uuid4().hex
+    return g.request_id
+
+
+def statement_comment():
+    """
+    A comment giving the route, controller and request a statement is run for, as much of them as is known, e.g.
+    /* route=/collection-instrument-api/1.0.2/<instrument_id>, controller=CollectionInstrument.get_instrument_json,
+    request_id=0d5c... */
+
+    :return: the comment, or None outside of an app context
+    """
+    if not has_app_context():
+        return None
+    tags = []
+    if has_request_context() and request.url_rule:
+        tags.append(("route", request.url_rule.rule))
+    if g.get("db_controller"):
+        tags.append(("controller", g.db_controller))
+    if has_request_context():
+        tags.append(("request_id", get_request_id()))
+    if not tags:
+        return None
+    return "/* " + ", ".join(f"{name}={_unsafe_tag_characters.sub('_', value)}" for name, value in tags) + " */"
+
+
+def comment_statements(engine):
+    """
+    Appends statement_comment() to every statement the engine executes, so statements seen by the database (in
+    pg_stat_activity or its slow statement log, say) can be traced back to the code that ran them
+
+    :param engine: the engine whose statements are tagged
+    """
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def _append_comment(conn, cursor, statement, parameters, context, executemany):
+        comment = statement_comment()
+        if comment:
+            statement = f"{statement} {comment}"
+        return statement, parameters
+
+
+def add_request_id_header(response):
+    """An after_request hook that returns the id the request's statements were tagged with, if they were"""
+    if "request_id" in g:
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+    return response
+
+
+def add_sql_stats_headers(response):
+    """
+    An after_request hook that adds the number of statements the request ran and the time they took, as they stood
+    when the response was started, if SQL_STATS_HEADERS
+    """
+    if current_app.config["SQL_STATS_HEADERS"]:
+        response.headers["X-DB-Statement-Count"] = str(g.get("db_statements", 0))
+        response.headers["X-DB-Time-Ms"] = f"{g.get('db_time', 0.0) * 1000:.1f}"
+    return response
+
+
+def observe_request_sql(exception=None):
+    """
+    A teardown_request hook that records the statements run by a metered request, and the time they took, in the
+    per request histograms
+    """
+    if request.blueprint not in METERED_BLUEPRINTS:
+        return
+    labels = (request.blueprint, request.url_rule.rule if request.url_rule else "", request.method)
+    DB_STATEMENTS_PER_REQUEST.labels(*labels).observe(g.get("db_statements", 0))
+    DB_TIME_PER_REQUEST.labels(*labels).observe(g.get("db_time", 0.0))
+
+
+def init_sql_instrumentation(app):
+    app.before_request(reset_request_sql)
+    app.after_request(add_sql_stats_headers)
+    app.after_request(add_request_id_header)
+    app.teardown_request(observe_request_sql)
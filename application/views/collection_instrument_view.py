@@ -1,10 +1,27 @@
 import logging
+import os
+from http import HTTPStatus
 
 import structlog
-from flask import Blueprint, jsonify, make_response, request
+from flask import (
+    Blueprint,
+    current_app,
+    jsonify,
+    make_response,
+    request,
+    stream_with_context,
+)
 
+from application.compression import compress_response
 from application.controllers.basic_auth import auth
-from application.controllers.collection_instrument import CollectionInstrument
+from application.controllers.collection_instrument import (
+    BULK_UPLOAD_UPLOADED,
+    CollectionInstrument,
+)
+from application.controllers.helper import (
+    files_from_zip_archive,
+    parse_bulk_upload_manifest,
+)
 from application.controllers.service_helper import (
     collection_exercise_instrument_update_request,
 )
@@ -22,6 +39,7 @@ PATCH_SUCCESSFUL = "The patch of the instrument was successful"
 LINK_SUCCESSFUL = "Linked collection instrument to collection exercise"
 UNLINK_SUCCESSFUL = "collection instrument and collection exercise unlinked"
 COLLECTION_EXERCISE_CI_UPDATE_SUCCESSFUL = "Collection exercise collection instrument update successful"
+NDJSON_MIMETYPE = "application/x-ndjson"
 
 
 @collection_instrument_view.before_request
@@ -30,6 +48,9 @@ def before_collection_instrument_view():
     pass
 
 
+collection_instrument_view.after_request(compress_response)
+
+
 @collection_instrument_view.route("/upload/<exercise_id>", methods=["POST"])
 @collection_instrument_view.route("/upload/<exercise_id>/<ru_ref>", methods=["POST"])
 def upload_seft_collection_instrument(exercise_id, ru_ref=None):
@@ -48,6 +69,62 @@ def upload_seft_collection_instrument(exercise_id, ru_ref=None):
     return make_response(UPLOAD_SUCCESSFUL, 200)
 
 
+@collection_instrument_view.route("/bulk-upload/<exercise_id>", methods=["POST"])
+def bulk_upload_seft_collection_instruments(exercise_id):
+    """
+    Uploads reporting unit specific SEFT collection instruments for an exercise in one request, either as repeated
+    'files' parts or as a zip 'archive' part. Each file's ru_ref is looked up in the manifest (a JSON object of file
+    name to ru_ref, sent as a 'manifest' form field or as manifest.json in the archive), otherwise it's the file name
+    without its extension (e.g. 49900000001.xlsx).
+
+    :param exercise_id: An exercise id (UUID)
+    :return: 200 if every file was uploaded, 207 if only some were, 400 if none were, with the per-file results
+    """
+    files, manifest = _bulk_upload_files_and_manifest()
+    if not files:
+        raise RasError("No files to upload", 400)
+    if len(files) > current_app.config["BULK_UPLOAD_MAX_FILES"]:
+        raise RasError(f"Can't upload more than {current_app.config['BULK_UPLOAD_MAX_FILES']} files at once", 400)
+
+    manifest = manifest or {}
+    files = [(file, manifest.get(file.filename, os.path.splitext(file.filename)[0])) for file in files]
+    classifiers = request.args.get("classifiers")
+    results = CollectionInstrument().bulk_upload_seft_to_bucket(exercise_id, files, classifiers=classifiers)
+
+    uploaded = sum(result["status"] == BULK_UPLOAD_UPLOADED for result in results)
+    if uploaded and not collection_exercise_instrument_update_request("ADD", exercise_id):
+        log.error("Failed to publish upload message", collection_exercise_id=exercise_id, uploaded=uploaded)
+        raise RasError("Failed to publish upload message", 500)
+
+    if uploaded == len(results):
+        status = HTTPStatus.OK
+    elif uploaded:
+        status = HTTPStatus.MULTI_STATUS
+    else:
+        status = HTTPStatus.BAD_REQUEST
+    return make_response(
+        jsonify({"uploaded": uploaded, "not_uploaded": len(results) - uploaded, "files": results}), status
+    )
+
+
+def _bulk_upload_files_and_manifest():
+    manifest = request.form.get("manifest")
+    if manifest:
+        manifest = parse_bulk_upload_manifest(manifest)
+    archive = request.files.get("archive")
+    if archive:
+        config = current_app.config
+        files, archive_manifest = files_from_zip_archive(
+            archive.stream,
+            config["BULK_UPLOAD_MAX_FILES"],
+            config["UPLOAD_FILE_EXTENSIONS"],
+            config["BULK_UPLOAD_MAX_FILE_SIZE"],
+            config["BULK_UPLOAD_MAX_ARCHIVE_SIZE"],
+        )
+        return files, manifest or archive_manifest
+    return request.files.getlist("files"), manifest
+
+
 @collection_instrument_view.route("/<instrument_id>", methods=["PATCH"])
 def patch_collection_instrument(instrument_id):
     file = request.files["file"]
@@ -81,8 +158,7 @@ def update_exercise_eq_instruments_(exercise_id):
 @collection_instrument_view.route("/link-exercise/<instrument_id>/<exercise_id>", methods=["POST"])
 def link_collection_instrument(instrument_id, exercise_id):
     CollectionInstrument().link_instrument_to_exercise(instrument_id, exercise_id)
-    response = collection_exercise_instrument_update_request("ADD", exercise_id)
-    if response.status_code != 200:
+    if not collection_exercise_instrument_update_request("ADD", exercise_id):
         log.error("Failed to publish upload message", instrument_id=instrument_id, collection_exercise_id=exercise_id)
         raise RasError("Failed to publish upload message", 500)
     return make_response(LINK_SUCCESSFUL, 200)
@@ -123,14 +199,46 @@ def download_csv(exercise_id):
     return make_response(NO_INSTRUMENT_FOR_EXERCISE, 404)
 
 
+@collection_instrument_view.route("/manifest/collection-exercise/<exercise_id>", methods=["GET"])
+def collection_exercise_manifest(exercise_id):
+    manifest = CollectionInstrument().get_manifest_by_exercise_id(exercise_id)
+
+    if manifest:
+        return make_response(jsonify(manifest), 200)
+
+    return make_response(NO_INSTRUMENT_FOR_EXERCISE, 404)
+
+
 @collection_instrument_view.route("/collectioninstrument", methods=["GET"])
 def collection_instrument_by_search_string():
     search_string = request.args.get("searchString")
     limit = request.args.get("limit")
+    if request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+        return _stream_collection_instruments(search_string, limit)
     instruments = CollectionInstrument().get_instrument_by_search_string(search_string, limit)
     return make_response(jsonify(instruments), 200)
 
 
+def _stream_collection_instruments(search_string, limit):
+    """Streams the search results as newline delimited JSON, one instrument per line"""
+    instruments = CollectionInstrument().stream_instrument_by_search_string(search_string, limit)
+    # Running the query up to the first instrument before the response starts means errors still get their status
+    first = next(instruments, None)
+
+    def generate():
+        if first is None:
+            return
+        try:
+            yield current_app.json.dumps(first) + "\n"
+            for instrument in instruments:
+                yield current_app.json.dumps(instrument) + "\n"
+        finally:
+            # Ends the database session, still in the request context, if the client goes away part way through
+            instruments.close()
+
+    return current_app.response_class(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
 @collection_instrument_view.route("/collectioninstrument/count", methods=["GET"])
 def count_collection_instruments_by_search_string():
     search_string = request.args.get("searchString")
@@ -138,6 +246,28 @@ def count_collection_instruments_by_search_string():
     return make_response(str(len(instruments)), 200)
 
 
+@collection_instrument_view.route("/collectioninstrument/batch", methods=["POST"])
+def collection_instruments_by_ids():
+    """
+    Looks up many collection instruments at once, given as a JSON object with a list of instrument ids, e.g.
+    {"ids": ["<instrument id>", ...]}
+
+    :return: the instruments keyed by id, and the ids that weren't found
+    """
+    payload = request.get_json(silent=True)
+    instrument_ids = payload.get("ids") if isinstance(payload, dict) else None
+    if not isinstance(instrument_ids, list) or not instrument_ids:
+        raise RasError("A non empty list of ids is required", 400)
+    if not all(isinstance(instrument_id, str) for instrument_id in instrument_ids):
+        raise RasError("Instrument ids must be strings", 400)
+    max_ids = current_app.config["INSTRUMENT_BATCH_MAX_IDS"]
+    if len(instrument_ids) > max_ids:
+        raise RasError(f"No more than {max_ids} ids can be given", 400)
+
+    instruments, not_found = CollectionInstrument().get_instruments_json_by_ids(instrument_ids)
+    return make_response(jsonify({"instruments": instruments, "not_found": not_found}), 200)
+
+
 @collection_instrument_view.route("/<instrument_id>", methods=["GET"])
 @collection_instrument_view.route("/collectioninstrument/id/<instrument_id>", methods=["GET"])
 def collection_instrument_by_id(instrument_id):
@@ -3,20 +3,87 @@ import os
 
 from flask import Blueprint, current_app, jsonify, make_response
 
+from application.controllers.invalidation_bus import INVALIDATION_LISTENER
+from application.controllers.search_cache import get_search_cache
+from application.controllers.service_helper import SURVEY_DETAILS_CACHE
+from application.metrics import latest_metrics
+from application.warm_up import WARM_UP
+
 info_view = Blueprint("info_view", __name__)
 
+GIT_INFO = "git_info"
+
 
 @info_view.route("/info", methods=["GET"])
 def get_info():
-    git_info = {}
-    if os.path.exists("git_info"):
-        with open("git_info") as io:
-            git_info = json.loads(io.read())
-
     app_info = {
         "name": "ras-collection-instrument",
         "version": current_app.config["VERSION"],
     }
-    info = dict(git_info, **app_info)
+    info = dict(_git_info(), **app_info)
 
     return make_response(jsonify(info), 200)
+
+
+@info_view.route("/health/live", methods=["GET"])
+def get_liveness():
+    """The worker is serving requests. Nothing is checked, so a slow dependency doesn't get a worker restarted"""
+    return make_response(jsonify({"status": "UP"}), 200)
+
+
+@info_view.route("/health/ready", methods=["GET"])
+def get_readiness():
+    """
+    Whether the worker has warmed up and should be sent traffic, along with its database pool, invalidation listener
+    and cache stats. All of it is read from memory, so the probe never waits on the database.
+    """
+    warm_up = current_app.extensions.get(WARM_UP)
+    ready = warm_up is None or warm_up.ready.is_set()
+    health = {
+        "status": "UP" if ready else "DOWN",
+        "warm_up": warm_up.snapshot() if warm_up else None,
+        "database_pool": _pool_stats(),
+        "invalidation_listener": _listener_stats(),
+        "caches": {
+            "search_results": len(get_search_cache().entries),
+            "survey_details": len(current_app.extensions.get(SURVEY_DETAILS_CACHE, {})),
+        },
+    }
+    return make_response(jsonify(health), 200 if ready else 503)
+
+
+@info_view.route("/metrics", methods=["GET"])
+def get_metrics():
+    metrics, content_type = latest_metrics()
+    return make_response(metrics, 200, {"Content-Type": content_type})
+
+
+def _git_info():
+    # git_info is written into the image when it's built, so it's only read once
+    if GIT_INFO not in current_app.extensions:
+        git_info = {}
+        if os.path.exists("git_info"):
+            with open("git_info") as io:
+                git_info = json.loads(io.read())
+        current_app.extensions[GIT_INFO] = git_info
+    return current_app.extensions[GIT_INFO]
+
+
+def _pool_stats():
+    db = getattr(current_app, "db", None)
+    if db is None:
+        return None
+    pool = db.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
+
+
+def _listener_stats():
+    listener = current_app.extensions.get(INVALIDATION_LISTENER)
+    if listener is None:
+        return None
+    return {"channel": listener.channel, "listening": listener.listening.is_set()}
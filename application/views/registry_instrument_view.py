@@ -1,15 +1,19 @@
 import logging
+import re
+from collections import Counter
 from http import HTTPStatus
 
 import structlog
-from flask import Blueprint, Response, jsonify, make_response, request
+from flask import Blueprint, Response, current_app, jsonify, make_response, request
 from werkzeug.exceptions import BadRequest
 
+from application.compression import compress_response
 from application.controllers.basic_auth import auth
 from application.controllers.registry_instrument import RegistryInstrument
 from application.controllers.registry_instrument_validator import (
     validate_registry_instrument_payload,
 )
+from application.exceptions import RasError
 
 log = structlog.wrap_logger(logging.getLogger(__name__))
 
@@ -22,6 +26,9 @@ def before_registry_instrument_view():
     pass
 
 
+registry_instrument_view.after_request(compress_response)
+
+
 @registry_instrument_view.route("/registry-instrument/exercise-id/<exercise_id>", methods=["GET"])
 def get_registry_instruments(exercise_id):
     """
@@ -29,17 +36,64 @@ def get_registry_instruments(exercise_id):
 
     :param exercise_id: An exercise id (UUID)
     """
+    etag = _registry_instruments_etag(exercise_id)
+    if request.if_none_match.contains_weak(etag):
+        return _cacheable(make_response("", HTTPStatus.NOT_MODIFIED), etag)
+
     registry_instruments = RegistryInstrument().get_by_exercise_id(exercise_id)
 
+    return _cacheable(make_response(jsonify(registry_instruments), HTTPStatus.OK), etag)
+
+
+@registry_instrument_view.route("/registry-instrument/exercise-ids", methods=["GET"])
+def get_registry_instruments_for_exercises():
+    """
+    Returns the selected CIR instruments for each of the collection exercises given as repeated exercise_id query
+    parameters, e.g. ?exercise_id=<uuid>&exercise_id=<uuid>, grouped by exercise id.
+    """
+    registry_instruments = RegistryInstrument().get_by_exercise_ids(_exercise_ids_from_args())
+
     return make_response(jsonify(registry_instruments), HTTPStatus.OK)
 
 
+@registry_instrument_view.route("/registry-instrument/guid/<guid>", methods=["GET"])
+def get_registry_instruments_by_guid(guid):
+    """
+    Returns the selected CIR instruments for a CIR version, i.e. the exercises that have selected it, a page at a time.
+    Pass the returned next cursor as the after query parameter to get the following page.
+
+    :param guid: The CIR guid (UUID)
+    """
+    registry_instruments, next_cursor = RegistryInstrument().get_page_by_guid(
+        guid, _page_limit_from_args(), after=request.args.get("after")
+    )
+    return make_response(jsonify({"registry_instruments": registry_instruments, "next": next_cursor}), HTTPStatus.OK)
+
+
+@registry_instrument_view.route("/registry-instrument/instrument-id/<instrument_id>", methods=["GET"])
+def get_registry_instruments_by_instrument_id(instrument_id):
+    """
+    Returns the selected CIR instruments for a collection instrument, a page at a time.
+    Pass the returned next cursor as the after query parameter to get the following page.
+
+    :param instrument_id: The collection instrument id (UUID)
+    """
+    registry_instruments, next_cursor = RegistryInstrument().get_page_by_instrument_id(
+        instrument_id, _page_limit_from_args(), after=request.args.get("after")
+    )
+    return make_response(jsonify({"registry_instruments": registry_instruments, "next": next_cursor}), HTTPStatus.OK)
+
+
 @registry_instrument_view.route("/registry-instrument/exercise-id/<exercise_id>/formtype/<form_type>", methods=["GET"])
 def get_registry_instrument(exercise_id, form_type):
+    etag = _registry_instruments_etag(exercise_id)
+    if request.if_none_match.contains_weak(etag):
+        return _cacheable(make_response("", HTTPStatus.NOT_MODIFIED), etag)
+
     registry_instrument = RegistryInstrument().get_by_exercise_id_and_formtype(exercise_id, form_type)
 
     if registry_instrument:
-        return make_response(jsonify(registry_instrument), HTTPStatus.OK)
+        return _cacheable(make_response(jsonify(registry_instrument), HTTPStatus.OK), etag)
 
     return make_response("Not Found", HTTPStatus.NOT_FOUND)
 
@@ -95,6 +149,81 @@ def put_registry_instrument(exercise_id):
     return make_response("Registry instrument failed to save successfully", HTTPStatus.INTERNAL_SERVER_ERROR)
 
 
+@registry_instrument_view.route("/registry-instrument/bulk/exercise-id/<exercise_id>", methods=["PUT"])
+def put_registry_instruments(exercise_id):
+    """
+    Creates or updates a set of selected CIR instruments for the given collection exercise in one go.
+    The payload is an array of registry instruments, each in the format accepted for a single save, with at most one
+    per form type. Nothing is saved unless every registry instrument is valid.
+
+    :param exercise_id: An exercise id (UUID)
+    :return: 200 with the created and updated counts and the status of each registry instrument,
+             400 if the payload is invalid
+    """
+
+    try:
+        payload = request.get_json(force=True)
+    except BadRequest:
+        return make_response("Invalid JSON payload", HTTPStatus.BAD_REQUEST)
+
+    if not isinstance(payload, list) or not payload:
+        return make_response("Payload must be a non-empty array of registry instruments", HTTPStatus.BAD_REQUEST)
+
+    errors = []
+    for index, registry_instrument in enumerate(payload):
+        if not isinstance(registry_instrument, dict):
+            errors.append(f"Registry instrument {index}: not an object")
+            continue
+        is_valid, error = validate_registry_instrument_payload(registry_instrument, exercise_id)
+        if not is_valid:
+            errors.append(f"Registry instrument {index}: {error}")
+    if errors:
+        return make_response(jsonify({"errors": errors}), HTTPStatus.BAD_REQUEST)
+
+    form_types = Counter(str(registry_instrument["classifier_value"]) for registry_instrument in payload)
+    duplicates = sorted(form_type for form_type, count in form_types.items() if count > 1)
+    if duplicates:
+        return make_response(
+            jsonify({"errors": [f"Form type {form_type} given more than once" for form_type in duplicates]}),
+            HTTPStatus.BAD_REQUEST,
+        )
+
+    saved = RegistryInstrument().bulk_save_for_exercise_id(exercise_id, payload)
+
+    results = [
+        {
+            "classifier_type": classifier_type,
+            "classifier_value": classifier_value,
+            "status": "CREATED" if is_new else "UPDATED",
+        }
+        for classifier_type, classifier_value, is_new in saved
+    ]
+    created = sum(is_new for _, _, is_new in saved)
+    return make_response(
+        jsonify({"created": created, "updated": len(saved) - created, "registry_instruments": results}),
+        HTTPStatus.OK,
+    )
+
+
+@registry_instrument_view.route("/registry-instrument/exercise-id/<exercise_id>", methods=["DELETE"])
+def delete_registry_instruments(exercise_id):
+    """
+    Deletes the selected CIR instruments for the given collection exercise. Repeated form_type query parameters,
+    e.g. ?form_type=0001&form_type=0002, limit it to those form types.
+
+    :param exercise_id: An exercise id (UUID)
+    :return: 200 with the number of registry instruments deleted, which may be 0
+    """
+    form_types = request.args.getlist("form_type")
+    invalid_form_types = [form_type for form_type in form_types if not re.fullmatch(r"\d{4}", form_type)]
+    if invalid_form_types:
+        return make_response(f"Invalid form types: {', '.join(invalid_form_types)}", HTTPStatus.BAD_REQUEST)
+
+    deleted = RegistryInstrument().delete_by_exercise_id(exercise_id, form_types=form_types or None)
+
+    return make_response(jsonify({"deleted": deleted}), HTTPStatus.OK)
+
+
 @registry_instrument_view.route(
     "/registry-instrument/exercise-id/<exercise_id>/formtype/<form_type>", methods=["DELETE"]
 )
@@ -111,3 +240,48 @@ def delete_registry_instrument(exercise_id, form_type):
 @registry_instrument_view.route("/registry-instrument/count/exercise-id/<exercise_id>", methods=["GET"])
 def registry_instrument_count(exercise_id: str) -> Response:
     return make_response(RegistryInstrument().get_count_by_exercise_id(exercise_id), HTTPStatus.OK)
+
+
+@registry_instrument_view.route("/registry-instrument/count/exercise-ids", methods=["GET"])
+def registry_instrument_counts() -> Response:
+    """
+    Returns the count of selected CIR instruments for each of the collection exercises given as repeated exercise_id
+    query parameters, e.g. ?exercise_id=<uuid>&exercise_id=<uuid>
+    """
+    counts = RegistryInstrument().get_counts_by_exercise_ids(_exercise_ids_from_args())
+    return make_response(jsonify({"registry_instrument_counts": counts}), HTTPStatus.OK)
+
+
+def _exercise_ids_from_args():
+    exercise_ids = request.args.getlist("exercise_id")
+    if not exercise_ids:
+        raise RasError("At least one exercise_id is required", 400)
+    max_exercise_ids = current_app.config["REGISTRY_INSTRUMENT_MAX_EXERCISE_IDS"]
+    if len(exercise_ids) > max_exercise_ids:
+        raise RasError(f"No more than {max_exercise_ids} exercise_ids can be given", 400)
+    return exercise_ids
+
+
+def _page_limit_from_args():
+    max_limit = current_app.config["REGISTRY_INSTRUMENT_MAX_PAGE_SIZE"]
+    limit = request.args.get("limit", max_limit)
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise RasError("limit must be a number", 400)
+    if not 1 <= limit <= max_limit:
+        raise RasError(f"limit must be between 1 and {max_limit}", 400)
+    return limit
+
+
+def _registry_instruments_etag(exercise_id):
+    # Probed before the registry instruments are read, so a concurrent change can only make the ETag stale, never
+    # newer than the body it goes out with
+    return f"{exercise_id}-{RegistryInstrument().get_revision_by_exercise_id(exercise_id)}"
+
+
+def _cacheable(response, etag):
+    response.set_etag(etag)
+    # Clients may keep the response but must revalidate it, which costs a revision lookup when it hasn't changed
+    response.headers["Cache-Control"] = "no-cache"
+    return response
@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import structlog
+from sqlalchemy import text
+
+from application.controllers.service_helper import get_survey_details
+from application.controllers.session_decorator import with_db_session
+from application.controllers.sql_queries import query_survey_ids_with_recent_instruments
+
+log = structlog.wrap_logger(logging.getLogger(__name__))
+
+WARM_UP = "warm_up"
+PENDING = "pending"
+RUNNING = "running"
+READY = "ready"
+
+
+class WarmUp:
+    """
+    Readies a freshly started worker before it's sent traffic. It opens the database pool's connections, so the first
+    requests don't wait for them, then gets the details of the surveys with recent instruments into the survey
+    details cache, so the first downloads and uploads don't all call the survey service at once.
+
+    Both are only optimisations, so a step that fails is logged and counted and the worker is still made ready.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.state = PENDING
+        self.ready = threading.Event()
+        self.connections_opened = 0
+        self.surveys_resolved = 0
+        self.errors = 0
+        self.duration = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        self.state = RUNNING
+        start = time.monotonic()
+        with self.app.app_context():
+            self._open_connections()
+            self._resolve_recent_surveys()
+        self.duration = time.monotonic() - start
+        self.state = READY
+        self.ready.set()
+        log.info(
+            "Warm-up complete",
+            connections_opened=self.connections_opened,
+            surveys_resolved=self.surveys_resolved,
+            errors=self.errors,
+            duration=round(self.duration, 3),
+        )
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "connections_opened": self.connections_opened,
+            "surveys_resolved": self.surveys_resolved,
+            "errors": self.errors,
+            "duration": self.duration,
+        }
+
+    def _open_connections(self):
+        # Connections are only opened when they're checked out, so all of them are held at once before they're returned
+        connections = []
+        try:
+            for _ in range(self.app.db.pool.size()):
+                connection = self.app.db.connect()
+                connections.append(connection)
+                connection.execute(text("SELECT 1"))
+        except Exception:
+            log.exception("Failed to open database connections during warm-up")
+            self.errors += 1
+        finally:
+            for connection in connections:
+                connection.close()
+        self.connections_opened = len(connections)
+
+    def _resolve_recent_surveys(self):
+        try:
+            survey_ids = _recent_survey_ids(
+                datetime.now() - timedelta(days=self.app.config["WARM_UP_RECENT_DAYS"]),
+                self.app.config["WARM_UP_MAX_SURVEYS"],
+            )
+        except Exception:
+            log.exception("Failed to find surveys with recent instruments during warm-up")
+            self.errors += 1
+            return
+        for survey_id in survey_ids:
+            try:
+                get_survey_details(survey_id)
+                self.surveys_resolved += 1
+            except Exception:
+                log.exception("Failed to get survey details during warm-up", survey_id=survey_id)
+                self.errors += 1
+
+
+@with_db_session
+def _recent_survey_ids(since, limit, session=None):
+    return query_survey_ids_with_recent_instruments(since, limit, session)
+
+
+def start_warm_up(app):
+    """
+    Starts warming up the app in the background if WARM_UP_ENABLED, otherwise it's ready straight away
+
+    :param app: the app, with its database initialised
+    :return: the WarmUp
+    """
+    warm_up = WarmUp(app)
+    app.extensions[WARM_UP] = warm_up
+    if app.config["WARM_UP_ENABLED"]:
+        warm_up.start()
+    else:
+        warm_up.state = READY
+        warm_up.ready.set()
+    return warm_up
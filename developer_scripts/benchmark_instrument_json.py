@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Compares the per instrument cost of building InstrumentModel.json from the ORM (the instruments loaded with their
+relationships eagerly) with building it from a column projection (InstrumentSummary).
+
+Synthetic instruments are added in a transaction that is rolled back at the end, so nothing is left behind. Run from
+the repository root against a database the service has already created its tables in:
+
+    python developer_scripts/benchmark_instrument_json.py --instruments 2000 --repeat 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from sqlalchemy.orm import joinedload, selectinload
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from application.controllers.sql_queries import (  # noqa: E402
+    query_instrument_summaries_by_ids,
+)
+from application.models.models import (  # noqa: E402
+    BusinessModel,
+    ExerciseModel,
+    InstrumentModel,
+    SEFTModel,
+    SurveyModel,
+)
+from run import create_app  # noqa: E402
+
+
+def add_instruments(session, count, businesses_per_instrument):
+    survey = SurveyModel(survey_id="8f8e8ed4-a1c5-4d0f-9c4a-3e0f4e2f0b6a")
+    exercise = ExerciseModel(exercise_id="7d6e0c33-3b63-4a4f-8dc9-2c7b8d58c4a1")
+    instrument_ids = []
+    for i in range(count):
+        instrument = InstrumentModel(classifiers={"form_type": f"{i % 10000:04}"}, ci_type="SEFT")
+        instrument.survey = survey
+        instrument.exercises.append(exercise)
+        instrument.seft_file = SEFTModel(instrument_id=instrument.instrument_id, file_name=f"{i}.xlsx", length=999)
+        for j in range(businesses_per_instrument):
+            instrument.businesses.append(BusinessModel(ru_ref=f"{i:06}{j:05}"))
+        session.add(instrument)
+        instrument_ids.append(instrument.instrument_id)
+    session.flush()
+    session.expunge_all()
+    return instrument_ids
+
+
+def orm_json(instrument_ids, session):
+    # The instruments with everything InstrumentModel.json reads eagerly loaded, so it's four queries for any number
+    instruments = (
+        session.query(InstrumentModel)
+        .options(
+            joinedload(InstrumentModel.survey),
+            selectinload(InstrumentModel.businesses),
+            selectinload(InstrumentModel.exercises),
+        )
+        .filter(InstrumentModel.instrument_id.in_(instrument_ids))
+        .all()
+    )
+    return [instrument.json for instrument in instruments]
+
+
+def projection_json(instrument_ids, session):
+    return [instrument.json for instrument in query_instrument_summaries_by_ids(instrument_ids, session)]
+
+
+def time_path(path, instrument_ids, session, repeat):
+    timings = []
+    for _ in range(repeat):
+        # Clear the identity map so every run hydrates the instruments from scratch, as a request would
+        session.expunge_all()
+        start = time.perf_counter()
+        path(instrument_ids, session)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def print_timings(name, timings, rows):
+    per_row = [timing / rows * 1_000_000 for timing in timings]
+    print(
+        f"{name:<11} median {statistics.median(timings) * 1000:8.1f} ms, "
+        f"{statistics.median(per_row):6.1f} us/instrument (min {min(per_row):.1f}, max {max(per_row):.1f})"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark InstrumentModel.json against the projection read path")
+    parser.add_argument("--config", default=os.environ.get("APP_SETTINGS", "Config"), help="Config class to use")
+    parser.add_argument("--instruments", type=int, default=1000, help="Number of synthetic instruments")
+    parser.add_argument("--businesses", type=int, default=1, help="ru_refs per instrument")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs of each path")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    app = create_app(args.config)
+    session = app.db.session()
+    try:
+        instrument_ids = add_instruments(session, args.instruments, args.businesses)
+        # Both paths must produce the same json for the comparison to mean anything
+        key = lambda instrument_json: instrument_json["id"]  # noqa: E731
+        if sorted(orm_json(instrument_ids, session), key=key) != sorted(
+            projection_json(instrument_ids, session), key=key
+        ):
+            sys.exit("The ORM and projection json differ")
+        print(f"{args.instruments} instruments, {args.businesses} ru_refs each, median of {args.repeat} runs")
+        print_timings("ORM", time_path(orm_json, instrument_ids, session, args.repeat), args.instruments)
+        print_timings("projection", time_path(projection_json, instrument_ids, session, args.repeat), args.instruments)
+    finally:
+        session.rollback()
+        session.close()
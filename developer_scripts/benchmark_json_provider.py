@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Compares serialising collection instrument responses with Flask's default JSON provider and with FastJSONProvider.
+
+The rows have the shapes returned by /collectioninstrument (a search) and /<instrument_id>, with UUIDs and datetimes
+as they come from the database, so no database is needed:
+
+    python developer_scripts/benchmark_json_provider.py --rows 10000 --repeat 10
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from application.json_provider import FastJSONProvider  # noqa: E402
+from run import create_app  # noqa: E402
+
+
+def search_rows(count):
+    survey_id = uuid.uuid4()
+    return [
+        {
+            "id": uuid.uuid4(),
+            "file_name": f"{i:011}.xlsx",
+            "type": "SEFT",
+            "classifiers": {"form_type": f"{i % 10000:04}", "RU_REF": [], "COLLECTION_EXERCISE": []},
+            "surveyId": survey_id,
+        }
+        for i in range(count)
+    ]
+
+
+def instrument_rows(count):
+    survey_id = uuid.uuid4()
+    exercise_id = uuid.uuid4()
+    stamp = datetime(2024, 1, 1)
+    return [
+        {
+            "id": uuid.uuid4(),
+            "file_name": f"{i:011}.xlsx",
+            "len": 5462,
+            "stamp": stamp + timedelta(seconds=i),
+            "survey": survey_id,
+            "businesses": [f"{i:011}"],
+            "exercises": [exercise_id],
+            "classifiers": {"form_type": f"{i % 10000:04}"},
+            "type": "SEFT",
+        }
+        for i in range(count)
+    ]
+
+
+def time_response(app, provider, rows, repeat):
+    timings = []
+    with app.app_context():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            provider.response(rows).get_data()
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Flask's default JSON provider against FastJSONProvider")
+    parser.add_argument("--rows", type=int, default=10000, help="Instruments per response")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed runs of each provider")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    app = create_app("TestingConfig", init_db=False)
+    # Compact responses, as served outside of debug
+    app.debug = False
+    providers = {"default": DefaultJSONProvider(app), "fast": FastJSONProvider(app)}
+    print(f"{args.rows} rows, median of {args.repeat} runs")
+    for shape, rows in (("search", search_rows(args.rows)), ("instrument", instrument_rows(args.rows))):
+        timings = {name: time_response(app, provider, rows, args.repeat) for name, provider in providers.items()}
+        print(
+            f"{shape:<11} default {timings['default'] * 1000:7.1f} ms, fast {timings['fast'] * 1000:7.1f} ms "
+            f"({timings['default'] / timings['fast']:.1f}x)"
+        )
@@ -1,68 +1,242 @@
 #!/usr/bin/env python
+"""
+Bulk loads test reporting unit specific SEFT collection instruments into a collection instrument service.
+
+An xlsx is generated in memory for each ru_ref in the ru_ref file and uploaded by a pool of workers, each keeping its
+own keep-alive session. Every uploaded ru_ref is appended to a checkpoint file, so re-running the same command after an
+interruption or failures only uploads what is left. Throughput and latency percentiles are printed at the end.
+
+    python import.py --url http://localhost:8002 --exercise-id 14fb3e68-4dca-46db-bf49-04b84e07e77c --workers 8
+
+Any option that isn't given is prompted for. With --batch-size greater than 1 the files are sent to the bulk upload
+end point, that many per request.
+"""
+
+import argparse
+import getpass
 import os
+import statistics
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
 
 import requests
 import xlsxwriter
+from requests.adapters import HTTPAdapter
 
 END_POINT = "{}/collection-instrument-api/1.0.2/upload/{}/{}"
+BULK_END_POINT = "{}/collection-instrument-api/1.0.2/bulk-upload/{}"
 FILE_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+DEFAULT_RU_REF_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ru_ref_import.txt")
+
+
+class Checkpoint:
+    """The ru_refs already uploaded for an exercise, persisted one per line as they complete"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as io:
+                self.done = {line.strip() for line in io if line.strip()}
+
+    def record(self, ru_refs):
+        with self.lock:
+            with open(self.path, "a") as io:
+                io.writelines(f"{ru_ref}\n" for ru_ref in ru_refs)
+                io.flush()
+                os.fsync(io.fileno())
+            self.done.update(ru_refs)
 
 
-def upload_test_collection_instruments(app_url, exercise_id, basic_auth_username, basic_auth_password):
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.uploaded = 0
+        self.failed = []
+
+    def add(self, latency, uploaded, failed):
+        with self.lock:
+            self.latencies.append(latency)
+            self.uploaded += uploaded
+            self.failed.extend(failed)
+
+
+def upload_test_collection_instruments(
+    app_url,
+    exercise_id,
+    basic_auth_username,
+    basic_auth_password,
+    ru_ref_file=DEFAULT_RU_REF_FILE,
+    workers=4,
+    batch_size=1,
+    checkpoint_file=None,
+):
     """
-    This function takes the values in 'ru_ref_import.txt' creates a xls for each and then uploads them
-    to the desired application.
+    Creates an xlsx for each ru_ref in the ru_ref file and uploads them to the desired application.
+
     :param app_url: The url of the application, should not include end point
     :param exercise_id: The exercise id of the upload
     :param basic_auth_username: The basic auth username for the service
     :param basic_auth_password: The basic auth password for the service
+    :param ru_ref_file: File of quoted ru_refs, one per line
+    :param workers: The number of concurrent uploads
+    :param batch_size: The number of files per request, more than 1 uses the bulk upload end point
+    :param checkpoint_file: Where uploaded ru_refs are recorded, defaults to <exercise_id>.checkpoint
+    :return: True if every ru_ref has been uploaded
     """
+    checkpoint = Checkpoint(checkpoint_file or f"{exercise_id}.checkpoint")
+    all_ru_refs = read_ru_refs(ru_ref_file)
+    ru_refs = [ru_ref for ru_ref in all_ru_refs if ru_ref not in checkpoint.done]
+    # Only this run's ru_refs, as the checkpoint can hold others (e.g. from an earlier, longer ru_ref file)
+    skipped = len(all_ru_refs) - len(ru_refs)
+    print(f"{len(ru_refs)} to upload, {skipped} already uploaded according to {checkpoint.path}")
 
-    with open("ru_ref_import.txt") as io:
-        while True:
-            line_data = io.readline()
-            if not line_data:
-                break
-            ru_ref = line_data.split('"')[1]
-            file_name = ru_ref + ".xlsx"
-            create_xls_file(file_name, ru_ref)
-
-            file = {"file": (file_name, open(file_name, "rb"), FILE_TYPE)}
-            request_url = END_POINT.format(app_url, exercise_id, ru_ref)
-            auth = (basic_auth_username, basic_auth_password)
-            response = requests.post(request_url, files=file, auth=auth)
-
-            if response.status_code != 200:
-                print('%% upload error "{}" - "{}"'.format(response.status_code, response.text))
-                os.remove(file_name)
-                exit(1)
+    sessions = threading.local()
+    auth = (basic_auth_username, basic_auth_password)
 
+    def get_session():
+        if not hasattr(sessions, "session"):
+            session = requests.Session()
+            session.auth = auth
+            session.mount(app_url, HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            sessions.session = session
+        return sessions.session
+
+    def upload(batch):
+        start = time.perf_counter()
+        try:
+            if batch_size > 1:
+                uploaded, failed = _post_bulk(get_session(), app_url, exercise_id, batch)
+            else:
+                uploaded, failed = _post_single(get_session(), app_url, exercise_id, batch[0])
+        except requests.RequestException as e:
+            uploaded, failed = [], [(ru_ref, str(e)) for ru_ref in batch]
+        if uploaded:
+            checkpoint.record(uploaded)
+        stats.add(time.perf_counter() - start, len(uploaded), failed)
+        return len(batch)
+
+    stats = Stats()
+    batches = [ru_refs[start:end] for start, end in _batch_bounds(len(ru_refs), batch_size)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        completed = 0
+        for future in as_completed([executor.submit(upload, batch) for batch in batches]):
+            completed += future.result()
             # A visual guide so the user knows something is uploading
-            print(".", end="")
+            print(f"\r{completed}/{len(ru_refs)}", end="")
             sys.stdout.flush()
+    print()
+
+    print_summary(stats, time.perf_counter() - started, skipped)
+    return not stats.failed
+
 
-            # Removes the xls file created
-            os.remove(file_name)
+def _batch_bounds(total, batch_size):
+    for start in range(0, total, batch_size):
+        yield start, min(start + batch_size, total)
 
 
-def create_xls_file(file_name, ru_ref):
+def _post_single(session, app_url, exercise_id, ru_ref):
+    file_name = ru_ref + ".xlsx"
+    file = {"file": (file_name, create_xls_file(ru_ref), FILE_TYPE)}
+    response = session.post(END_POINT.format(app_url, exercise_id, ru_ref), files=file)
+    if response.status_code != 200:
+        return [], [(ru_ref, f"{response.status_code} - {response.text}")]
+    return [ru_ref], []
+
+
+def _post_bulk(session, app_url, exercise_id, ru_refs):
+    files = [("files", (ru_ref + ".xlsx", create_xls_file(ru_ref), FILE_TYPE)) for ru_ref in ru_refs]
+    response = session.post(BULK_END_POINT.format(app_url, exercise_id), files=files)
+    if response.status_code not in (200, 207, 400) or "files" not in response.json():
+        return [], [(ru_ref, f"{response.status_code} - {response.text}") for ru_ref in ru_refs]
+    uploaded, failed = [], []
+    for result in response.json()["files"]:
+        if result["status"] == "UPLOADED":
+            uploaded.append(result["ru_ref"])
+        else:
+            failed.append((result["ru_ref"], "; ".join(result["errors"])))
+    return uploaded, failed
+
+
+def read_ru_refs(ru_ref_file):
     """
-    Creates a xls file with data
-    :param file_name: The file name of the xls
-    :param ru_ref: The ru_ref, which is inserted into the xls document
+    Reads the ru_refs to upload
+
+    :param ru_ref_file: File with one ru_ref per line, optionally in double quotes
+    :return: list of ru_refs
+    """
+    with open(ru_ref_file) as io:
+        return [line.strip().strip('"') for line in io if line.strip()]
+
+
+def create_xls_file(ru_ref):
     """
+    Creates a xls file in memory with data
 
-    workbook = xlsxwriter.Workbook(file_name)
+    :param ru_ref: The ru_ref, which is inserted into the xls document
+    :return: the xlsx file contents
+    """
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
     worksheet = workbook.add_worksheet()
     worksheet.set_column("A:A", 25)
     worksheet.write("A1", "RU_REF = {}".format(ru_ref))
     workbook.close()
+    return output.getvalue()
+
+
+def print_summary(stats, elapsed, skipped):
+    files = stats.uploaded + len(stats.failed)
+    print(f"Uploaded {stats.uploaded}, failed {len(stats.failed)}, skipped {skipped} in {elapsed:.1f}s")
+    if elapsed and files:
+        print(f"Throughput {stats.uploaded / elapsed:.1f} files/s, {len(stats.latencies) / elapsed:.1f} requests/s")
+    if len(stats.latencies) > 1:
+        percentiles = statistics.quantiles(stats.latencies, n=100, method="inclusive")
+        print(
+            "Request latency ms: "
+            f"p50 {percentiles[49] * 1000:.0f}, p90 {percentiles[89] * 1000:.0f}, "
+            f"p95 {percentiles[94] * 1000:.0f}, p99 {percentiles[98] * 1000:.0f}, max {max(stats.latencies) * 1000:.0f}"
+        )
+    for ru_ref, error in stats.failed:
+        print(f'%% upload error "{ru_ref}" - "{error}"')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load test SEFT collection instruments")
+    parser.add_argument("--url", help="App URL (i.e http://localhost:8080)")
+    parser.add_argument("--exercise-id", help="Collection exercise id (i.e 14fb3e68-4dca-46db-bf49-04b84e07e77c)")
+    parser.add_argument("--username", help="Basic Auth username")
+    parser.add_argument("--password", help="Basic Auth password, prompted for if not given")
+    parser.add_argument("--ru-refs", default=DEFAULT_RU_REF_FILE, help="File of ru_refs to upload")
+    parser.add_argument("--workers", type=int, default=4, help="Number of concurrent uploads")
+    parser.add_argument("--batch-size", type=int, default=1, help="Files per request, >1 uses bulk upload")
+    parser.add_argument("--checkpoint", help="Checkpoint file, defaults to <exercise-id>.checkpoint")
+    args = parser.parse_args(argv)
+
+    args.url = args.url or input("App URL (i.e http://localhost:8080): ")
+    args.exercise_id = args.exercise_id or input("Collection exercise id (i.e 14fb3e68-4dca-46db-bf49-04b84e07e77c):")
+    args.username = args.username or input("Basic Auth username:")
+    args.password = args.password or getpass.getpass("Basic Auth Password:")
+    return args
 
 
 if __name__ == "__main__":
-    app_url = input("App URL (i.e http://localhost:8080): ")
-    collection_exercise = input("Collection exercise id (i.e 14fb3e68-4dca-46db-bf49-04b84e07e77c):")
-    basic_auth_username = input("Basic Auth username:")
-    basic_auth_password = input("Basic Auth Password:")
-    upload_test_collection_instruments(app_url, collection_exercise, basic_auth_username, basic_auth_password)
+    args = parse_args()
+    complete = upload_test_collection_instruments(
+        args.url.rstrip("/"),
+        args.exercise_id,
+        args.username,
+        args.password,
+        ru_ref_file=args.ru_refs,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        checkpoint_file=args.checkpoint,
+    )
+    sys.exit(0 if complete else 1)
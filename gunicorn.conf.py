@@ -0,0 +1,20 @@
+"""Gunicorn server hooks, loaded from the working directory alongside the command line settings in the Dockerfile"""
+
+import os
+import shutil
+
+
+def on_starting(server):
+    # Metrics files left by a previous run would be added to this one's
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        # Drops the exited worker's live gauges, such as its requests in flight
+        multiprocess.mark_process_dead(worker.pid)
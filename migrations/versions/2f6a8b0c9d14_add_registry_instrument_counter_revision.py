@@ -0,0 +1,62 @@
+"""Add a revision to registry_instrument_counter, bumped on any registry_instrument change
+
+Revision ID: 2f6a8b0c9d14
+Revises: 7c1d9e4f2b60
+Create Date: 2026-10-19 13:41:05.774102
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "2f6a8b0c9d14"
+down_revision = "7c1d9e4f2b60"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS and OR REPLACE as a new database gets the column and trigger from the models before being upgraded
+    op.execute(
+        "ALTER TABLE ras_ci.registry_instrument_counter ADD COLUMN IF NOT EXISTS revision BIGINT NOT NULL DEFAULT 0"
+    )
+    op.execute("""CREATE OR REPLACE FUNCTION ras_ci.count_registry_instrument() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO ras_ci.registry_instrument_counter AS counter (exercise_id, count, revision)
+                VALUES (NEW.exercise_id, 1, 1)
+                ON CONFLICT (exercise_id) DO UPDATE SET count = counter.count + 1, revision = counter.revision + 1;
+            ELSIF TG_OP = 'UPDATE' THEN
+                UPDATE ras_ci.registry_instrument_counter SET revision = revision + 1
+                WHERE exercise_id = NEW.exercise_id;
+            ELSE
+                UPDATE ras_ci.registry_instrument_counter SET count = count - 1, revision = revision + 1
+                WHERE exercise_id = OLD.exercise_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql""")
+    op.execute("DROP TRIGGER IF EXISTS registry_instrument_count ON ras_ci.registry_instrument")
+    op.execute(
+        """CREATE TRIGGER registry_instrument_count AFTER INSERT OR UPDATE OR DELETE ON ras_ci.registry_instrument
+        FOR EACH ROW EXECUTE PROCEDURE ras_ci.count_registry_instrument()"""
+    )
+
+
+def downgrade():
+    op.execute("""CREATE OR REPLACE FUNCTION ras_ci.count_registry_instrument() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO ras_ci.registry_instrument_counter AS counter (exercise_id, count)
+                VALUES (NEW.exercise_id, 1)
+                ON CONFLICT (exercise_id) DO UPDATE SET count = counter.count + 1;
+            ELSE
+                UPDATE ras_ci.registry_instrument_counter SET count = count - 1 WHERE exercise_id = OLD.exercise_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql""")
+    op.execute("DROP TRIGGER IF EXISTS registry_instrument_count ON ras_ci.registry_instrument")
+    op.execute("""CREATE TRIGGER registry_instrument_count AFTER INSERT OR DELETE ON ras_ci.registry_instrument
+        FOR EACH ROW EXECUTE PROCEDURE ras_ci.count_registry_instrument()""")
+    op.drop_column("registry_instrument_counter", "revision", schema="ras_ci")
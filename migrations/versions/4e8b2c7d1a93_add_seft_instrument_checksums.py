@@ -0,0 +1,26 @@
+"""Add crc32c and md5_hash to seft_instrument
+
+Revision ID: 4e8b2c7d1a93
+Revises: 9a724381cde7
+Create Date: 2026-10-19 12:10:41.201337
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "4e8b2c7d1a93"
+down_revision = "9a724381cde7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS as a new database gets these columns from the models before being upgraded
+    op.execute("ALTER TABLE ras_ci.seft_instrument ADD COLUMN IF NOT EXISTS crc32c VARCHAR(8)")
+    op.execute("ALTER TABLE ras_ci.seft_instrument ADD COLUMN IF NOT EXISTS md5_hash VARCHAR(24)")
+
+
+def downgrade():
+    op.drop_column("seft_instrument", "md5_hash", schema="ras_ci")
+    op.drop_column("seft_instrument", "crc32c", schema="ras_ci")
@@ -0,0 +1,28 @@
+"""Add registry_instrument guid and instrument_id indexes
+
+Revision ID: 5b9e3a7f0c21
+Revises: 2f6a8b0c9d14
+Create Date: 2026-10-19 14:08:52.319460
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5b9e3a7f0c21"
+down_revision = "2f6a8b0c9d14"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS as a new database gets these indexes from the models before being upgraded
+    op.execute("""CREATE INDEX IF NOT EXISTS ix_registry_instrument_guid
+        ON ras_ci.registry_instrument (guid, exercise_id, classifier_type, classifier_value)""")
+    op.execute("""CREATE INDEX IF NOT EXISTS ix_registry_instrument_instrument_id
+        ON ras_ci.registry_instrument (instrument_id, exercise_id, classifier_type, classifier_value)""")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ras_ci.ix_registry_instrument_instrument_id")
+    op.execute("DROP INDEX IF EXISTS ras_ci.ix_registry_instrument_guid")
@@ -0,0 +1,50 @@
+"""Replace the registry_instrument_count view with a trigger maintained counter table
+
+Revision ID: 7c1d9e4f2b60
+Revises: 4e8b2c7d1a93
+Create Date: 2026-10-19 13:02:17.556210
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7c1d9e4f2b60"
+down_revision = "4e8b2c7d1a93"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("DROP VIEW IF EXISTS ras_ci.registry_instrument_count")
+    # IF NOT EXISTS and OR REPLACE as a new database gets the table and trigger from the models before being upgraded
+    op.execute("""CREATE TABLE IF NOT EXISTS ras_ci.registry_instrument_counter (
+        exercise_id UUID PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0)""")
+    op.execute("""CREATE OR REPLACE FUNCTION ras_ci.count_registry_instrument() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO ras_ci.registry_instrument_counter AS counter (exercise_id, count)
+                VALUES (NEW.exercise_id, 1)
+                ON CONFLICT (exercise_id) DO UPDATE SET count = counter.count + 1;
+            ELSE
+                UPDATE ras_ci.registry_instrument_counter SET count = count - 1 WHERE exercise_id = OLD.exercise_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql""")
+    op.execute("DROP TRIGGER IF EXISTS registry_instrument_count ON ras_ci.registry_instrument")
+    op.execute("""CREATE TRIGGER registry_instrument_count AFTER INSERT OR DELETE ON ras_ci.registry_instrument
+        FOR EACH ROW EXECUTE PROCEDURE ras_ci.count_registry_instrument()""")
+    # Creating the trigger locks out writes to registry_instrument until this commits, so the counts can't drift
+    op.execute("""INSERT INTO ras_ci.registry_instrument_counter (exercise_id, count)
+        SELECT exercise_id, count(*) FROM ras_ci.registry_instrument GROUP BY exercise_id
+        ON CONFLICT (exercise_id) DO UPDATE SET count = excluded.count""")
+
+
+def downgrade():
+    op.execute("DROP TRIGGER IF EXISTS registry_instrument_count ON ras_ci.registry_instrument")
+    op.execute("DROP FUNCTION IF EXISTS ras_ci.count_registry_instrument()")
+    op.execute("DROP TABLE IF EXISTS ras_ci.registry_instrument_counter")
+    op.execute("""CREATE VIEW ras_ci.registry_instrument_count as SELECT exercise_id, count(*) as count
+        FROM ras_ci.registry_instrument GROUP BY exercise_id; """)
@@ -0,0 +1,70 @@
+"""Count registry instruments moved between exercises against their new exercise
+
+Revision ID: 8d2f4a6b1e37
+Revises: 5b9e3a7f0c21
+Create Date: 2026-10-19 15:12:40.183529
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8d2f4a6b1e37"
+down_revision = "5b9e3a7f0c21"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # OR REPLACE as a new database gets the function from the models before being upgraded
+    op.execute("""CREATE OR REPLACE FUNCTION ras_ci.count_registry_instrument() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO ras_ci.registry_instrument_counter AS counter (exercise_id, count, revision)
+                VALUES (NEW.exercise_id, 1, 1)
+                ON CONFLICT (exercise_id) DO UPDATE SET count = counter.count + 1, revision = counter.revision + 1;
+            ELSIF TG_OP = 'UPDATE' AND OLD.exercise_id IS DISTINCT FROM NEW.exercise_id THEN
+                UPDATE ras_ci.registry_instrument_counter SET count = count - 1, revision = revision + 1
+                WHERE exercise_id = OLD.exercise_id;
+                INSERT INTO ras_ci.registry_instrument_counter AS counter (exercise_id, count, revision)
+                VALUES (NEW.exercise_id, 1, 1)
+                ON CONFLICT (exercise_id) DO UPDATE SET count = counter.count + 1, revision = counter.revision + 1;
+            ELSIF TG_OP = 'UPDATE' THEN
+                UPDATE ras_ci.registry_instrument_counter SET revision = revision + 1
+                WHERE exercise_id = NEW.exercise_id;
+            ELSE
+                UPDATE ras_ci.registry_instrument_counter SET count = count - 1, revision = revision + 1
+                WHERE exercise_id = OLD.exercise_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql""")
+    # Recount, in case any registry instruments were moved before now. Replacing the function takes no lock on
+    # registry_instrument, so this does, to keep out writes until it commits
+    op.execute("LOCK TABLE ras_ci.registry_instrument IN SHARE MODE")
+    op.execute("""UPDATE ras_ci.registry_instrument_counter AS counter
+        SET count = (SELECT count(*) FROM ras_ci.registry_instrument WHERE exercise_id = counter.exercise_id),
+            revision = counter.revision + 1
+        WHERE count <> (SELECT count(*) FROM ras_ci.registry_instrument WHERE exercise_id = counter.exercise_id)""")
+    op.execute("""INSERT INTO ras_ci.registry_instrument_counter (exercise_id, count, revision)
+        SELECT exercise_id, count(*), 1 FROM ras_ci.registry_instrument GROUP BY exercise_id
+        ON CONFLICT (exercise_id) DO NOTHING""")
+
+
+def downgrade():
+    op.execute("""CREATE OR REPLACE FUNCTION ras_ci.count_registry_instrument() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO ras_ci.registry_instrument_counter AS counter (exercise_id, count, revision)
+                VALUES (NEW.exercise_id, 1, 1)
+                ON CONFLICT (exercise_id) DO UPDATE SET count = counter.count + 1, revision = counter.revision + 1;
+            ELSIF TG_OP = 'UPDATE' THEN
+                UPDATE ras_ci.registry_instrument_counter SET revision = revision + 1
+                WHERE exercise_id = NEW.exercise_id;
+            ELSE
+                UPDATE ras_ci.registry_instrument_counter SET count = count - 1, revision = revision + 1
+                WHERE exercise_id = OLD.exercise_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql""")
@@ -25,6 +25,18 @@ def create_app(config=None, init_db=True):
     app_config = f"config.{config_name}"
     app.config.from_object(app_config)
 
+    from application.json_provider import FastJSONProvider
+
+    app.json = FastJSONProvider(app)
+
+    from application.metrics import init_metrics
+
+    init_metrics(app)
+
+    from application.sql_instrumentation import init_sql_instrumentation
+
+    init_sql_instrumentation(app)
+
     # register view blueprints
 
     from application.views.collection_instrument_view import collection_instrument_view
@@ -54,6 +66,13 @@ def create_app(config=None, init_db=True):
         except RetryError:
             logger.exception("Failed to initialise database")
             exit(1)
+        from application.controllers.invalidation_bus import start_invalidation_listener
+
+        start_invalidation_listener(app)
+
+        from application.warm_up import start_warm_up
+
+        start_warm_up(app)
     else:
         logger.debug("Skipped initialising database")
 
@@ -62,10 +81,14 @@ def create_app(config=None, init_db=True):
     return app
 
 
-def create_database(db_connection, db_schema):
+def create_database(db_connection, db_schema, slow_statement_ms, tag_statements=False):
     from application.models import models
+    from application.sql_instrumentation import comment_statements, instrument_engine
 
     engine = create_engine(db_connection)
+    instrument_engine(engine, slow_statement_ms)
+    if tag_statements:
+        comment_statements(engine)
     session_factory = sessionmaker(bind=engine)
     session = scoped_session(session_factory)
     session.configure(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
@@ -117,7 +140,12 @@ def retry_if_database_error(exception):
 @retry(retry_on_exception=retry_if_database_error, wait_fixed=2000, stop_max_delay=30000, wrap_exception=True)
 def initialise_db(app):
     # TODO: this isn't entirely safe, use a get_db() lazy initializer instead...
-    app.db = create_database(app.config["DATABASE_URI"], app.config["DATABASE_SCHEMA"])
+    app.db = create_database(
+        app.config["DATABASE_URI"],
+        app.config["DATABASE_SCHEMA"],
+        app.config["SLOW_SQL_THRESHOLD_MS"],
+        tag_statements=app.config["SQL_COMMENT_TAGGING"],
+    )
 
 
 if __name__ == "__main__":
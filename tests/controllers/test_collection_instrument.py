@@ -1,9 +1,14 @@
+import base64
+import hashlib
 import json
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 
+import google_crc32c
 import requests_mock
+from flask import current_app
 from google.cloud.exceptions import NotFound
+from werkzeug.datastructures import FileStorage
 
 from application.controllers.collection_instrument import (
     COLLECTION_EXERCISE_AND_ASSOCIATED_FILES_DELETED,
@@ -14,6 +19,7 @@ from application.controllers.collection_instrument import (
 from application.controllers.registry_instrument import RegistryInstrument
 from application.controllers.session_decorator import with_db_session
 from application.exceptions import RasDatabaseError, RasError
+from application.models.google_cloud_bucket import GoogleCloudSEFTCIBucket
 from application.models.models import (
     BusinessModel,
     ExerciseModel,
@@ -224,6 +230,33 @@ class TestCollectionInstrument(TestClient):
         self.assertEqual(message, COLLECTION_EXERCISE_NOT_FOUND_ON_GCP)
         self.assertEqual(status, 404)
 
+    @patch("application.models.google_cloud_bucket.storage")
+    def test_upload_file_to_bucket_digests_while_streaming(self, mock_storage):
+        # Given the client re-sends the start of the file part way through the upload, as it does on a retry
+        def upload_from_file(file_obj, size, checksum):
+            file_obj.read(100)
+            file_obj.seek(0)
+            while file_obj.read(256):
+                pass
+
+        mock_storage.Client().bucket().blob().upload_from_file.side_effect = upload_from_file
+        with open(TEST_FILE_LOCATION, "rb") as io:
+            contents = io.read()
+            io.seek(0)
+
+            # When the file is uploaded
+            digest = GoogleCloudSEFTCIBucket(current_app.config).upload_file_to_bucket(
+                FileStorage(stream=io, filename="test.xlsx")
+            )
+
+        # Then the length and digests cover each byte once, computed without reading the file up front
+        self.assertEqual(digest.length, len(contents))
+        self.assertEqual(digest.md5_hash, base64.b64encode(hashlib.md5(contents).digest()).decode())
+        self.assertEqual(digest.crc32c, base64.b64encode(google_crc32c.Checksum(contents).digest()).decode())
+        upload_kwargs = mock_storage.Client().bucket().blob().upload_from_file.call_args.kwargs
+        self.assertEqual(upload_kwargs["size"], len(contents))
+        self.assertEqual(upload_kwargs["checksum"], "crc32c")
+
     def test_get_instrument_by_incorrect_id(self):
         # Given there is an instrument in the db
         # When an incorrect instrument id is used to find that instrument
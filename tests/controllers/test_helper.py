@@ -1,11 +1,18 @@
+import io
+import json
+import struct
 import unittest
+import zipfile
 
 from werkzeug.datastructures import FileStorage
 
 from application.controllers.helper import (
+    MAX_MANIFEST_SIZE,
     convert_file_object_to_string_base64,
+    files_from_zip_archive,
     is_valid_file_extension,
     is_valid_file_name_length,
+    parse_bulk_upload_manifest,
     to_str,
     validate_uuid,
 )
@@ -119,3 +126,109 @@ class TestHelper(unittest.TestCase):
         # Then an RasError is raised
         with self.assertRaises(RasError):
             validate_uuid(uuid)
+
+    def test_files_from_zip_archive(self):
+        # Given a zip archive holding two spreadsheets, a manifest and something else
+        archive = self._zip_archive(
+            {
+                "49900000001.xlsx": b"one",
+                "dir/49900000002.xlsx": b"two",
+                "manifest.json": b'{"49900000001.xlsx": "1"}',
+                "readme.txt": b"not a spreadsheet",
+            }
+        )
+
+        # When the archive is unpacked
+        files, manifest = self._unzip(archive)
+
+        # Then the spreadsheets are returned as files named without their folder, and the manifest is parsed
+        self.assertEqual([file.filename for file in files], ["49900000001.xlsx", "49900000002.xlsx"])
+        self.assertEqual([file.read() for file in files], [b"one", b"two"])
+        self.assertEqual(manifest, {"49900000001.xlsx": "1"})
+
+    def test_files_from_zip_archive_too_many_files(self):
+        # Given a zip archive holding more files than allowed
+        archive = self._zip_archive({f"{i}.xlsx": b"data" for i in range(3)})
+
+        # When the archive is unpacked
+        # Then a RasError is raised
+        with self.assertRaises(RasError) as error:
+            self._unzip(archive, max_files=2)
+        self.assertEqual(error.exception.errors, ["Archive contains more than 2 files"])
+
+    def test_files_from_zip_archive_not_a_zip(self):
+        with self.assertRaises(RasError) as error:
+            self._unzip(io.BytesIO(b"not a zip"))
+        self.assertEqual(error.exception.status_code, 400)
+
+    def test_files_from_zip_archive_invalid_manifest(self):
+        archive = self._zip_archive({"manifest.json": json.dumps(["49900000001"]).encode()})
+        with self.assertRaises(RasError) as error:
+            self._unzip(archive)
+        self.assertEqual(error.exception.errors, ["Manifest must be a JSON object of file name to ru_ref"])
+
+    def test_files_from_zip_archive_file_too_large(self):
+        # Given a file which compresses well, but unzips to more than a file may
+        archive = self._zip_archive({"49900000001.xlsx": b"0" * 1001})
+
+        # When the archive is unpacked, then it's rejected
+        with self.assertRaises(RasError) as error:
+            self._unzip(archive, max_file_size=1000)
+        self.assertEqual(error.exception.errors, ["49900000001.xlsx is larger than 1000 bytes uncompressed"])
+
+    def test_files_from_zip_archive_too_large(self):
+        # Given files which each unzip to less than a file may, but to more than an archive may together
+        archive = self._zip_archive({f"{i}.xlsx": b"0" * 600 for i in range(2)})
+
+        with self.assertRaises(RasError) as error:
+            self._unzip(archive, max_file_size=1000, max_archive_size=1000)
+        self.assertEqual(error.exception.errors, ["Archive is larger than 1000 bytes uncompressed"])
+
+    def test_files_from_zip_archive_understated_size(self):
+        # Given a file whose headers say it's smaller than it unzips to
+        data = b"0" * 100000
+        archive = self._zip_archive({"49900000001.xlsx": data}).getvalue()
+        archive = archive.replace(struct.pack("<I", len(data)), struct.pack("<I", 10))
+
+        # When the archive is unpacked, then it's rejected rather than unzipped in full
+        with self.assertRaises(RasError) as error:
+            self._unzip(io.BytesIO(archive), max_file_size=1000)
+        self.assertEqual(error.exception.status_code, 400)
+
+    def test_files_from_zip_archive_manifest_too_large(self):
+        archive = self._zip_archive({"manifest.json": b" " * (MAX_MANIFEST_SIZE + 1)})
+        with self.assertRaises(RasError) as error:
+            self._unzip(archive)
+        self.assertEqual(error.exception.errors, [f"Manifest is larger than {MAX_MANIFEST_SIZE} bytes"])
+
+    def test_parse_bulk_upload_manifest(self):
+        self.assertEqual(parse_bulk_upload_manifest('{"first.xlsx": "49900000001"}'), {"first.xlsx": "49900000001"})
+
+    def test_parse_bulk_upload_manifest_rejects_anything_but_file_names_to_ru_refs(self):
+        manifests = [
+            ["49900000001"],
+            {"first.xlsx": 49900000001},
+            {"first.xlsx": ["49900000001"]},
+            {"first.xlsx": {"ru_ref": "49900000001"}},
+            {"first.xlsx": None},
+            {"first.xlsx": ""},
+            {"": "49900000001"},
+        ]
+        for manifest in manifests:
+            with self.subTest(manifest=manifest):
+                with self.assertRaises(RasError) as error:
+                    parse_bulk_upload_manifest(json.dumps(manifest))
+                self.assertEqual(error.exception.errors, ["Manifest must be a JSON object of file name to ru_ref"])
+
+    @staticmethod
+    def _unzip(archive, max_files=10, max_file_size=1024 * 1024, max_archive_size=10 * 1024 * 1024):
+        return files_from_zip_archive(archive, max_files, "xls,xlsx", max_file_size, max_archive_size)
+
+    @staticmethod
+    def _zip_archive(contents):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            for name, data in contents.items():
+                zip_file.writestr(name, data, compress_type=zipfile.ZIP_DEFLATED)
+        archive.seek(0)
+        return archive
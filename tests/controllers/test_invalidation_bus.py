@@ -0,0 +1,121 @@
+import json
+import select
+import time
+
+from sqlalchemy import text
+
+from application.controllers.invalidation_bus import (
+    MAX_PAYLOAD_SIZE,
+    InvalidationListener,
+    get_origin,
+    notification_payloads,
+)
+from application.controllers.search_cache import (
+    ALL,
+    EXERCISE,
+    SURVEY,
+    get_search_cache,
+    invalidate_instruments_on_commit,
+)
+from tests.test_client import TestClient
+
+SURVEY_ID = "cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87"
+EXERCISE_ID = "3ff59b73-7f15-406f-9e4d-7f00b41e85ce"
+
+
+class TestInvalidationBus(TestClient):
+    def setUp(self):
+        self.app.config["INVALIDATION_BUS_ENABLED"] = True
+        self.channel = self.app.config["INVALIDATION_CHANNEL"]
+
+    def test_notification_payloads_fit_in_a_notify(self):
+        # Given more exercises than fit in one notification
+        scopes = {(EXERCISE, f"{i:08}-0000-0000-0000-000000000000") for i in range(500)}
+
+        payloads = notification_payloads("origin", scopes)
+
+        # Then they're split between payloads Postgres will accept, without losing any
+        self.assertGreater(len(payloads), 1)
+        self.assertTrue(all(len(payload) <= MAX_PAYLOAD_SIZE for payload in payloads))
+        received = {tuple(scope) for payload in payloads for scope in json.loads(payload)["scopes"]}
+        self.assertEqual(received, scopes)
+
+    def test_commit_notifies_invalidated_scopes(self):
+        # Given a connection listening on the channel
+        connection = self.listen()
+
+        # When a session that invalidated an instrument commits
+        session = self.app.db.session()
+        invalidate_instruments_on_commit(session, [SURVEY_ID], [EXERCISE_ID])
+        session.commit()
+
+        # Then the scopes are notified, along with this app's origin
+        message = json.loads(self.wait_for_notify(connection))
+        self.assertEqual(message["origin"], get_origin(self.app))
+        self.assertEqual(
+            {tuple(scope) for scope in message["scopes"]}, {(ALL, None), (SURVEY, SURVEY_ID), (EXERCISE, EXERCISE_ID)}
+        )
+
+    def test_rollback_does_not_notify(self):
+        connection = self.listen()
+
+        session = self.app.db.session()
+        invalidate_instruments_on_commit(session, [SURVEY_ID])
+        session.execute(text("SELECT 1"))
+        session.rollback()
+
+        self.assertIsNone(self.wait_for_notify(connection, timeout=0.5))
+
+    def test_listener_evicts_other_workers_invalidations(self):
+        # Given a listening worker with a cached search
+        listener = InvalidationListener(self.app)
+        listener.start()
+        self.addCleanup(listener.stop, 5)
+        self.assertTrue(listener.listening.wait(5))
+        search_cache = get_search_cache()
+        key = search_cache.key({"SURVEY_ID": SURVEY_ID}, None)
+        search_cache.put(key, [])
+
+        # When another worker notifies that the survey's instruments changed
+        payload = json.dumps({"origin": "another-worker", "scopes": [[ALL, None], [SURVEY, SURVEY_ID]]})
+        with self.app.db.connect() as connection:
+            connection.execute(
+                text("SELECT pg_notify(:channel, :payload)"), {"channel": self.channel, "payload": payload}
+            )
+            connection.commit()
+
+        # Then the cached search is evicted
+        deadline = time.monotonic() + 5
+        while search_cache.get(key) is not None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertIsNone(search_cache.get(key))
+
+    def test_listener_ignores_its_own_notifications(self):
+        # Given a cached search
+        listener = InvalidationListener(self.app)
+        search_cache = get_search_cache()
+        key = search_cache.key({"SURVEY_ID": SURVEY_ID}, None)
+        search_cache.put(key, [])
+
+        # When the listener receives the notification its own commit sent
+        listener.handle(json.dumps({"origin": listener.origin, "scopes": [[SURVEY, SURVEY_ID]]}))
+
+        # Then it's left to the after commit hook, and the entry is still cached
+        self.assertEqual(search_cache.get(key), [])
+
+    def listen(self):
+        connection = self.app.db.raw_connection()
+        # Autocommit is set on the driver connection, so it is discarded rather than returned to the pool
+        self.addCleanup(connection.invalidate)
+        connection.driver_connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return connection.driver_connection
+
+    @staticmethod
+    def wait_for_notify(connection, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not connection.notifies and time.monotonic() < deadline:
+            select.select([connection], [], [], max(deadline - time.monotonic(), 0))
+            connection.poll()
+        return connection.notifies.pop(0).payload if connection.notifies else None
@@ -1,3 +1,4 @@
+import json
 from unittest.mock import patch
 
 import requests
@@ -6,6 +7,8 @@ from requests.models import Response
 
 from application.controllers.service_helper import (
     collection_exercise_instrument_update_request,
+    get_instrument_change_publisher,
+    get_survey_details,
     service_request,
 )
 from application.exceptions import RasError, ServiceUnavailableException
@@ -14,6 +17,7 @@ from tests.test_client import TestClient
 SERVICE = "survey-service"
 COLLECTION_EXERCISE_LINK_URL = "http://localhost:8145/collection-instrument/link"
 COLLECTION_EXERCISE_ID = "db0711c3-0ac8-41d3-ae0e-567e5ea1ef87"
+SURVEY_ID = "41320b22-b425-4fba-a90e-718898f718ce"
 
 
 class TestServiceHelper(TestClient):
@@ -95,3 +99,53 @@ class TestServiceHelper(TestClient):
         # Then a RasError is raised
         with self.assertRaises(RasError):
             collection_exercise_instrument_update_request("ADD", COLLECTION_EXERCISE_ID)
+
+    @patch("application.models.google_cloud_pubsub.pubsub_v1")
+    def test_publish_instrument_change_to_pubsub(self, mock_pubsub):
+        # Given notifications are configured to go through Pub/Sub
+        self.app.config["INSTRUMENT_NOTIFICATION_BACKEND"] = "PUBSUB"
+        mock_client = mock_pubsub.PublisherClient.return_value
+        mock_client.topic_path.return_value = "projects/TEST_PROJECT/topics/collection-instrument-change"
+
+        # When two changes are notified
+        result = collection_exercise_instrument_update_request("ADD", COLLECTION_EXERCISE_ID)
+        collection_exercise_instrument_update_request("REMOVE", COLLECTION_EXERCISE_ID)
+
+        # Then one batching publisher is created and each event is queued on the topic without any REST call
+        mock_pubsub.PublisherClient.assert_called_once()
+        self.assertEqual(mock_client.publish.call_count, 2)
+        topic, data = mock_client.publish.call_args_list[0].args
+        self.assertEqual(topic, "projects/TEST_PROJECT/topics/collection-instrument-change")
+        self.assertEqual(json.loads(data), {"action": "ADD", "exercise_id": COLLECTION_EXERCISE_ID})
+        self.assertEqual(mock_client.publish.call_args_list[0].kwargs["action"], "ADD")
+        self.assertEqual(result, mock_client.publish.return_value)
+        self.assertIs(get_instrument_change_publisher().client, mock_client)
+
+    def test_unknown_notification_backend(self):
+        # Given an unsupported notification backend
+        self.app.config["INSTRUMENT_NOTIFICATION_BACKEND"] = "CARRIER_PIGEON"
+        # When a change is notified
+        # Then a RasError is raised
+        with self.assertRaises(RasError) as exception:
+            collection_exercise_instrument_update_request("ADD", COLLECTION_EXERCISE_ID)
+        self.assertEqual(["notification backend 'CARRIER_PIGEON' not configured"], exception.exception.errors)
+
+    @requests_mock.mock()
+    def test_get_survey_details_cached(self, mock_request):
+        # Given the survey service returns a survey's details
+        mock_request.get(f"http://localhost:8080/surveys/{SURVEY_ID}", status_code=200, json={"surveyRef": "139"})
+
+        # When they're got twice, then the survey service is only called once
+        self.assertEqual(get_survey_details(SURVEY_ID), {"surveyRef": "139"})
+        self.assertEqual(get_survey_details(SURVEY_ID.upper()), {"surveyRef": "139"})
+        self.assertEqual(mock_request.call_count, 1)
+
+    @requests_mock.mock()
+    def test_get_survey_details_not_cached_when_ttl_zero(self, mock_request):
+        self.app.config["SURVEY_DETAILS_CACHE_TTL"] = 0
+        mock_request.get(f"http://localhost:8080/surveys/{SURVEY_ID}", status_code=200, json={"surveyRef": "139"})
+
+        get_survey_details(SURVEY_ID)
+        get_survey_details(SURVEY_ID)
+
+        self.assertEqual(mock_request.call_count, 2)
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import requests_mock
+
+from application.controllers.service_helper import get_survey_details
+from application.controllers.session_decorator import with_db_session
+from application.models.models import InstrumentModel, SurveyModel
+from application.warm_up import PENDING, READY, WarmUp, start_warm_up
+from tests.test_client import TestClient
+
+RECENT_SURVEY_ID = "cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87"
+OLD_SURVEY_ID = "41320b22-b425-4fba-a90e-718898f718ce"
+recent_survey_url = f"http://localhost:8080/surveys/{RECENT_SURVEY_ID}"
+
+
+class TestWarmUp(TestClient):
+    @requests_mock.mock()
+    def test_warm_up_resolves_recent_surveys(self, mock_request):
+        # Given a survey with a recent instrument and one whose instruments are all old
+        self.add_instrument(RECENT_SURVEY_ID, datetime.now())
+        self.add_instrument(OLD_SURVEY_ID, datetime.now() - timedelta(days=365))
+        mock_request.get(recent_survey_url, status_code=200, json={"surveyRef": "139"})
+        warm_up = WarmUp(self.app)
+        self.assertEqual(warm_up.state, PENDING)
+
+        # When the worker warms up
+        warm_up.run()
+
+        # Then it's ready, with its pool's connections opened and only the recent survey's details got
+        self.assertTrue(warm_up.ready.is_set())
+        self.assertEqual(warm_up.state, READY)
+        self.assertEqual(warm_up.connections_opened, self.app.db.pool.size())
+        self.assertEqual(warm_up.surveys_resolved, 1)
+        self.assertEqual(warm_up.errors, 0)
+        self.assertEqual(mock_request.call_count, 1)
+
+        # And the survey's details are cached for the first requests
+        self.assertEqual(get_survey_details(RECENT_SURVEY_ID), {"surveyRef": "139"})
+        self.assertEqual(mock_request.call_count, 1)
+
+    @requests_mock.mock()
+    def test_warm_up_ready_when_survey_service_fails(self, mock_request):
+        self.add_instrument(RECENT_SURVEY_ID, datetime.now())
+        mock_request.get(recent_survey_url, status_code=500)
+        warm_up = WarmUp(self.app)
+
+        warm_up.run()
+
+        self.assertTrue(warm_up.ready.is_set())
+        self.assertEqual(warm_up.surveys_resolved, 0)
+        self.assertEqual(warm_up.errors, 1)
+
+    def test_ready_when_warm_up_disabled(self):
+        # Given warm-up is disabled, as it is for the tests, then the app is ready without warming up
+        warm_up = start_warm_up(self.app)
+
+        self.assertTrue(warm_up.ready.is_set())
+        self.assertIsNone(warm_up.thread)
+
+    @staticmethod
+    @with_db_session
+    def add_instrument(survey_id, stamp, session=None):
+        instrument = InstrumentModel(ci_type="EQ", classifiers={"form_type": "0001"})
+        instrument.stamp = stamp
+        instrument.survey = SurveyModel(survey_id=survey_id)
+        session.add(instrument)
@@ -1,6 +1,8 @@
+import base64
 import logging
 
 import structlog
+from flask import current_app
 from flask_testing import TestCase
 from sqlalchemy import text
 
@@ -9,6 +11,9 @@ from run import create_app
 
 logger = structlog.wrap_logger(logging.getLogger(__name__))
 
+api_root = "/collection-instrument-api/1.0.2"
+exercise_id = "3ff59b73-7f15-406f-9e4d-7f00b41e85ce"
+
 
 class TestClient(TestCase):
     @staticmethod
@@ -25,3 +30,10 @@ class TestClient(TestCase):
         models.Base.metadata.drop_all(self.app.db)
         models.Base.metadata.create_all(self.app.db)
         self.app.db.session.commit()
+
+    @staticmethod
+    def get_auth_headers():
+        auth = "{}:{}".format(
+            current_app.config.get("SECURITY_USER_NAME"), current_app.config.get("SECURITY_USER_PASSWORD")
+        ).encode("utf-8")
+        return {"Authorization": "Basic %s" % base64.b64encode(bytes(auth)).decode("ascii")}
@@ -1,5 +1,8 @@
 import base64
 import json
+import warnings
+import zipfile
+from datetime import datetime
 from unittest import mock
 from unittest.mock import patch
 
@@ -7,16 +10,24 @@ import requests_mock
 from flask import current_app
 from requests.models import Response
 from six import BytesIO
+from sqlalchemy import event
+from sqlalchemy.exc import SAWarning
 
 from application.controllers.collection_instrument import (
     COLLECTION_EXERCISE_AND_ASSOCIATED_FILES_DELETED,
 )
 from application.controllers.session_decorator import with_db_session
+from application.controllers.sql_queries import (
+    query_instrument_by_id,
+    query_instrument_summaries_by_ids,
+)
 from application.exceptions import RasError
+from application.models.google_cloud_bucket import SEFTFileDigest, digest_file
 from application.models.models import (
     BusinessModel,
     ExerciseModel,
     InstrumentModel,
+    RegistryInstrumentModel,
     SEFTModel,
     SurveyModel,
 )
@@ -33,6 +44,9 @@ url_collection_instrument_link_url = "http://localhost:8145/collection-instrumen
 survey_url = "http://localhost:8080/surveys/cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87"
 survey_response_json = {"surveyId": "cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87", "surveyRef": "139", "surveyMode": "SEFT"}
 collection_exercise_url = "http://localhost:8145/collectionexercises/6790cdaa-28a9-4429-905c-0e943373b62e"
+bulk_exercise_id = "a2dd4d5a-9e1c-4c4e-8b3a-0b0d3b3f4d11"
+bulk_collection_exercise_url = f"http://localhost:8145/collectionexercises/{bulk_exercise_id}"
+seft_file_digest = SEFTFileDigest(length=5462, crc32c="ZJ8Kfg==", md5_hash="ObD5Dx1xqzLfFCCmCIuZvQ==")
 
 survey_response_json_EQ_AND_SEFT = {
     "surveyId": "cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87",
@@ -74,7 +88,7 @@ class TestCollectionInstrumentView(TestClient):
     def test_upload_seft_collection_instrument(self, mock_bucket, mock_request):
         mock_request.post(url_collection_instrument_link_url, status_code=200)
         mock_request.get(survey_url, status_code=200, json=survey_response_json)
-        mock_bucket.return_value.upload_file_to_bucket.return_value = "file_path.xlsx"
+        mock_bucket.return_value.upload_file_to_bucket.return_value = seft_file_digest
         # Given an upload file and a patched survey_id response
         mock_survey_service = Response()
         mock_survey_service.status_code = 200
@@ -96,6 +110,11 @@ class TestCollectionInstrumentView(TestClient):
         self.assertEqual(response.data.decode(), UPLOAD_SUCCESSFUL)
 
         self.assertEqual(len(collection_instruments()), 2)
+        seft_file = next(ci.seft_file for ci in collection_instruments() if ci.seft_file.file_name == "test.xls")
+        self.assertEqual(
+            (seft_file.len, seft_file.crc32c, seft_file.md5_hash),
+            (seft_file_digest.length, seft_file_digest.crc32c, seft_file_digest.md5_hash),
+        )
 
     @requests_mock.mock()
     def test_upload_eq_collection_instrument(self, mock_request):
@@ -179,7 +198,7 @@ class TestCollectionInstrumentView(TestClient):
     def test_upload_seft_collection_instrument_with_ru(self, mock_bucket, mock_request):
         mock_request.post(url_collection_instrument_link_url, status_code=200)
         mock_request.get(survey_url, status_code=200, json=survey_response_json)
-        mock_bucket.return_value.upload_file_to_bucket.return_value = "file_path.xlsx"
+        mock_bucket.return_value.upload_file_to_bucket.return_value = seft_file_digest
         # Given an upload file and a patched survey_id response
         mock_survey_service = Response()
         mock_survey_service.status_code = 200
@@ -207,7 +226,7 @@ class TestCollectionInstrumentView(TestClient):
     def test_upload_seft_collection_instrument_with_ru_only_allows_single_one(self, mock_bucket, mock_request):
         mock_request.post(url_collection_instrument_link_url, status_code=200)
         mock_request.get(survey_url, status_code=200, json=survey_response_json)
-        mock_bucket.return_value.upload_file_to_bucket.return_value = "file_path.xlsx"
+        mock_bucket.return_value.upload_file_to_bucket.return_value = seft_file_digest
         """Verify that uploading a collection instrument for a reporting unit twice for the same collection exercise
         will result in an error"""
         # Given an upload file and a patched survey_id response
@@ -254,7 +273,7 @@ class TestCollectionInstrumentView(TestClient):
     def test_upload_seft_collection_instrument_with_duplicate_filename_causes_error(self, mock_bucket, mock_request):
         mock_request.get(survey_url, status_code=200, json=survey_response_json)
         mock_request.post(url_collection_instrument_link_url, status_code=200)
-        mock_bucket.return_value.upload_file_to_bucket.return_value = "file_path.xlsx"
+        mock_bucket.return_value.upload_file_to_bucket.return_value = seft_file_digest
         """Verify that uploading a collection instrument file that has the same name as a file already uploaded
         for that collection exercise results in an error"""
         # Given an upload file and a patched survey_id response
@@ -299,7 +318,7 @@ class TestCollectionInstrumentView(TestClient):
     def test_upload_seft_collection_instrument_with_ru_allowed_for_different_exercises(self, mock_bucket, mock_request):
         mock_request.post(url_collection_instrument_link_url, status_code=200)
         mock_request.get(survey_url, status_code=200, json=survey_response_json)
-        mock_bucket.return_value.upload_file_to_bucket.return_value = "file_path.xlsx"
+        mock_bucket.return_value.upload_file_to_bucket.return_value = seft_file_digest
         """Verify that uploading a collection exercise, bound to a reporting unit, for two separate collection exercises
         results in them both being saved"""
         # Given an upload file and a patched survey_id response
@@ -339,6 +358,208 @@ class TestCollectionInstrumentView(TestClient):
 
             self.assertEqual(len(collection_instruments()), 3)
 
+    @mock.patch("application.controllers.collection_instrument.GoogleCloudSEFTCIBucket")
+    @requests_mock.mock()
+    def test_bulk_upload_seft_collection_instruments(self, mock_bucket, mock_request):
+        mock_request.post(url_collection_instrument_link_url, status_code=200)
+        mock_request.get(survey_url, status_code=200, json=survey_response_json)
+        mock_request.get(
+            bulk_collection_exercise_url, status_code=200, json={"surveyId": survey_response_json["surveyId"]}
+        )
+        mock_bucket.return_value.upload_file_to_bucket.return_value = seft_file_digest
+        # Given three RU files, one of which is named for an RU given in the manifest
+        data = {
+            "files": [
+                (BytesIO(b"test data 1"), "49900000001.xlsx"),
+                (BytesIO(b"test data 2"), "49900000002.xlsx"),
+                (BytesIO(b"test data 3"), "third.xlsx"),
+            ],
+            "manifest": json.dumps({"third.xlsx": "49900000003"}),
+        }
+
+        # When they are posted to the bulk upload end point
+        response = self.client.post(
+            f"/collection-instrument-api/1.0.2/bulk-upload/{bulk_exercise_id}",
+            headers=self.get_auth_headers(),
+            data=data,
+            content_type="multipart/form-data",
+        )
+
+        # Then every file is uploaded, committed and notified once
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json["uploaded"], 3)
+        self.assertEqual(
+            [(result["ru_ref"], result["status"]) for result in response.json["files"]],
+            [("49900000001", "UPLOADED"), ("49900000002", "UPLOADED"), ("49900000003", "UPLOADED")],
+        )
+        self.assertEqual(mock_bucket.return_value.upload_file_to_bucket.call_count, 3)
+        self.assertEqual(len(collection_instruments()), 4)
+        self.assertEqual(
+            len([request for request in mock_request.request_history if request.method == "POST"]),
+            1,
+        )
+
+    @mock.patch("application.controllers.collection_instrument.GoogleCloudSEFTCIBucket")
+    @requests_mock.mock()
+    def test_bulk_upload_seft_collection_instruments_partial(self, mock_bucket, mock_request):
+        mock_request.post(url_collection_instrument_link_url, status_code=200)
+        mock_request.get(survey_url, status_code=200, json=survey_response_json)
+        mock_request.get(
+            bulk_collection_exercise_url, status_code=200, json={"surveyId": survey_response_json["surveyId"]}
+        )
+        mock_bucket.return_value.upload_file_to_bucket.return_value = seft_file_digest
+        # Given an RU that already has an instrument for the exercise
+        self.client.post(
+            f"/collection-instrument-api/1.0.2/bulk-upload/{bulk_exercise_id}",
+            headers=self.get_auth_headers(),
+            data={"files": [(BytesIO(b"test data"), "49900000001.xlsx")]},
+            content_type="multipart/form-data",
+        )
+
+        # When a set is uploaded with that RU again, a duplicated RU, a bad extension and one valid file
+        data = {
+            "files": [
+                (BytesIO(b"test data"), "49900000001.xls"),
+                (BytesIO(b"test data"), "49900000002.xlsx"),
+                (BytesIO(b"test data"), "49900000002.xls"),
+                (BytesIO(b"test data"), "49900000003.txt"),
+                (BytesIO(b"test data"), "49900000004.xlsx"),
+            ],
+        }
+        data["manifest"] = json.dumps({"49900000002.xls": "49900000002"})
+        response = self.client.post(
+            f"/collection-instrument-api/1.0.2/bulk-upload/{bulk_exercise_id}",
+            headers=self.get_auth_headers(),
+            data=data,
+            content_type="multipart/form-data",
+        )
+
+        # Then only the valid file is uploaded and the rest are reported as rejected
+        self.assertStatus(response, 207)
+        self.assertEqual(
+            [result["status"] for result in response.json["files"]],
+            ["REJECTED", "REJECTED", "REJECTED", "REJECTED", "UPLOADED"],
+        )
+        self.assertEqual(
+            response.json["files"][0]["errors"],
+            ["Reporting unit 49900000001 already has an instrument uploaded for this collection exercise"],
+        )
+        self.assertEqual(response.json["files"][3]["errors"], ["File must be one of xls,xlsx"])
+        self.assertEqual(len(collection_instruments()), 3)
+
+    @mock.patch("application.controllers.collection_instrument.GoogleCloudSEFTCIBucket")
+    @requests_mock.mock()
+    def test_bulk_upload_seft_collection_instruments_zip_archive(self, mock_bucket, mock_request):
+        mock_request.post(url_collection_instrument_link_url, status_code=200)
+        mock_request.get(survey_url, status_code=200, json=survey_response_json)
+        mock_request.get(
+            bulk_collection_exercise_url, status_code=200, json={"surveyId": survey_response_json["surveyId"]}
+        )
+        mock_bucket.return_value.upload_file_to_bucket.side_effect = [seft_file_digest, Exception("bucket unavailable")]
+        # Given a zip of two RU files and a manifest
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            zip_file.writestr("a.xlsx", b"test data a")
+            zip_file.writestr("b.xlsx", b"test data b")
+            zip_file.writestr("manifest.json", json.dumps({"a.xlsx": "49900000001", "b.xlsx": "49900000002"}))
+        archive.seek(0)
+
+        # When the archive is posted and the second file fails to upload to the bucket
+        response = self.client.post(
+            f"/collection-instrument-api/1.0.2/bulk-upload/{bulk_exercise_id}",
+            headers=self.get_auth_headers(),
+            data={"archive": (archive, "instruments.zip")},
+            content_type="multipart/form-data",
+        )
+
+        # Then only the file that reached the bucket is committed
+        self.assertStatus(response, 207)
+        self.assertEqual(
+            [(result["ru_ref"], result["status"]) for result in response.json["files"]],
+            [("49900000001", "UPLOADED"), ("49900000002", "FAILED")],
+        )
+        self.assertEqual(len(collection_instruments()), 2)
+
+    @mock.patch("application.controllers.collection_instrument.GoogleCloudSEFTCIBucket")
+    @requests_mock.mock()
+    def test_bulk_upload_failed_file_for_existing_business(self, mock_bucket, mock_request):
+        mock_request.get(survey_url, status_code=200, json=survey_response_json)
+        mock_request.get(
+            bulk_collection_exercise_url, status_code=200, json={"surveyId": survey_response_json["surveyId"]}
+        )
+        mock_bucket.return_value.upload_file_to_bucket.side_effect = Exception("bucket unavailable")
+
+        # Given a file for a business already in the db, when it fails to upload to the bucket
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            response = self.client.post(
+                f"/collection-instrument-api/1.0.2/bulk-upload/{bulk_exercise_id}",
+                headers=self.get_auth_headers(),
+                data={
+                    "files": [(BytesIO(b"test data"), "existing.xlsx")],
+                    "manifest": json.dumps({"existing.xlsx": "test_ru_ref"}),
+                },
+                content_type="multipart/form-data",
+            )
+
+        # Then nothing is committed, and its instrument isn't left linked to the business
+        self.assertStatus(response, 400)
+        self.assertEqual(response.json["files"][0]["status"], "FAILED")
+        self.assertEqual(len(collection_instruments()), 1)
+        self.assertEqual([str(w.message) for w in caught if issubclass(w.category, SAWarning)], [])
+
+    @mock.patch("application.controllers.collection_instrument.GoogleCloudSEFTCIBucket")
+    @requests_mock.mock()
+    def test_bulk_upload_ru_ref_too_long(self, mock_bucket, mock_request):
+        mock_request.get(survey_url, status_code=200, json=survey_response_json)
+        mock_request.get(
+            bulk_collection_exercise_url, status_code=200, json={"surveyId": survey_response_json["surveyId"]}
+        )
+
+        # Given a file whose ru_ref is too long for the database
+        response = self.client.post(
+            f"/collection-instrument-api/1.0.2/bulk-upload/{bulk_exercise_id}",
+            headers=self.get_auth_headers(),
+            data={
+                "files": [(BytesIO(b"test data"), "long.xlsx")],
+                "manifest": json.dumps({"long.xlsx": "4" * 33}),
+            },
+            content_type="multipart/form-data",
+        )
+
+        # Then it's rejected before anything is uploaded
+        self.assertStatus(response, 400)
+        self.assertEqual(response.json["files"][0]["status"], "REJECTED")
+        self.assertEqual(
+            response.json["files"][0]["errors"], [f"Reporting unit {'4' * 33} is longer than 32 characters"]
+        )
+        mock_bucket.return_value.upload_file_to_bucket.assert_not_called()
+
+    def test_bulk_upload_manifest_with_non_string_ru_ref(self):
+        response = self.client.post(
+            f"/collection-instrument-api/1.0.2/bulk-upload/{bulk_exercise_id}",
+            headers=self.get_auth_headers(),
+            data={
+                "files": [(BytesIO(b"test data"), "first.xlsx")],
+                "manifest": json.dumps({"first.xlsx": ["49900000001"]}),
+            },
+            content_type="multipart/form-data",
+        )
+
+        self.assertStatus(response, 400)
+        self.assertEqual(response.json, {"errors": ["Manifest must be a JSON object of file name to ru_ref"]})
+
+    def test_bulk_upload_seft_collection_instruments_no_files(self):
+        response = self.client.post(
+            f"/collection-instrument-api/1.0.2/bulk-upload/{bulk_exercise_id}",
+            headers=self.get_auth_headers(),
+            data={},
+            content_type="multipart/form-data",
+        )
+
+        self.assertStatus(response, 400)
+        self.assertEqual(response.json, {"errors": ["No files to upload"]})
+
     @requests_mock.mock()
     def test_upload_eq_collection_instrument_eq_and_seft_survey_mode(self, mock_request):
         # Given a survey with mode EQ_AND_SEFT
@@ -361,7 +582,7 @@ class TestCollectionInstrumentView(TestClient):
         # Given a survey with mode EQ_AND_SEFT
         mock_request.post(url_collection_instrument_link_url, status_code=200)
         mock_request.get(survey_url, status_code=200, json=survey_response_json_EQ_AND_SEFT)
-        mock_bucket.return_value.upload_file_to_bucket.return_value = "file_path.xlsx"
+        mock_bucket.return_value.upload_file_to_bucket.return_value = seft_file_digest
         mock_survey_service = Response()
         mock_survey_service.status_code = 200
         mock_survey_service._content = b'{"surveyId": "cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87"}'
@@ -612,6 +833,107 @@ class TestCollectionInstrumentView(TestClient):
         self.assertStatus(response, 200)
         self.assertEqual(response.data.decode().count("cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87"), 2)
 
+    def test_stream_instrument_by_search_string(self):
+        # Given a 2nd instrument is added
+        instrument_id = self.add_instrument_data()
+
+        # When the collection instrument end point is called asking for NDJSON
+        response = self.client.get(
+            '/collection-instrument-api/1.0.2/collectioninstrument?searchString={"FORM_TYPE":%20"001"}',
+            headers={**self.get_auth_headers(), "Accept": "application/x-ndjson"},
+        )
+
+        # Then each instrument is a line of JSON, newest first, the same as the JSON response
+        self.assertStatus(response, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.data.decode().splitlines()
+        instruments = [json.loads(line) for line in lines]
+        self.assertEqual(
+            [instrument["id"] for instrument in instruments], [str(instrument_id), str(self.instrument_id)]
+        )
+        json_response = self.client.get(
+            '/collection-instrument-api/1.0.2/collectioninstrument?searchString={"FORM_TYPE":%20"001"}',
+            headers=self.get_auth_headers(),
+        )
+        self.assertEqual(instruments, json_response.json)
+
+    def test_stream_instrument_by_search_string_limit_and_no_results(self):
+        # Given a 2nd instrument is added
+        self.add_instrument_data()
+        headers = {**self.get_auth_headers(), "Accept": "application/x-ndjson"}
+
+        # When NDJSON is asked for with limit set to 1, then 1 line is returned
+        response = self.client.get("/collection-instrument-api/1.0.2/collectioninstrument?limit=1", headers=headers)
+        self.assertStatus(response, 200)
+        self.assertEqual(len(response.data.decode().splitlines()), 1)
+
+        # When nothing matches, then the response is empty
+        response = self.client.get(
+            '/collection-instrument-api/1.0.2/collectioninstrument?searchString={"TYPE":%20"EQ"}', headers=headers
+        )
+        self.assertStatus(response, 200)
+        self.assertEqual(response.data, b"")
+
+    @requests_mock.mock()
+    def test_search_cached_until_instruments_change(self, mock_request):
+        mock_request.get(survey_url, status_code=200, json=survey_response_json)
+        url = "/collection-instrument-api/1.0.2/collectioninstrument?searchString="
+
+        # Given a search by survey has been made
+        first = self.client.get(
+            url + '{"SURVEY_ID": "cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87", "TYPE": "EQ"}',
+            headers=self.get_auth_headers(),
+        )
+        self.assertEqual(first.json, [])
+
+        # When an instrument is added behind the service's back and the search is made with its keys reordered
+        self.add_instrument_without_exercise()
+        second = self.client.get(
+            url + '{"TYPE": "EQ", "SURVEY_ID": "cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87"}',
+            headers=self.get_auth_headers(),
+        )
+
+        # Then the cached result is returned
+        self.assertEqual(second.json, [])
+
+        # When an instrument is uploaded for the survey
+        response = self.client.post(
+            "/collection-instrument-api/1.0.2/upload?survey_id=cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87"
+            '&classifiers={"form_type": "0002"}',
+            headers=self.get_auth_headers(),
+            content_type="multipart/form-data",
+        )
+        self.assertStatus(response, 200)
+        third = self.client.get(
+            url + '{"TYPE": "EQ", "SURVEY_ID": "cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87"}',
+            headers=self.get_auth_headers(),
+        )
+
+        # Then the search is run again and finds both
+        self.assertEqual(len(third.json), 2)
+
+    @requests_mock.mock()
+    def test_search_by_exercise_cached_until_linked(self, mock_request):
+        mock_request.post(url_collection_instrument_link_url, status_code=200)
+        url = (
+            "/collection-instrument-api/1.0.2/collectioninstrument"
+            f'?searchString={{"COLLECTION_EXERCISE": "{linked_exercise_id}"}}'
+        )
+
+        # Given a search by exercise has been made
+        self.assertEqual(len(self.client.get(url, headers=self.get_auth_headers()).json), 1)
+
+        # When another instrument is linked to the exercise
+        instrument_id = self.add_instrument_without_exercise()
+        response = self.client.post(
+            f"/collection-instrument-api/1.0.2/link-exercise/{instrument_id}/{linked_exercise_id}",
+            headers=self.get_auth_headers(),
+        )
+        self.assertStatus(response, 200)
+
+        # Then the search finds it
+        self.assertEqual(len(self.client.get(url, headers=self.get_auth_headers()).json), 2)
+
     def test_count_instrument_by_search_string_ru(self):
         # Given an instrument which is in the db
         # When the collection instrument end point is called with a search string
@@ -716,6 +1038,16 @@ class TestCollectionInstrumentView(TestClient):
         self.assertIn("test_ru_ref", response.data.decode())
         self.assertIn("cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87", response.data.decode())
 
+    def test_instrument_summary_json_matches_model_json(self):
+        # Given a SEFT instrument and an EQ instrument without a SEFT file or exercise
+        eq_instrument_id = self.add_instrument_without_exercise()
+
+        # When their json is built from a projection and from the model
+        # Then they are the same
+        for instrument_id in (self.instrument_id, eq_instrument_id):
+            with self.subTest(instrument_id=instrument_id):
+                self.assertEqual(*self.summary_and_model_json(instrument_id))
+
     def test_get_instrument_by_id_no_instrument(self):
         # Given an instrument which doesn't exist
         missing_instrument_id = "ffb8a5e8-03ef-45f0-a85a-3276e98f66b8"
@@ -740,6 +1072,44 @@ class TestCollectionInstrumentView(TestClient):
         self.assertStatus(response, 404)
         self.assertEqual(response.data.decode(), COLLECTION_INSTRUMENT_NOT_FOUND)
 
+    def test_get_instruments_by_ids(self):
+        # Given two instruments in the db and one which doesn't exist
+        eq_instrument_id = self.add_instrument_without_exercise()
+        missing_instrument_id = "ffb8a5e8-03ef-45f0-a85a-3276e98f66b8"
+
+        # When the batch end point is called with their ids
+        response = self.client.post(
+            "/collection-instrument-api/1.0.2/collectioninstrument/batch",
+            headers=self.get_auth_headers(),
+            json={"ids": [str(self.instrument_id), str(eq_instrument_id), missing_instrument_id]},
+        )
+
+        # Then the instruments that exist are returned keyed by id, and the missing one is listed
+        self.assertStatus(response, 200)
+        instruments = response.json["instruments"]
+        self.assertEqual(set(instruments), {str(self.instrument_id), str(eq_instrument_id)})
+        self.assertEqual(instruments[str(self.instrument_id)]["businesses"], ["test_ru_ref"])
+        self.assertEqual(instruments[str(self.instrument_id)]["exercises"], [linked_exercise_id])
+        self.assertEqual(instruments[str(eq_instrument_id)]["type"], "EQ")
+        self.assertEqual(response.json["not_found"], [missing_instrument_id])
+
+    def test_get_instruments_by_ids_invalid(self):
+        url = "/collection-instrument-api/1.0.2/collectioninstrument/batch"
+        for payload, error in [
+            ({}, "A non empty list of ids is required"),
+            ({"ids": []}, "A non empty list of ids is required"),
+            ({"ids": [1]}, "Instrument ids must be strings"),
+            ({"ids": ["not-a-uuid"]}, "Value is not a valid UUID (not-a-uuid)"),
+            ({"ids": [str(self.instrument_id)] * 501}, "No more than 500 ids can be given"),
+        ]:
+            with self.subTest(payload=payload):
+                # When the batch end point is called with an invalid payload
+                response = self.client.post(url, headers=self.get_auth_headers(), json=payload)
+
+                # Then it is rejected
+                self.assertStatus(response, 400)
+                self.assertEqual(response.json["errors"], [error])
+
     def test_download_exercise_csv_missing(self):
         # Given a incorrect exercise id
         # When a call is made to the download_csv end point
@@ -765,6 +1135,55 @@ class TestCollectionInstrumentView(TestClient):
         # Then the response returns a 404
         self.assertStatus(response, 404)
 
+    def test_get_exercise_manifest(self):
+        # Given an exercise with a SEFT instrument and an EQ instrument that has a CIR version selected
+        eq_instrument_id = self.add_eq_instrument_to_exercise(linked_exercise_id)
+        self.add_registry_instrument(linked_exercise_id, eq_instrument_id, "0002")
+        statements = []
+
+        def record_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.app.db, "before_cursor_execute", record_statement)
+
+        # When the manifest end point is called for the exercise
+        try:
+            response = self.client.get(
+                f"/collection-instrument-api/1.0.2/manifest/collection-exercise/{linked_exercise_id}",
+                headers=self.get_auth_headers(),
+            )
+        finally:
+            event.remove(self.app.db, "before_cursor_execute", record_statement)
+
+        # Then both instruments are returned, the EQ one with its selection, from a fixed number of queries
+        self.assertStatus(response, 200)
+        manifest = response.json
+        self.assertEqual(manifest["exercise_id"], linked_exercise_id)
+        self.assertEqual(manifest["registry_instrument_count"], 1)
+        instruments = {instrument["type"]: instrument for instrument in manifest["instruments"]}
+        self.assertEqual(instruments["SEFT"]["id"], str(self.instrument_id))
+        self.assertEqual(instruments["SEFT"]["file_name"], "test_file")
+        self.assertEqual(instruments["SEFT"]["len"], 999)
+        self.assertEqual(instruments["SEFT"]["businesses"], ["test_ru_ref"])
+        self.assertIsNone(instruments["SEFT"]["registry_instrument"])
+        self.assertEqual(instruments["EQ"]["file_name"], "0002")
+        self.assertEqual(instruments["EQ"]["businesses"], ["eq_ru_ref"])
+        self.assertEqual(instruments["EQ"]["registry_instrument"]["classifier_value"], "0002")
+        self.assertEqual(instruments["EQ"]["registry_instrument"]["ci_version"], 3)
+        self.assertEqual(len(statements), 4)
+
+    def test_get_exercise_manifest_missing_exercise(self):
+        # Given an exercise which doesn't exist
+        # When the manifest end point is called for it
+        response = self.client.get(
+            "/collection-instrument-api/1.0.2/manifest/collection-exercise/d10711c3-0ac8-41d3-ae0e-567e5ea1ef87",
+            headers=self.get_auth_headers(),
+        )
+
+        # Then the exercise is not found
+        self.assertStatus(response, 404)
+        self.assertEqual(response.data.decode(), NO_INSTRUMENT_FOR_EXERCISE)
+
     def test_ras_error_in_session(self):
         # Given an upload file and a patched survey_id response which returns a RasError
         data = {"file": (BytesIO(b"test data"), "test.xls")}
@@ -1042,7 +1461,7 @@ class TestCollectionInstrumentView(TestClient):
     def test_patch_collection_instrument_gcs(self, mock_request, mock_bucket):
         mock_request.get(survey_url, status_code=200, json=survey_response_json)
 
-        mock_bucket.return_value.upload_file_to_bucket.return_value = "file_path.xlsx"
+        mock_bucket.return_value.upload_file_to_bucket.return_value = seft_file_digest
         # When patch call made
         data = {"file": (BytesIO(b"test data"), "test.xls")}
 
@@ -1055,6 +1474,47 @@ class TestCollectionInstrumentView(TestClient):
 
         self.assertStatus(response, 200)
         self.assertEqual(response.data.decode(), "The patch of the instrument was successful")
+        mock_bucket.return_value.upload_file_to_bucket.assert_called_once()
+        self.assertEqual(
+            mock_bucket.return_value.upload_file_to_bucket.call_args.kwargs["expected_digest"],
+            digest_file(BytesIO(b"test data"), 1024),
+        )
+
+    @requests_mock.mock()
+    @mock.patch("application.controllers.collection_instrument.GoogleCloudSEFTCIBucket")
+    def test_patch_collection_instrument_unchanged_file_not_reuploaded(self, mock_request, mock_bucket):
+        mock_request.get(survey_url, status_code=200, json=survey_response_json)
+        # Given the instrument's file was uploaded as test.xls with the content being patched
+        self.set_seft_file(self.instrument_id, "test.xls", digest_file(BytesIO(b"test data"), 1024))
+
+        # When the same file is patched again
+        data = {"file": (BytesIO(b"test data"), "test.xls")}
+        response = self.client.patch(
+            f"/collection-instrument-api/1.0.2/{self.instrument_id}",
+            data=data,
+            content_type="multipart/form-data",
+            headers=self.get_auth_headers(),
+        )
+
+        # Then the patch succeeds without touching the bucket
+        self.assertStatus(response, 200)
+        mock_bucket.return_value.delete_file_from_bucket.assert_not_called()
+        mock_bucket.return_value.upload_file_to_bucket.assert_not_called()
+
+    @staticmethod
+    @with_db_session
+    def set_seft_file(instrument_id, file_name, digest, session=None):
+        seft_file = session.query(SEFTModel).filter(SEFTModel.instrument_id == instrument_id).one()
+        seft_file.file_name = file_name
+        seft_file.len = digest.length
+        seft_file.crc32c = digest.crc32c
+        seft_file.md5_hash = digest.md5_hash
+
+    @staticmethod
+    @with_db_session
+    def summary_and_model_json(instrument_id, session=None):
+        (summary,) = query_instrument_summaries_by_ids([instrument_id], session)
+        return summary.json, query_instrument_by_id(instrument_id, session).json
 
     @staticmethod
     @with_db_session
@@ -1077,6 +1537,32 @@ class TestCollectionInstrumentView(TestClient):
         session.add(collection_exercise)
         return collection_exercise
 
+    @staticmethod
+    @with_db_session
+    def add_eq_instrument_to_exercise(exercise_id, session=None):
+        instrument = InstrumentModel(ci_type="EQ", classifiers={"form_type": "0002", "geography": "EN"})
+        instrument.survey = session.query(SurveyModel).first()
+        instrument.businesses.append(BusinessModel(ru_ref="eq_ru_ref"))
+        instrument.exercises.append(session.query(ExerciseModel).filter(ExerciseModel.exercise_id == exercise_id).one())
+        session.add(instrument)
+        return instrument.instrument_id
+
+    @staticmethod
+    @with_db_session
+    def add_registry_instrument(exercise_id, instrument_id, form_type, session=None):
+        session.add(
+            RegistryInstrumentModel(
+                survey_id="cb0711c3-0ac8-41d3-ae0e-567e5ea1ef87",
+                exercise_id=exercise_id,
+                instrument_id=instrument_id,
+                classifier_type="form_type",
+                classifier_value=form_type,
+                ci_version=3,
+                guid="c046861a-0df7-443a-a963-d9aa3bddf328",
+                published_at=datetime(2024, 1, 1),
+            )
+        )
+
     @staticmethod
     @with_db_session
     def add_instrument_data(session=None, ci_type="SEFT"):
@@ -0,0 +1,99 @@
+import gzip
+import json
+from pathlib import Path
+from unittest.mock import patch
+
+import brotli
+from flask import current_app
+from prometheus_client import REGISTRY
+
+from tests.test_client import TestClient, api_root, exercise_id
+
+
+class TestCompression(TestClient):
+    """Response compression unit tests"""
+
+    def setUp(self):
+        with open(Path(__file__).parent.parent / "test_data" / "registry_instruments.json") as f:
+            # Plenty of registry instruments to be over the compression threshold
+            self.registry_instruments = json.load(f) * 20
+        patcher = patch(
+            "application.views.registry_instrument_view.RegistryInstrument.get_by_exercise_id",
+            return_value=self.registry_instruments,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = f"{api_root}/registry-instrument/exercise-id/{exercise_id}"
+
+    def test_gzip(self):
+        # Given a client which accepts gzip
+        before_responses = self.sample("ras_ci_http_compressed_responses_total")
+        before_saved = self.bytes_saved()
+
+        # When a large JSON response is requested
+        response = self.client.get(self.url, headers={**self.get_auth_headers(), "Accept-Encoding": "gzip"})
+
+        # Then it is gzipped, with a weak ETag, and the bytes saved are counted
+        self.assertStatus(response, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertTrue(response.headers["ETag"].startswith("W/"))
+        original = gzip.decompress(response.data)
+        self.assertEqual(json.loads(original), self.registry_instruments)
+        self.assertEqual(self.sample("ras_ci_http_compressed_responses_total"), before_responses + 1)
+        self.assertEqual(self.bytes_saved(), before_saved + len(original) - len(response.data))
+
+        # And the weak ETag still revalidates
+        response = self.client.get(
+            self.url,
+            headers={
+                **self.get_auth_headers(),
+                "Accept-Encoding": "gzip",
+                "If-None-Match": response.headers["ETag"],
+            },
+        )
+        self.assertStatus(response, 304)
+
+    def test_brotli_preferred(self):
+        response = self.client.get(self.url, headers={**self.get_auth_headers(), "Accept-Encoding": "gzip, br"})
+
+        self.assertStatus(response, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(json.loads(brotli.decompress(response.data)), self.registry_instruments)
+
+    def test_not_compressed_when_not_accepted(self):
+        response = self.client.get(self.url, headers=self.get_auth_headers())
+
+        self.assertStatus(response, 200)
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.json, self.registry_instruments)
+
+    def test_not_compressed_below_threshold(self):
+        # Given the threshold is larger than the response
+        current_app.config["RESPONSE_COMPRESSION_MIN_SIZE"] = 1024 * 1024
+        self.addCleanup(current_app.config.update, RESPONSE_COMPRESSION_MIN_SIZE=1024)
+
+        response = self.client.get(self.url, headers={**self.get_auth_headers(), "Accept-Encoding": "gzip"})
+
+        self.assertStatus(response, 200)
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_streamed_response_not_compressed(self):
+        # Given a streamed NDJSON search, when a client accepting gzip requests it
+        response = self.client.get(
+            f"{api_root}/collectioninstrument",
+            headers={**self.get_auth_headers(), "Accept-Encoding": "gzip", "Accept": "application/x-ndjson"},
+        )
+
+        # Then it is sent as it's produced, uncompressed
+        self.assertStatus(response, 200)
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    @staticmethod
+    def sample(name, encoding="gzip"):
+        return REGISTRY.get_sample_value(name, {"encoding": encoding}) or 0
+
+    def bytes_saved(self, encoding="gzip"):
+        return self.sample("ras_ci_http_response_compression_original_bytes_total", encoding) - self.sample(
+            "ras_ci_http_response_compression_compressed_bytes_total", encoding
+        )
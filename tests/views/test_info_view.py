@@ -1,5 +1,6 @@
 from unittest.mock import mock_open, patch
 
+from application.warm_up import WARM_UP, WarmUp
 from tests.test_client import TestClient
 
 
@@ -18,3 +19,43 @@ class TestInfoView(TestClient):
             self.assertIn("origin", response.data.decode())
             self.assertIn("name", response.data.decode())
             self.assertIn("version", response.data.decode())
+
+    def test_info_reads_git_info_once(self):
+        with patch("os.path.exists", return_value=True), patch(
+            "builtins.open", mock_open(read_data='{"origin": "test"}')
+        ) as mock_file:
+            self.client.get("/info")
+            response = self.client.get("/info")
+
+        self.assertEqual(response.json["origin"], "test")
+        mock_file.assert_called_once_with("git_info")
+
+    def test_liveness(self):
+        response = self.client.get("/health/live")
+
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json, {"status": "UP"})
+
+    def test_readiness(self):
+        # Given the application has warmed up, when its readiness is checked
+        response = self.client.get("/health/ready")
+
+        # Then it's ready, and its pool and caches are reported
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json["status"], "UP")
+        self.assertEqual(response.json["warm_up"]["state"], "ready")
+        self.assertEqual(response.json["database_pool"]["size"], self.app.db.pool.size())
+        self.assertEqual(response.json["database_pool"]["overflow"], 0)
+        self.assertIsNone(response.json["invalidation_listener"])
+        self.assertEqual(response.json["caches"], {"search_results": 0, "survey_details": 0})
+
+    def test_not_ready_until_warmed_up(self):
+        # Given the application hasn't finished warming up
+        self.app.extensions[WARM_UP] = WarmUp(self.app)
+
+        # When its readiness is checked, then it's reported as not ready
+        response = self.client.get("/health/ready")
+
+        self.assertStatus(response, 503)
+        self.assertEqual(response.json["status"], "DOWN")
+        self.assertEqual(response.json["warm_up"]["state"], "pending")
@@ -0,0 +1,47 @@
+import json
+import unittest
+import uuid
+from datetime import datetime
+
+from flask.json.provider import DefaultJSONProvider
+
+from run import create_app
+
+
+class TestFastJSONProvider(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app("TestingConfig", init_db=False)
+        self.default_provider = DefaultJSONProvider(self.app)
+
+    def test_response_matches_default_provider(self):
+        # Given an instrument like object with UUIDs, a datetime and unsorted keys
+        instrument = {
+            "id": uuid.UUID("ffb8a5e8-03ef-45f0-a85a-3276e98f66b8"),
+            "stamp": datetime(2017, 10, 13, 11, 25, 27, 20468),
+            "classifiers": {"form_type": "0001", "RU_REF": []},
+            "exercises": [uuid.UUID("fb2a9d3a-6e9c-46f6-af5e-5f67fec3c040")],
+            "len": None,
+        }
+
+        for debug in (True, False):
+            with self.subTest(debug=debug):
+                self.app.debug = debug
+
+                # When it's serialised for a response
+                with self.app.app_context():
+                    response = self.app.json.response([instrument])
+
+                # Then it's the same as Flask's default would give, with the datetime as an HTTP date
+                self.assertEqual(response.mimetype, "application/json")
+                self.assertEqual(response.get_data(), self.default_provider.response([instrument]).get_data())
+                self.assertEqual(response.json[0]["stamp"], "Fri, 13 Oct 2017 11:25:27 GMT")
+
+    def test_dumps_falls_back_for_values_orjson_cannot_encode(self):
+        # Given an integer too big for orjson
+        value = {"count": 2**70}
+
+        # When it's serialised, then the default encoder is used
+        self.assertEqual(json.loads(self.app.json.dumps(value)), value)
+
+    def test_loads(self):
+        self.assertEqual(self.app.json.loads(b'{"ids": ["a", "b"]}'), {"ids": ["a", "b"]})
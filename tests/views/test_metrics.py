@@ -0,0 +1,47 @@
+from prometheus_client import REGISTRY
+
+from tests.test_client import TestClient, api_root, exercise_id
+
+route = f"{api_root}/registry-instrument/exercise-id/<exercise_id>"
+labels = {"blueprint": "registry_instrument_view", "route": route, "method": "GET"}
+
+
+class TestMetrics(TestClient):
+    """Request metrics unit tests"""
+
+    def test_request_metrics(self):
+        # Given the request metrics so far
+        before_count = self.sample("ras_ci_http_request_duration_seconds_count", labels)
+        before_ok = self.sample("ras_ci_http_requests_total", {**labels, "status": "200"})
+        before_unauthorised = self.sample("ras_ci_http_requests_total", {**labels, "status": "401"})
+
+        # When a route is requested with and without credentials
+        response = self.client.get(
+            f"{api_root}/registry-instrument/exercise-id/{exercise_id}", headers=self.get_auth_headers()
+        )
+        self.assertStatus(response, 200)
+        response = self.client.get(f"{api_root}/registry-instrument/exercise-id/{exercise_id}")
+        self.assertStatus(response, 401)
+
+        # Then both are timed and counted against the route, by status, and neither is still in flight
+        self.assertEqual(self.sample("ras_ci_http_request_duration_seconds_count", labels), before_count + 2)
+        self.assertEqual(self.sample("ras_ci_http_requests_total", {**labels, "status": "200"}), before_ok + 1)
+        self.assertEqual(
+            self.sample("ras_ci_http_requests_total", {**labels, "status": "401"}), before_unauthorised + 1
+        )
+        self.assertEqual(self.sample("ras_ci_http_requests_in_flight", labels), 0)
+
+    def test_metrics_endpoint(self):
+        self.client.get(f"{api_root}/registry-instrument/exercise-id/{exercise_id}", headers=self.get_auth_headers())
+
+        response = self.client.get("/metrics")
+
+        self.assertStatus(response, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        self.assertIn('ras_ci_http_request_duration_seconds_bucket{blueprint="registry_instrument_view"', response.text)
+        # The service endpoints aren't measured
+        self.assertNotIn('route="/metrics"', response.text)
+
+    @staticmethod
+    def sample(name, sample_labels):
+        return REGISTRY.get_sample_value(name, sample_labels) or 0
@@ -4,7 +4,14 @@ from pathlib import Path
 from unittest.mock import patch
 
 from flask import current_app
+from sqlalchemy import update
 
+from application.controllers.session_decorator import with_db_session
+from application.models.models import (
+    InstrumentModel,
+    RegistryInstrumentCountModel,
+    RegistryInstrumentModel,
+)
 from tests.test_client import TestClient
 
 api_root = "/collection-instrument-api/1.0.2"
@@ -191,6 +198,310 @@ class TestRegistryInstrumentView(TestClient):
             self.assertIn("Invalid JSON payload", response.data.decode())
             self.assertEqual(response.headers["Content-Type"], "text/html; charset=utf-8")
 
+    def test_put_registry_instruments_creates_then_updates(self):
+        # Given the instruments the registry instruments refer to exist
+        with open(Path(__file__).parent.parent / "test_data" / "registry_instruments.json") as f:
+            body = json.load(f)
+        self.add_instruments([registry_instrument["instrument_id"] for registry_instrument in body])
+        url = f"{api_root}/registry-instrument/bulk/exercise-id/{exercise_id}"
+
+        # When they are saved in bulk
+        response = self.client.put(url, data=json.dumps(body), headers=self.get_auth_headers())
+
+        # Then they are all created
+        self.assertStatus(response, 200)
+        self.assertEqual(response.json["created"], 2)
+        self.assertEqual([result["status"] for result in response.json["registry_instruments"]], ["CREATED", "CREATED"])
+
+        # And when one is saved again with a new version alongside a new form type
+        body[1]["ci_version"] = 4
+        body.append(dict(body[0], classifier_value="0003"))
+        response = self.client.put(url, data=json.dumps(body[1:]), headers=self.get_auth_headers())
+
+        # Then the existing one is updated and the new one created
+        self.assertStatus(response, 200)
+        self.assertEqual((response.json["created"], response.json["updated"]), (1, 1))
+        self.assertEqual(
+            [(result["classifier_value"], result["status"]) for result in response.json["registry_instruments"]],
+            [("0002", "UPDATED"), ("0003", "CREATED")],
+        )
+        response = self.client.get(
+            f"{api_root}/registry-instrument/exercise-id/{exercise_id}/formtype/0002", headers=self.get_auth_headers()
+        )
+        self.assertEqual(response.json["ci_version"], 4)
+
+    def test_registry_instrument_count_follows_saves_and_deletes(self):
+        # Given two registry instruments are saved for the exercise
+        with open(Path(__file__).parent.parent / "test_data" / "registry_instruments.json") as f:
+            body = json.load(f)
+        self.add_instruments([registry_instrument["instrument_id"] for registry_instrument in body])
+        self.client.put(
+            f"{api_root}/registry-instrument/bulk/exercise-id/{exercise_id}",
+            data=json.dumps(body),
+            headers=self.get_auth_headers(),
+        )
+        count_url = f"{api_root}/registry-instrument/count/exercise-id/{exercise_id}"
+        self.assertEqual(
+            self.client.get(count_url, headers=self.get_auth_headers()).json, {"registry_instrument_count": 2}
+        )
+
+        # When one is deleted
+        self.client.delete(
+            f"{api_root}/registry-instrument/exercise-id/{exercise_id}/formtype/0001", headers=self.get_auth_headers()
+        )
+
+        # Then the count is kept up to date
+        self.assertEqual(
+            self.client.get(count_url, headers=self.get_auth_headers()).json, {"registry_instrument_count": 1}
+        )
+
+    def test_registry_instrument_count_follows_a_move_to_another_exercise(self):
+        # Given two registry instruments are saved for the exercise
+        other_exercise_id = "5a1f2d3c-4b5a-4c6d-8e7f-9a0b1c2d3e4f"
+        with open(Path(__file__).parent.parent / "test_data" / "registry_instruments.json") as f:
+            body = json.load(f)
+        self.add_instruments([registry_instrument["instrument_id"] for registry_instrument in body])
+        self.client.put(
+            f"{api_root}/registry-instrument/bulk/exercise-id/{exercise_id}",
+            data=json.dumps(body),
+            headers=self.get_auth_headers(),
+        )
+        revisions = self.counter_revisions()
+
+        # When one is moved to another exercise
+        self.move_registry_instrument(exercise_id, "0001", other_exercise_id)
+
+        # Then it's counted against the other exercise instead, and both exercises' revisions go up
+        for moved_exercise_id, expected_count in ((exercise_id, 1), (other_exercise_id, 1)):
+            self.assertEqual(
+                self.client.get(
+                    f"{api_root}/registry-instrument/count/exercise-id/{moved_exercise_id}",
+                    headers=self.get_auth_headers(),
+                ).json,
+                {"registry_instrument_count": expected_count},
+            )
+        moved_revisions = self.counter_revisions()
+        self.assertGreater(moved_revisions[exercise_id], revisions[exercise_id])
+        self.assertGreater(moved_revisions[other_exercise_id], revisions.get(other_exercise_id, 0))
+
+    def test_get_registry_instruments_and_counts_for_exercises(self):
+        # Given two registry instruments are saved for one exercise and none for another
+        other_exercise_id = "5a1f2d3c-4b5a-4c6d-8e7f-9a0b1c2d3e4f"
+        with open(Path(__file__).parent.parent / "test_data" / "registry_instruments.json") as f:
+            body = json.load(f)
+        self.add_instruments([registry_instrument["instrument_id"] for registry_instrument in body])
+        self.client.put(
+            f"{api_root}/registry-instrument/bulk/exercise-id/{exercise_id}",
+            data=json.dumps(body),
+            headers=self.get_auth_headers(),
+        )
+        query = f"exercise_id={exercise_id}&exercise_id={other_exercise_id}"
+
+        # When both exercises are asked for at once
+        counts = self.client.get(
+            f"{api_root}/registry-instrument/count/exercise-ids?{query}", headers=self.get_auth_headers()
+        )
+        selections = self.client.get(
+            f"{api_root}/registry-instrument/exercise-ids?{query}", headers=self.get_auth_headers()
+        )
+
+        # Then each exercise has its own count and selections
+        self.assertStatus(counts, 200)
+        self.assertEqual(counts.json, {"registry_instrument_counts": {exercise_id: 2, other_exercise_id: 0}})
+        self.assertStatus(selections, 200)
+        self.assertEqual(selections.json, {exercise_id: body, other_exercise_id: []})
+
+    def test_get_registry_instrument_counts_without_exercise_ids_returns_400(self):
+        response = self.client.get(
+            f"{api_root}/registry-instrument/count/exercise-ids", headers=self.get_auth_headers()
+        )
+        self.assertStatus(response, 400)
+        self.assertEqual(response.json, {"errors": ["At least one exercise_id is required"]})
+
+    def test_get_registry_instruments_for_exercises_invalid_uuid_returns_400(self):
+        response = self.client.get(
+            f"{api_root}/registry-instrument/exercise-ids?exercise_id={exercise_id}&exercise_id=not-a-uuid",
+            headers=self.get_auth_headers(),
+        )
+        self.assertStatus(response, 400)
+        self.assertEqual(response.json, {"errors": ["Value is not a valid UUID (not-a-uuid)"]})
+
+    def test_get_registry_instruments_etag(self):
+        # Given registry instruments are saved for the exercise
+        with open(Path(__file__).parent.parent / "test_data" / "registry_instruments.json") as f:
+            body = json.load(f)
+        self.add_instruments([registry_instrument["instrument_id"] for registry_instrument in body])
+        bulk_url = f"{api_root}/registry-instrument/bulk/exercise-id/{exercise_id}"
+        self.client.put(bulk_url, data=json.dumps(body), headers=self.get_auth_headers())
+        url = f"{api_root}/registry-instrument/exercise-id/{exercise_id}"
+
+        # When they are fetched, then fetched again with the ETag
+        response = self.client.get(url, headers=self.get_auth_headers())
+        etag = response.headers["ETag"]
+        not_modified = self.client.get(url, headers={**self.get_auth_headers(), "If-None-Match": etag})
+        form_type_not_modified = self.client.get(
+            f"{url}/formtype/0001", headers={**self.get_auth_headers(), "If-None-Match": etag}
+        )
+
+        # Then the first response must be revalidated and the later ones are 304s with no body
+        self.assertStatus(response, 200)
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        self.assertStatus(not_modified, 304)
+        self.assertEqual(not_modified.data, b"")
+        self.assertEqual(not_modified.headers["ETag"], etag)
+        self.assertStatus(form_type_not_modified, 304)
+
+        # And once one of them is updated the old ETag no longer matches
+        body[0]["ci_version"] = 2
+        self.client.put(bulk_url, data=json.dumps(body[:1]), headers=self.get_auth_headers())
+        response = self.client.get(url, headers={**self.get_auth_headers(), "If-None-Match": etag})
+        self.assertStatus(response, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        versions = {
+            registry_instrument["classifier_value"]: registry_instrument["ci_version"]
+            for registry_instrument in response.json
+        }
+        self.assertEqual(versions, {"0001": 2, "0002": 3})
+
+    def test_get_registry_instruments_by_guid_pages_through_exercises(self):
+        # Given three exercises have selected the same CIR version
+        with open(Path(__file__).parent.parent / "test_data" / "registry_instrument.json") as f:
+            body = json.load(f)
+        self.add_instruments([body["instrument_id"]])
+        exercise_ids = sorted(
+            [exercise_id, "5a1f2d3c-4b5a-4c6d-8e7f-9a0b1c2d3e4f", "0c2b4a6d-8e0f-4a1b-9c3d-5e7f9a1b3c5d"]
+        )
+        for selecting_exercise_id in exercise_ids:
+            self.client.put(
+                f"{api_root}/registry-instrument/bulk/exercise-id/{selecting_exercise_id}",
+                data=json.dumps([dict(body, exercise_id=selecting_exercise_id)]),
+                headers=self.get_auth_headers(),
+            )
+        url = f"{api_root}/registry-instrument/guid/{body['guid']}"
+
+        # When they are fetched two at a time
+        first_page = self.client.get(f"{url}?limit=2", headers=self.get_auth_headers())
+        second_page = self.client.get(f"{url}?limit=2&after={first_page.json['next']}", headers=self.get_auth_headers())
+
+        # Then each exercise is returned once, in order, and the last page has no next cursor
+        self.assertStatus(first_page, 200)
+        self.assertStatus(second_page, 200)
+        self.assertEqual(
+            [
+                ri["exercise_id"]
+                for ri in first_page.json["registry_instruments"] + second_page.json["registry_instruments"]
+            ],
+            exercise_ids,
+        )
+        self.assertIsNone(second_page.json["next"])
+        by_instrument_id = self.client.get(
+            f"{api_root}/registry-instrument/instrument-id/{body['instrument_id']}", headers=self.get_auth_headers()
+        )
+        self.assertEqual(len(by_instrument_id.json["registry_instruments"]), 3)
+
+    def test_get_registry_instruments_by_guid_invalid_cursor_returns_400(self):
+        keys = [
+            [1, "form_type", "0001"],
+            [exercise_id, 1, "0001"],
+            [exercise_id, "form_type", None],
+            [exercise_id, "form_type"],
+            [exercise_id, "form_type", "0001", "0002"],
+            {"exercise_id": exercise_id, "classifier_type": "form_type", "classifier_value": "0001"},
+            ["not-a-uuid", "form_type", "0001"],
+        ]
+        cursors = ["not-a-cursor"] + [base64.urlsafe_b64encode(json.dumps(key).encode()).decode() for key in keys]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    f"{api_root}/registry-instrument/guid/c046861a-0df7-443a-a963-d9aa3bddf328?after={cursor}",
+                    headers=self.get_auth_headers(),
+                )
+                self.assertStatus(response, 400)
+                self.assertEqual(response.json, {"errors": ["Invalid cursor"]})
+
+    def test_delete_registry_instruments_for_exercise(self):
+        # Given three registry instruments are saved for the exercise
+        with open(Path(__file__).parent.parent / "test_data" / "registry_instruments.json") as f:
+            body = json.load(f)
+        body.append(dict(body[0], classifier_value="0003"))
+        self.add_instruments({registry_instrument["instrument_id"] for registry_instrument in body})
+        self.client.put(
+            f"{api_root}/registry-instrument/bulk/exercise-id/{exercise_id}",
+            data=json.dumps(body),
+            headers=self.get_auth_headers(),
+        )
+        url = f"{api_root}/registry-instrument/exercise-id/{exercise_id}"
+
+        # When two form types are deleted, then the rest
+        some = self.client.delete(f"{url}?form_type=0001&form_type=0003", headers=self.get_auth_headers())
+        remaining = self.client.get(url, headers=self.get_auth_headers())
+        rest = self.client.delete(url, headers=self.get_auth_headers())
+
+        # Then the number deleted each time is returned
+        self.assertStatus(some, 200)
+        self.assertEqual(some.json, {"deleted": 2})
+        self.assertEqual([ri["classifier_value"] for ri in remaining.json], ["0002"])
+        self.assertEqual(rest.json, {"deleted": 1})
+        count = self.client.get(
+            f"{api_root}/registry-instrument/count/exercise-id/{exercise_id}", headers=self.get_auth_headers()
+        )
+        self.assertEqual(count.json, {"registry_instrument_count": 0})
+
+    def test_delete_registry_instruments_invalid_form_type_returns_400(self):
+        with patch(
+            "application.views.registry_instrument_view.RegistryInstrument.delete_by_exercise_id"
+        ) as mock_delete_by_exercise_id:
+            response = self.client.delete(
+                f"{api_root}/registry-instrument/exercise-id/{exercise_id}?form_type=0001&form_type=abc",
+                headers=self.get_auth_headers(),
+            )
+            self.assertStatus(response, 400)
+            self.assertEqual(response.data.decode(), "Invalid form types: abc")
+            mock_delete_by_exercise_id.assert_not_called()
+
+    def test_put_registry_instruments_invalid_item_returns_400(self):
+        with patch(
+            "application.views.registry_instrument_view.RegistryInstrument.bulk_save_for_exercise_id"
+        ) as mock_bulk_save_for_exercise_id:
+            with open(Path(__file__).parent.parent / "test_data" / "registry_instruments.json") as f:
+                body = json.load(f)
+            body[1]["classifier_value"] = "12"
+            response = self.client.put(
+                f"{api_root}/registry-instrument/bulk/exercise-id/{exercise_id}",
+                data=json.dumps(body),
+                headers=self.get_auth_headers(),
+            )
+            self.assertStatus(response, 400)
+            self.assertEqual(response.json, {"errors": ["Registry instrument 1: Invalid classifier value"]})
+            mock_bulk_save_for_exercise_id.assert_not_called()
+
+    def test_put_registry_instruments_duplicate_form_type_returns_400(self):
+        with patch(
+            "application.views.registry_instrument_view.RegistryInstrument.bulk_save_for_exercise_id"
+        ) as mock_bulk_save_for_exercise_id:
+            with open(Path(__file__).parent.parent / "test_data" / "registry_instruments.json") as f:
+                body = json.load(f)
+            body[1]["classifier_value"] = body[0]["classifier_value"]
+            response = self.client.put(
+                f"{api_root}/registry-instrument/bulk/exercise-id/{exercise_id}",
+                data=json.dumps(body),
+                headers=self.get_auth_headers(),
+            )
+            self.assertStatus(response, 400)
+            self.assertEqual(response.json, {"errors": ["Form type 0001 given more than once"]})
+            mock_bulk_save_for_exercise_id.assert_not_called()
+
+    def test_put_registry_instruments_not_an_array_returns_400(self):
+        with open(Path(__file__).parent.parent / "test_data" / "registry_instrument.json") as f:
+            body = json.load(f)
+        response = self.client.put(
+            f"{api_root}/registry-instrument/bulk/exercise-id/{exercise_id}",
+            data=json.dumps(body),
+            headers=self.get_auth_headers(),
+        )
+        self.assertStatus(response, 400)
+        self.assertEqual(response.data.decode(), "Payload must be a non-empty array of registry instruments")
+
     @patch("application.views.registry_instrument_view.RegistryInstrument.get_count_by_exercise_id")
     def test_registry_instrument_count(self, get_count_by_exercise_id):
         get_count_by_exercise_id.return_value = {"registry_instrument_count": 1}
@@ -201,6 +512,33 @@ class TestRegistryInstrumentView(TestClient):
         self.assertStatus(response, 200)
         self.assertEqual(json.loads(response.data), {"registry_instrument_count": 1})
 
+    @staticmethod
+    @with_db_session
+    def move_registry_instrument(from_exercise_id, form_type, to_exercise_id, session=None):
+        session.execute(
+            update(RegistryInstrumentModel)
+            .where(
+                RegistryInstrumentModel.exercise_id == from_exercise_id,
+                RegistryInstrumentModel.classifier_value == form_type,
+            )
+            .values(exercise_id=to_exercise_id)
+        )
+
+    @staticmethod
+    @with_db_session
+    def counter_revisions(session=None):
+        return {
+            str(counter.exercise_id): counter.revision for counter in session.query(RegistryInstrumentCountModel).all()
+        }
+
+    @staticmethod
+    @with_db_session
+    def add_instruments(instrument_ids, session=None):
+        for instrument_id in instrument_ids:
+            instrument = InstrumentModel(ci_type="EQ")
+            instrument.instrument_id = instrument_id
+            session.add(instrument)
+
     @staticmethod
     def get_auth_headers():
         auth = "{}:{}".format(
@@ -0,0 +1,130 @@
+import re
+
+from flask import current_app
+from prometheus_client import REGISTRY
+from sqlalchemy import event
+
+from application.sql_instrumentation import (
+    comment_statements,
+    instrument_engine,
+    normalise_sql,
+)
+from tests.test_client import TestClient, api_root, exercise_id
+
+labels = {
+    "blueprint": "registry_instrument_view",
+    "route": f"{api_root}/registry-instrument/exercise-id/<exercise_id>",
+    "method": "GET",
+}
+
+
+class TestSQLInstrumentation(TestClient):
+    """SQL instrumentation unit tests"""
+
+    def test_statement_totals_in_headers_and_metrics(self):
+        # Given the per request statement metrics so far
+        before = REGISTRY.get_sample_value("ras_ci_db_statements_per_request_sum", labels) or 0
+
+        # When a route is requested twice
+        counts = []
+        for _ in range(2):
+            response = self.client.get(
+                f"{api_root}/registry-instrument/exercise-id/{exercise_id}", headers=self.get_auth_headers()
+            )
+            self.assertStatus(response, 200)
+            counts.append(int(response.headers["X-DB-Statement-Count"]))
+            self.assertGreater(float(response.headers["X-DB-Time-Ms"]), 0)
+
+        # Then each response has the request's own totals, rather than a running total
+        self.assertGreater(counts[0], 0)
+        self.assertEqual(counts[0], counts[1])
+
+        # And they're recorded against the route
+        self.assertEqual(
+            REGISTRY.get_sample_value("ras_ci_db_statements_per_request_sum", labels), before + sum(counts)
+        )
+
+    def test_no_headers_unless_configured(self):
+        current_app.config["SQL_STATS_HEADERS"] = False
+
+        response = self.client.get(
+            f"{api_root}/registry-instrument/exercise-id/{exercise_id}", headers=self.get_auth_headers()
+        )
+
+        self.assertStatus(response, 200)
+        self.assertNotIn("X-DB-Statement-Count", response.headers)
+
+    def test_slow_statement_logged_with_route(self):
+        # Given every statement is slow
+        instrument_engine(self.app.db, slow_statement_ms=0)
+
+        # When a route is requested, then its statement is logged, normalised, with the route
+        with self.assertLogs("application.sql_instrumentation", level="WARNING") as logs:
+            self.client.get(
+                f"{api_root}/registry-instrument/exercise-id/{exercise_id}", headers=self.get_auth_headers()
+            )
+
+        output = "\n".join(logs.output)
+        self.assertIn("Slow database statement", output)
+        self.assertIn(labels["route"], output)
+        self.assertIn("registry_instrument.exercise_id = ?", output)
+
+    def test_statements_tagged_with_route_controller_and_request_id(self):
+        # Given statements are tagged
+        comment_statements(self.app.db)
+        statements = []
+        event.listen(
+            self.app.db, "after_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement)
+        )
+
+        # When a route is requested with a request id
+        response = self.client.get(
+            f"{api_root}/registry-instrument/exercise-id/{exercise_id}",
+            headers={**self.get_auth_headers(), "X-Request-ID": "abc-123"},
+        )
+
+        # Then its statements say where they came from, and the request id is returned
+        self.assertStatus(response, 200)
+        self.assertEqual(response.headers["X-Request-ID"], "abc-123")
+        self.assertTrue(statements)
+        tags = rf" /\* route={re.escape(labels['route'])}, controller=RegistryInstrument\.\w+, request_id=abc-123 \*/$"
+        for statement in statements:
+            self.assertRegex(statement, tags)
+        self.assertIn("controller=RegistryInstrument.get_by_exercise_id,", statements[-1])
+
+    def test_request_id_cannot_break_out_of_the_comment(self):
+        comment_statements(self.app.db)
+        statements = []
+        event.listen(
+            self.app.db, "after_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement)
+        )
+
+        response = self.client.get(
+            f"{api_root}/registry-instrument/exercise-id/{exercise_id}",
+            headers={**self.get_auth_headers(), "X-Request-ID": "x */ DROP TABLE instrument; %s /*"},
+        )
+
+        self.assertStatus(response, 200)
+        self.assertEqual(response.headers["X-Request-ID"], "xDROPTABLEinstruments")
+        self.assertTrue(all(statement.count("*/") == 1 for statement in statements))
+
+    def test_request_id_made_up_when_not_sent(self):
+        comment_statements(self.app.db)
+
+        response = self.client.get(
+            f"{api_root}/registry-instrument/exercise-id/{exercise_id}", headers=self.get_auth_headers()
+        )
+
+        self.assertEqual(len(response.headers["X-Request-ID"]), 32)
+
+    def test_normalise_sql(self):
+        statement = """SELECT instrument.id
+            FROM ras_ci.instrument
+            WHERE instrument.instrument_id IN (%(id_1_1)s, %(id_1_2)s, %(id_1_3)s) AND type = 'SEFT' LIMIT 10
+            /* route=/collection-instrument-api/1.0.2/<instrument_id>, request_id=abc-123 */"""
+
+        self.assertEqual(
+            normalise_sql(statement),
+            "SELECT instrument.id FROM ras_ci.instrument "
+            "WHERE instrument.instrument_id IN (?, ...) AND type = ? LIMIT ?",
+        )